@@ -9,8 +9,11 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+# Django's handler, streaming responses that read the database from a worker thread
+from dmsapi.handlers import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dms.settings')
+# Connections are not kept across requests without the pool, see settings
+os.environ['DMSAPI_ASGI'] = '1'
 
 application = get_asgi_application()
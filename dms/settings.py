@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import dj_database_url
 import django_heroku
 import os
 from pathlib import Path
@@ -45,7 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'dmsapi.middleware.metrics_middleware',
+    'dmsapi.middleware.query_instrumentation_middleware',
     'django.middleware.security.SecurityMiddleware',
+    'dmsapi.middleware.replica_stickiness_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -60,6 +64,73 @@ REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
 
+# Read-through cache of the folder/document/topic detail payloads.
+# BACKEND is 'lru' (per worker process) or 'django' (the CACHES alias named
+# by ALIAS, shared between workers). Set to None to disable.
+#
+# A write only drops the 'lru' entries of the worker serving it, so 'lru' is
+# for single-process servers. With several workers (WEB_CONCURRENCY) the
+# cache is off unless BACKEND is 'django' on a cache they all reach, such as
+# memcached or redis.
+DMSAPI_DETAIL_CACHE = {
+    'BACKEND': os.environ.get('DMSAPI_DETAIL_CACHE_BACKEND', 'lru'),
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'ALIAS': 'default',
+}
+if DMSAPI_DETAIL_CACHE['BACKEND'] == 'lru' and int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+    DMSAPI_DETAIL_CACHE = None
+
+# Where document bodies are stored. BACKEND is 'inline' (Document.content)
+# or 'blob' (deduplicated ContentBlob rows compressed with CODEC, 'zlib' or
+# 'zstd', for bodies of at least MIN_SIZE bytes). Existing rows are moved
+# with `manage.py migrate_document_content`.
+DMSAPI_CONTENT_STORAGE = {
+    'BACKEND': os.environ.get('DMSAPI_CONTENT_STORAGE_BACKEND', 'inline'),
+    'CODEC': os.environ.get('DMSAPI_CONTENT_CODEC', 'zlib'),
+    'LEVEL': 6,
+    'MIN_SIZE': 256,
+}
+
+# Background jobs, run by `manage.py runjobs`. Running jobs that sent no
+# heartbeat for STALE_AFTER seconds are taken over by another worker, failed
+# jobs are retried up to MAX_ATTEMPTS times with exponential backoff.
+DMSAPI_JOBS = {
+    'STALE_AFTER': 300,
+    'RETRY_DELAY': 10,
+    'MAX_ATTEMPTS': 3,
+}
+
+# Serve GET requests of the list, detail and topic lookup endpoints with
+# async views (dmsapi.async_views). Only for ASGI, under WSGI every async
+# view would need an event loop of its own. Off by default, as they answer
+# fewer requests per second than the sync views so far (manage.py bench).
+DMSAPI_ASYNC_READS = os.environ.get('DMSAPI_ASYNC_READS', '').lower() in ('1', 'true')
+
+# Per-request query count, DB time and duplicate queries, reported in a
+# Server-Timing header and logged by dmsapi.instrumentation, as a warning for
+# requests slower than SLOW_REQUEST_MS. Views over their query_budget fail
+# when RAISE_ON_BUDGET is set, and in the test suite.
+DMSAPI_INSTRUMENTATION = {
+    'ENABLED': os.environ.get('DMSAPI_INSTRUMENTATION', '1').lower() in ('1', 'true'),
+    'SLOW_REQUEST_MS': int(os.environ.get('DMSAPI_SLOW_REQUEST_MS', 500)),
+    'RAISE_ON_BUDGET': False,
+}
+
+# Request duration histograms, in-flight gauges, status code, query and
+# detail cache counters served at /metrics in the Prometheus text format.
+# Workers of a multi-process server need a DIRECTORY they all write to,
+# emptied before the server starts.
+DMSAPI_METRICS = {
+    'ENABLED': os.environ.get('DMSAPI_METRICS', '1').lower() in ('1', 'true'),
+    'DIRECTORY': os.environ.get('DMSAPI_METRICS_DIR') or None,
+}
+
+# OpenAPI document served by the API docs, written at build time by
+# `manage.py generate_schema`. Without it the document is generated on the
+# first request of each worker. Regenerate it whenever the API changes.
+DMSAPI_SCHEMA_FILE = os.environ.get('DMSAPI_SCHEMA_FILE') or None
+
 ROOT_URLCONF = 'dms.urls'
 
 TEMPLATES = [
@@ -95,6 +166,60 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, given as comma separated database
+# URLs in DATABASE_REPLICA_URLS (e.g. sqlite:////tmp/replica.db to try it
+# locally). The list, detail and topic lookup endpoints read from a random
+# replica lagging by at most MAX_LAG seconds, everything else and the
+# clients that wrote in the last STICKY_SECONDS use the primary.
+DMSAPI_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 5,
+    'MAX_LAG': 2,
+    'CHECK_INTERVAL': 5,
+}
+for index, url in enumerate(url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()):
+    alias = 'replica%d' % (index + 1)
+    DATABASES[alias] = {**dj_database_url.parse(url.strip()), 'TEST': {'MIRROR': 'default'}}
+    DMSAPI_REPLICAS['ALIASES'].append(alias)
+DATABASE_ROUTERS = ['dmsapi.routers.ReplicaRouter']
+
+# How connections to the default database and its replicas are kept.
+#
+# By default Django keeps one connection per thread for DB_CONN_MAX_AGE
+# seconds, checked before each request (CONN_HEALTH_CHECKS). Under ASGI
+# (dms/asgi.py sets DMSAPI_ASGI) requests do not map to threads, so such
+# connections are never reused and CONN_MAX_AGE is forced to 0 instead.
+#
+# With DMSAPI_DB_POOL set, connections to PostgreSQL go back at the end of
+# each request to a pool shared by the threads of the process, which suits
+# ASGI. POOL limits the connections per process (MAX_SIZE), how long idle
+# ones are kept (MAX_IDLE, seconds) and checks those idle for more than
+# CHECK_AFTER seconds before reuse. Pool counters are served at
+# /api/db/pool.
+#
+# Applied at the end of this file, after django_heroku has set up DATABASES.
+if os.environ.get('DMSAPI_DB_POOL', '').lower() in ('1', 'true'):
+    DATABASE_CONNECTIONS = {
+        'ENGINE': 'dmsapi.db.postgresql',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DMSAPI_DB_POOL_MAX_SIZE', 20)),
+            'MAX_IDLE': int(os.environ.get('DMSAPI_DB_POOL_MAX_IDLE', 300)),
+            'MAX_LIFETIME': 3600,
+            'TIMEOUT': 10,
+            'CHECK_AFTER': 30,
+        },
+    }
+elif os.environ.get('DMSAPI_ASGI') == '1':
+    DATABASE_CONNECTIONS = {
+        'CONN_MAX_AGE': 0,
+    }
+else:
+    DATABASE_CONNECTIONS = {
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -137,4 +262,8 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-django_heroku.settings(locals())
\ No newline at end of file
+django_heroku.settings(locals())
+# django_heroku replaces the default database when DATABASE_URL is set
+for alias in ['default'] + DMSAPI_REPLICAS['ALIASES']:
+    if DATABASES[alias]['ENGINE'].startswith('django.db.backends.postgresql') or 'ENGINE' not in DATABASE_CONNECTIONS:
+        DATABASES[alias].update(DATABASE_CONNECTIONS)
\ No newline at end of file
@@ -0,0 +1,167 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_detail_cache
+from .conditional import aaggregate_validators, aload_detail_validators, atag_state, detail_validators, is_conditional, validator_fields
+from .fieldsets import detail_columns, list_values, requested_fields
+from .models import Folder, Document, Topic, FolderTopic, DocumentTopic
+from .routers import is_replica, replica_reads
+from .serializers import FolderSerializer, DocumentSerializer, TopicSerializer
+from .storage import aload_content
+
+
+# Query parameters handled by the DRF paginator or the streaming responses,
+# requests using them are served by the sync views
+SYNC_PARAMETERS = ('stream', 'limit', 'cursor')
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    # Same bytes as the JSON renderer of the DRF views
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+    response['Vary'] = 'Accept'
+    return response
+
+def is_async_read(request):
+    """
+    Whether the async path covers ``request``: a GET for JSON without the
+    parameters that need the DRF stack. Browsers get the browsable API.
+    """
+    return (
+        request.method == 'GET'
+        and 'text/html' not in request.headers.get('Accept', '')
+        and not any(name in request.GET for name in SYNC_PARAMETERS)
+    )
+
+def read_view(view_class, read, async_reads=None):
+    """
+    The view of ``view_class``, with its GET requests served by the
+    coroutine ``read`` when async reads are enabled (``DMSAPI_ASYNC_READS``,
+    for ASGI deployments). Every other request goes to the DRF view, which
+    Django runs in a worker thread.
+    """
+    view = view_class.as_view()
+    if async_reads is None:
+        async_reads = getattr(settings, 'DMSAPI_ASYNC_READS', False)
+    if not async_reads:
+        return view
+    fallback = sync_to_async(view)
+
+    async def dispatch(request, *args, **kwargs):
+        if not is_async_read(request):
+            return await fallback(request, *args, **kwargs)
+        try:
+            with replica_reads():
+                return await read(request, *args, **kwargs)
+        except ValidationError as error:
+            return json_response(error.detail, status.HTTP_400_BAD_REQUEST)
+
+    # Keeps the endpoint in the generated schema and out of the CSRF checks,
+    # which DRF makes for session authenticated requests itself
+    dispatch.cls = view.cls
+    dispatch.initkwargs = view.initkwargs
+    dispatch.csrf_exempt = True
+    return dispatch
+
+
+async def alist_response(request, queryset, *parts):
+    validators = await aaggregate_validators(request, queryset, *parts)
+    not_modified = validators.conditional_response(request)
+    if not_modified is not None:
+        return not_modified
+    return validators.apply(json_response([row async for row in queryset]))
+
+async def aget_all(request, model, serializer_class):
+    data = list_values(model.objects.all(), requested_fields(request, serializer_class, listing=True))
+    return await alist_response(request, data)
+
+async def aget_one(request, id, model, serializer_class, fields=None):
+    """
+    Async counterpart of ``views.get_one()``. Cache hits are served without
+    touching the database.
+    """
+    cache = get_detail_cache()
+    missed_at = time.time()
+    data = cache.get(model, id)
+    parts = () if fields is None else (",".join(fields),)
+
+    if data is None and is_conditional(request):
+        try:
+            validators = await aload_detail_validators(model, id, serializer_class, *parts)
+        except model.DoesNotExist:
+            return json_response(None, status.HTTP_404_NOT_FOUND)
+        not_modified = validators.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+
+    if data is None:
+        loaded = None if fields is None else set(fields) | set(validator_fields(model))
+        queryset = model.objects.all() if loaded is None else model.objects.only(*detail_columns(model, loaded))
+        try:
+            obj = await queryset.aget(id=id)
+        except model.DoesNotExist:
+            return json_response(None, status.HTTP_404_NOT_FOUND)
+        if model == Document:
+            await aload_content(obj)
+        data = dict(serializer_class(obj, fields=loaded).data)
+        if fields is None:
+            cache.set(model, id, data, missed_at, from_replica=is_replica(obj._state.db))
+
+    validators = detail_validators(model, id, data, *parts)
+    not_modified = validators.conditional_response(request)
+    if not_modified is not None:
+        return not_modified
+
+    if fields is not None:
+        data = {name: data[name] for name in fields}
+    return validators.apply(json_response(data))
+
+async def atopic_list(request, model, serializer_class, relation, tags, folder_name=None):
+    topic_name = request.GET.get("topic_name", None)
+    if topic_name is None:
+        return json_response([{"message": "Parameter 'topic_name' is required"}], status.HTTP_400_BAD_REQUEST)
+
+    try:
+        topic_id = await Topic.objects.values_list("id", flat=True).aget(name=topic_name)
+    except Topic.DoesNotExist:
+        return json_response(None, status.HTTP_404_NOT_FOUND)
+    if folder_name is not None and not await Folder.objects.filter(name=folder_name).aexists():
+        return json_response(None, status.HTTP_404_NOT_FOUND)
+
+    rows = list_values(model.objects.filter(**{relation: topic_id}), requested_fields(request, serializer_class, listing=True))
+    if folder_name is not None:
+        rows = rows.filter(parent__name=folder_name)
+    return await alist_response(request, rows, *await atag_state(tags, topic_id))
+
+
+async def folder_list(request):
+    return await aget_all(request, Folder, FolderSerializer)
+
+async def folder_details(request, id):
+    return await aget_one(request, id, Folder, FolderSerializer, requested_fields(request, FolderSerializer))
+
+async def document_list(request):
+    return await aget_all(request, Document, DocumentSerializer)
+
+async def document_details(request, id):
+    fields = requested_fields(request, DocumentSerializer)
+    if request.GET.get("content", None) in ('false', '0'):
+        fields = tuple(name for name in fields or DocumentSerializer().fields if name != 'content')
+    return await aget_one(request, id, Document, DocumentSerializer, fields)
+
+async def topic_list(request):
+    return await aget_all(request, Topic, TopicSerializer)
+
+async def topic_details(request, id):
+    return await aget_one(request, id, Topic, TopicSerializer, requested_fields(request, TopicSerializer))
+
+async def topic_folders(request):
+    return await atopic_list(request, Folder, FolderSerializer, 'foldertopic__topic', FolderTopic)
+
+async def topic_documents(request):
+    return await atopic_list(request, Document, DocumentSerializer, 'documenttopic__topic', DocumentTopic, request.GET.get("folder_name", None))
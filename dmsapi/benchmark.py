@@ -0,0 +1,432 @@
+import asyncio
+import json
+import math
+import random
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from . import jobs
+from .handlers import ASGIHandler
+from .models import Folder, Document, Topic, FolderTopic, DocumentTopic
+from .storage import store_content
+from .transfer import DOCUMENT, FOLDER, TreeImporter
+from .tree import update_child_count
+
+
+BENCH_HOST = 'testserver'
+HEADERS = {'HTTP_ACCEPT': 'application/json'}
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of the sorted list ``values``.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(int(round(fraction * len(values))) - 1, 0))]
+
+
+class RunResult:
+    """
+    Latencies (in seconds) and error count of one benchmark run.
+    """
+
+    def __init__(self, mode, clients, latencies, errors, elapsed):
+        self.mode = mode
+        self.clients = clients
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    def summary(self):
+        return {
+            "mode": self.mode,
+            "clients": self.clients,
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "throughput": round(len(self.latencies) / self.elapsed, 1) if self.elapsed else None,
+            **latency_summary(self.latencies),
+        }
+
+
+def latency_summary(latencies):
+    """
+    p50/p95/p99/max in milliseconds of the sorted list ``latencies``.
+    """
+    milliseconds = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        "p50_ms": milliseconds(percentile(latencies, 0.50)),
+        "p95_ms": milliseconds(percentile(latencies, 0.95)),
+        "p99_ms": milliseconds(percentile(latencies, 0.99)),
+        "max_ms": milliseconds(latencies[-1] if latencies else None),
+    }
+
+
+def urlconf(async_reads):
+    from .urls import api_urlpatterns
+
+    module = ModuleType('dmsapi.bench_urls')
+    module.urlpatterns = api_urlpatterns(async_reads)
+    return module
+
+def split_url(url):
+    path, _, query = url.partition('?')
+    return path, query
+
+async def asgi_get(application, url):
+    path, query = split_url(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'headers': [(b'host', BENCH_HOST.encode()), (b'accept', b'application/json')],
+        'server': (BENCH_HOST, 80), 'client': ('127.0.0.1', 0),
+    }
+    received = False
+    messages = []
+
+    async def receive():
+        nonlocal received
+        if received:
+            # Nothing more is sent, the client stays connected
+            await asyncio.Future()
+        received = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+def wsgi_get(application, url):
+    path, query = split_url(url)
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_HOST': BENCH_HOST, **HEADERS}
+    setup_testing_defaults(environ)
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split()[0]))
+
+    response = application(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return statuses[0]
+
+async def drive(get, urls, clients, requests):
+    """
+    Sends ``requests`` GETs cycling through ``urls`` from ``clients``
+    concurrent clients, each sending its next request once the previous one
+    was answered.
+    """
+    latencies = []
+    errors = 0
+    indexes = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for index in indexes:
+            started = time.perf_counter()
+            status = await get(urls[index % len(urls)])
+            latencies.append(time.perf_counter() - started)
+            if status >= 500:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, errors, time.perf_counter() - started
+
+async def run_asgi(urls, clients, requests):
+    application = ASGIHandler()
+    return await drive(lambda url: asgi_get(application, url), urls, clients, requests)
+
+async def run_wsgi(urls, clients, requests, threads):
+    # A threaded WSGI server: requests beyond ``threads`` wait for a thread
+    application = WSGIHandler()
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(threads) as pool:
+        return await drive(lambda url: loop.run_in_executor(pool, wsgi_get, application, url), urls, clients, requests)
+
+def run_concurrency_benchmark(urls, clients, requests, threads=16, modes=('wsgi', 'asgi')):
+    """
+    Serves ``urls`` in-process through the WSGI handler with the sync views
+    and through the ASGI handler with the async read views, at each of the
+    ``clients`` concurrency levels. Returns the summaries of the runs.
+    """
+    results = []
+    hosts = list(settings.ALLOWED_HOSTS) + [BENCH_HOST]
+    for mode in modes:
+        with override_settings(ROOT_URLCONF=urlconf(mode == 'asgi'), ALLOWED_HOSTS=hosts):
+            for count in clients:
+                if mode == 'asgi':
+                    latencies, errors, elapsed = asyncio.run(run_asgi(urls, count, requests))
+                else:
+                    latencies, errors, elapsed = asyncio.run(run_wsgi(urls, count, requests, threads))
+                results.append(RunResult(mode, count, latencies, errors, elapsed).summary())
+    return results
+
+
+WORDS = (
+    "alpha", "beta", "gamma", "delta", "report", "budget", "quarterly", "roadmap", "meeting", "notes",
+    "design", "review", "customer", "invoice", "contract", "policy", "security", "release", "summary", "draft",
+    "planning", "hiring", "onboarding", "training", "migration", "database", "network", "storage", "incident", "metrics",
+)
+MAX_CONTENT_SIZE = 1024 * 1024
+
+
+class Dataset:
+    """
+    Shape of a synthetic dataset: ``folders`` folders below a 'bench' root,
+    all children of it ('wide') or in chains ``depth`` deep ('deep'),
+    ``documents`` documents spread over them with log-normally distributed
+    sizes around ``content_size`` bytes, and ``tags`` folder or document
+    tags over ``topics`` topics, the n-th topic used in proportion to
+    1 / n ** ``skew``.
+    """
+
+    def __init__(self, shape='wide', folders=200, depth=8, documents=1000, content_size=2048, content_sigma=1.0,
+                 topics=20, tags=2000, skew=1.2, seed=0):
+        self.shape = shape
+        self.folders = max(folders, 1)
+        self.depth = max(depth, 1)
+        self.documents = documents
+        self.content_size = max(content_size, 1)
+        self.content_sigma = content_sigma
+        self.topics = max(topics, 1)
+        self.tags = tags
+        self.skew = skew
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def folder_paths(self):
+        root = ('bench',)
+        if self.shape == 'wide':
+            return [root + ('f%d' % index,) for index in range(self.folders)]
+
+        paths = []
+        for chain in range(-(-self.folders // self.depth)):
+            parts = root
+            for level in range(min(self.depth, self.folders - len(paths))):
+                parts += ('c%d-%d' % (chain, level),)
+                paths.append(parts)
+        return paths
+
+    def entries(self, rng):
+        paths = self.folder_paths()
+        mu = math.log(self.content_size) - self.content_sigma ** 2 / 2
+        yield FOLDER, ('bench',), None
+        for parts in paths:
+            yield FOLDER, parts, None
+        for index in range(self.documents):
+            size = min(int(rng.lognormvariate(mu, self.content_sigma)) + 1, MAX_CONTENT_SIZE)
+            text = " ".join(rng.choices(WORDS, k=size // 7 + 1))[:size]
+            yield DOCUMENT, rng.choice(paths) + ('doc-%d' % index,), lambda text=text: text.encode()
+
+    def seed_database(self):
+        rng = random.Random(self.seed)
+        TreeImporter(batch_size=500).run(self.entries(rng))
+
+        Topic.objects.bulk_create([Topic(name='topic-%d' % index, short_desc="Topic %d" % index) for index in range(self.topics)])
+        topics = list(Topic.objects.filter(name__startswith='topic-').order_by('id').values_list('id', flat=True))
+        folders = list(Folder.objects.values_list('id', flat=True))
+        documents = list(Document.objects.values_list('id', flat=True))
+
+        weights = [1 / (rank + 1) ** self.skew for rank in range(len(topics))]
+        folder_tags, document_tags = set(), set()
+        for topic in rng.choices(topics, weights, k=self.tags):
+            if not documents or rng.random() < 0.3:
+                folder_tags.add((rng.choice(folders), topic))
+            else:
+                document_tags.add((rng.choice(documents), topic))
+        FolderTopic.objects.bulk_create([FolderTopic(folder_id=folder, topic_id=topic) for folder, topic in folder_tags], batch_size=1000)
+        DocumentTopic.objects.bulk_create([DocumentTopic(document_id=document, topic_id=topic) for document, topic in document_tags], batch_size=1000)
+        return BenchContext(folders, documents, topics)
+
+
+class BenchContext:
+    """
+    Ids of the seeded rows and of the fixtures some endpoints need, with
+    helpers creating throwaway rows for the endpoints that consume them.
+    """
+
+    def __init__(self, folders, documents, topics):
+        self.folders = folders
+        self.documents = documents or [None]
+        self.topics = topics
+        self.root = Folder.objects.values_list('id', flat=True).get(name='bench', parent=None)
+        self.counter = 0
+        # Two folders that the moved folder and document alternate between
+        self.targets = [Folder.objects.create(name=self.name('target')).id for _ in range(2)]
+        self.moved_folder = Folder.objects.create(name=self.name('moved'), parent_id=self.targets[1]).id
+        self.moved_document = self.document_in(self.targets[1])
+        self.patched_document = self.document_in(self.targets[0])
+        update_child_count(Folder, self.targets[1], 1)
+        self.job = jobs.submit('rebuild_child_counts').id
+
+    def name(self, prefix):
+        self.counter += 1
+        return "%s-%d" % (prefix, self.counter)
+
+    def cycle(self, ids, index):
+        return ids[index % len(ids)]
+
+    def document_in(self, parent, content="hello world"):
+        document = Document(name=self.name('doc'), parent_id=parent, content=content)
+        with transaction.atomic():
+            store_content([document])
+            document.save()
+            update_child_count(Document, parent, 1)
+        return document.id
+
+    def scratch_folder(self):
+        return Folder.objects.create(name=self.name('scratch')).id
+
+    def scratch_document(self):
+        return self.document_in(self.targets[0])
+
+    def content_patch(self):
+        base = Document.objects.values_list('updated_at', flat=True).get(id=self.patched_document)
+        return {"base": base.isoformat(), "ops": [{"offset": 0, "delete": 1, "insert": "H"}]}
+
+    def tag_change(self, target_field, target, index):
+        pairs = [{target_field: target, "topic": self.topics[-1]}]
+        return {"add": pairs} if index % 2 == 0 else {"remove": pairs}
+
+
+class Endpoint:
+    """
+    One request of the suite against the URL pattern ``route``. ``build``
+    is called with the context and the request index before the request is
+    timed and returns its path and JSON body.
+    """
+
+    def __init__(self, route, method, build, name=None):
+        self.route = route
+        self.method = method
+        self.build = build
+        self.name = name or "%s /%s" % (method, route)
+
+
+def endpoints():
+    return [
+        Endpoint('', 'GET', lambda ctx, i: ('/', None)),
+        Endpoint('api/folders', 'GET', lambda ctx, i: ('/api/folders', None)),
+        Endpoint('api/folders', 'GET', lambda ctx, i: ('/api/folders?limit=100', None), name="GET /api/folders?limit=100"),
+        Endpoint('api/folders', 'POST', lambda ctx, i: ('/api/folders', {"name": ctx.name('new')})),
+        Endpoint('api/folders', 'DELETE', lambda ctx, i: ('/api/folders', {"id": ctx.scratch_folder()})),
+        Endpoint('api/folders/<int:id>', 'GET', lambda ctx, i: ('/api/folders/%d' % ctx.cycle(ctx.folders, i), None)),
+        Endpoint('api/folders/<int:id>', 'PATCH', lambda ctx, i: ('/api/folders/%d' % ctx.targets[0], {"name": ctx.name('renamed')})),
+        Endpoint('api/folders/<int:id>/tree', 'GET', lambda ctx, i: ('/api/folders/%d/tree' % ctx.root, None)),
+        Endpoint('api/folders/move', 'POST', lambda ctx, i: ('/api/folders/move', {"ids": [ctx.moved_folder], "parent": ctx.targets[i % 2]})),
+        Endpoint('api/documents', 'GET', lambda ctx, i: ('/api/documents', None)),
+        Endpoint('api/documents', 'POST', lambda ctx, i: ('/api/documents', {"name": ctx.name('new'), "parent": ctx.targets[0], "content": "hello"})),
+        Endpoint('api/documents', 'DELETE', lambda ctx, i: ('/api/documents', {"id": ctx.scratch_document()})),
+        Endpoint('api/documents/move', 'POST', lambda ctx, i: ('/api/documents/move', {"ids": [ctx.moved_document], "parent": ctx.targets[i % 2]})),
+        Endpoint('api/documents/<int:id>', 'GET', lambda ctx, i: ('/api/documents/%d' % ctx.cycle(ctx.documents, i), None)),
+        Endpoint('api/documents/<int:id>', 'PATCH', lambda ctx, i: ('/api/documents/%d' % ctx.patched_document, {"name": ctx.name('renamed')})),
+        Endpoint('api/documents/<int:id>/content', 'GET', lambda ctx, i: ('/api/documents/%d/content' % ctx.cycle(ctx.documents, i), None)),
+        Endpoint('api/documents/<int:id>/content', 'PATCH', lambda ctx, i: ('/api/documents/%d/content' % ctx.patched_document, ctx.content_patch())),
+        Endpoint('api/topics', 'GET', lambda ctx, i: ('/api/topics', None)),
+        Endpoint('api/topics', 'POST', lambda ctx, i: ('/api/topics', {"name": ctx.name('topic'), "short_desc": "New topic"})),
+        # The delete of this view takes a folder id
+        Endpoint('api/topics', 'DELETE', lambda ctx, i: ('/api/topics', {"id": ctx.scratch_folder()})),
+        Endpoint('api/topics/<int:id>', 'GET', lambda ctx, i: ('/api/topics/%d' % ctx.cycle(ctx.topics, i), None)),
+        Endpoint('api/topics/<int:id>', 'PATCH', lambda ctx, i: ('/api/topics/%d' % ctx.topics[-1], {"short_desc": ctx.name('desc')})),
+        Endpoint('api/search', 'GET', lambda ctx, i: ('/api/search?q=%s' % WORDS[i % len(WORDS)], None)),
+        Endpoint('api/cache/stats', 'GET', lambda ctx, i: ('/api/cache/stats', None)),
+        Endpoint('api/db/pool', 'GET', lambda ctx, i: ('/api/db/pool', None)),
+        Endpoint('metrics', 'GET', lambda ctx, i: ('/metrics', None)),
+        Endpoint('api/jobs/<int:id>', 'GET', lambda ctx, i: ('/api/jobs/%d' % ctx.job, None)),
+        Endpoint('api/jobs/<int:id>/cancel', 'POST', lambda ctx, i: ('/api/jobs/%d/cancel' % jobs.submit('rebuild_child_counts').id, None)),
+        Endpoint('api/folder-topics', 'GET', lambda ctx, i: ('/api/folder-topics?topic_name=topic-0', None)),
+        Endpoint('api/folder-topics', 'POST', lambda ctx, i: ('/api/folder-topics', {"folder": ctx.scratch_folder(), "topic": ctx.topics[0]})),
+        Endpoint('api/folder-topics/bulk', 'POST', lambda ctx, i: ('/api/folder-topics/bulk', ctx.tag_change('folder', ctx.targets[0], i))),
+        Endpoint('api/document-topics', 'GET', lambda ctx, i: ('/api/document-topics?topic_name=topic-0', None)),
+        Endpoint('api/document-topics', 'POST', lambda ctx, i: ('/api/document-topics', {"document": ctx.scratch_document(), "topic": ctx.topics[0]})),
+        Endpoint('api/document-topics/bulk', 'POST', lambda ctx, i: ('/api/document-topics/bulk', ctx.tag_change('document', ctx.patched_document, i))),
+    ]
+
+
+def unbenched_routes(suite):
+    """
+    URL patterns of dmsapi.urls that no endpoint of ``suite`` requests.
+    """
+    from .urls import urlpatterns
+
+    return sorted({str(pattern.pattern) for pattern in urlpatterns} - {endpoint.route for endpoint in suite})
+
+def send(client, method, path, data):
+    body = "" if data is None else json.dumps(data)
+    response = client.generic(method, path, body, content_type='application/json', **HEADERS)
+    # Streaming responses do their work while being consumed
+    if response.streaming:
+        b"".join(response.streaming_content)
+    return response
+
+def run_endpoint(client, context, endpoint, iterations, warmup=0, memory_samples=1):
+    """
+    Times ``iterations`` requests of ``endpoint`` after ``warmup`` untimed
+    ones, counting their SQL queries, then measures the peak memory
+    allocated by ``memory_samples`` more requests, separately as tracing
+    allocations slows requests down.
+    """
+    index = 0
+    for index in range(warmup):
+        send(client, endpoint.method, *endpoint.build(context, index))
+
+    latencies = []
+    statuses = Counter()
+    queries = 0
+    for index in range(warmup, warmup + iterations):
+        path, data = endpoint.build(context, index)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = send(client, endpoint.method, path, data)
+            latencies.append(time.perf_counter() - started)
+        queries += len(captured)
+        statuses[response.status_code] += 1
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for index in range(warmup + iterations, warmup + iterations + memory_samples):
+            path, data = endpoint.build(context, index)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            send(client, endpoint.method, path, data)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+
+    elapsed = sum(latencies)
+    return {
+        "endpoint": endpoint.name,
+        "route": endpoint.route,
+        "method": endpoint.method,
+        "requests": iterations,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "throughput": round(iterations / elapsed, 1) if elapsed else None,
+        **latency_summary(sorted(latencies)),
+        "queries_per_request": round(queries / iterations, 2) if iterations else None,
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+def run_suite(context, suite, iterations, warmup=0, memory_samples=1):
+    hosts = list(settings.ALLOWED_HOSTS) + [BENCH_HOST]
+    with override_settings(ALLOWED_HOSTS=hosts):
+        client = Client()
+        return [run_endpoint(client, context, endpoint, iterations, warmup, memory_samples) for endpoint in suite]
@@ -0,0 +1,221 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .models import Folder, Document, Topic
+from .serializers import FolderSerializer, DocumentSerializer, BulkFolderItemSerializer, BulkDocumentItemSerializer
+from .storage import store_content
+from .tree import CHILD_COUNTERS, apply_child_count_deltas
+
+
+BULK_MAX_ITEMS = 5000
+
+ITEM_SERIALIZERS = {
+    Folder: BulkFolderItemSerializer,
+    Document: BulkDocumentItemSerializer,
+}
+OUTPUT_SERIALIZERS = {
+    Folder: FolderSerializer,
+    Document: DocumentSerializer,
+}
+
+
+class BulkCreate:
+    """
+    Validates and inserts a batch of folders or documents.
+
+    Validation is done for the whole batch with a fixed number of queries and
+    the rows are inserted with one ``bulk_create`` per tree level (a single
+    one unless folders reference each other through ``ref``/``parent_ref``),
+    all inside one transaction. Each item gets its own result entry, invalid
+    items do not prevent the valid ones from being created.
+    """
+
+    def __init__(self, items, model):
+        self.items = items
+        self.model = model
+        self.results = [None] * len(items)
+        self.valid = {}
+        self.refs = {}
+        self.parent_paths = {}
+        self.created = {}
+
+    def fail(self, index, errors):
+        self.valid.pop(index, None)
+        self.results[index] = {"index": index, "status": 400, "errors": errors}
+
+    def run(self):
+        self.validate_fields()
+        self.validate_refs()
+        self.validate_parents()
+        self.validate_names()
+        levels = self.resolve_levels()
+
+        with transaction.atomic():
+            for level in levels:
+                objs = [self.build(index) for index in level]
+                if self.model == Document:
+                    store_content(objs)
+                self.model.objects.bulk_create(objs)
+                self.created.update(zip(level, objs))
+            self.update_counters()
+
+        serializer_class = OUTPUT_SERIALIZERS[self.model]
+        for index, obj in self.created.items():
+            self.results[index] = {"index": index, "status": 201, "data": serializer_class(obj).data}
+        return self.results
+
+    def validate_fields(self):
+        serializer_class = ITEM_SERIALIZERS[self.model]
+        for index, item in enumerate(self.items):
+            ser = serializer_class(data=item)
+            if ser.is_valid():
+                self.valid[index] = ser.validated_data
+            else:
+                self.fail(index, ser.errors)
+
+    def validate_refs(self):
+        for index, attrs in list(self.valid.items()):
+            ref = attrs.get('ref')
+            if ref is None:
+                continue
+            if ref in self.refs:
+                self.fail(index, {"ref": ["Duplicate ref in batch"]})
+            else:
+                self.refs[ref] = index
+
+    def validate_parents(self):
+        parent_ids = {attrs['parent'] for attrs in self.valid.values() if attrs.get('parent') is not None}
+        self.parent_paths = dict(Folder.objects.filter(id__in=parent_ids).values_list('id', 'path'))
+
+        for index, attrs in list(self.valid.items()):
+            if attrs.get('parent') is not None and attrs['parent'] not in self.parent_paths:
+                self.fail(index, {"parent": ['Invalid pk "%s" - object does not exist.' % attrs['parent']]})
+            elif attrs.get('parent_ref') is not None and attrs['parent_ref'] not in self.refs:
+                self.fail(index, {"parent_ref": ["Unknown ref"]})
+
+    def parent_key(self, attrs):
+        if attrs.get('parent_ref') is not None:
+            return ('ref', self.refs[attrs['parent_ref']])
+        return ('id', attrs.get('parent'))
+
+    def validate_names(self):
+        names = {attrs['name'] for attrs in self.valid.values() if attrs.get('parent_ref') is None}
+        existing = set(
+            self.model.objects
+            .filter(Q(parent__in=list(self.parent_paths)) | Q(parent=None), name__in=names)
+            .values_list('parent', 'name')
+        )
+
+        seen = set()
+        for index, attrs in list(self.valid.items()):
+            key = (self.parent_key(attrs), attrs['name'])
+            if key in seen or (key[0][0] == 'id' and (key[0][1], attrs['name']) in existing):
+                self.fail(index, [{"message": "Name duplication not allowed"}])
+            seen.add(key)
+
+    def resolve_levels(self):
+        levels = []
+        placed = set()
+        remaining = dict(self.valid)
+        while remaining:
+            level = [
+                index for index, attrs in remaining.items()
+                if attrs.get('parent_ref') is None or self.refs[attrs['parent_ref']] in placed
+            ]
+            if not level:
+                break
+            levels.append(level)
+            placed.update(level)
+            for index in level:
+                del remaining[index]
+
+        for index in remaining:
+            self.fail(index, {"parent_ref": ["Parent item is invalid or part of a cycle"]})
+        return levels
+
+    def build(self, index):
+        attrs = self.valid[index]
+        if attrs.get('parent_ref') is not None:
+            parent = self.created[self.refs[attrs['parent_ref']]]
+            parent_id, path = parent.id, parent.subtree_prefix
+        elif attrs.get('parent') is not None:
+            parent_id = attrs['parent']
+            path = "%s%d/" % (self.parent_paths[parent_id], parent_id)
+        else:
+            parent_id, path = None, "/"
+
+        if self.model == Folder:
+            return Folder(name=attrs['name'], parent_id=parent_id, path=path)
+        return Document(name=attrs['name'], parent_id=parent_id, content=attrs['content'])
+
+    def update_counters(self):
+        deltas = {}
+        for obj in self.created.values():
+            deltas[obj.parent_id] = deltas.get(obj.parent_id, 0) + 1
+        apply_child_count_deltas(self.model, deltas)
+
+        # Keep the in-batch parents consistent with the database for the response
+        field = CHILD_COUNTERS[self.model]
+        folders = {obj.id: obj for obj in self.created.values() if isinstance(obj, Folder)}
+        for parent_id, delta in deltas.items():
+            if parent_id in folders:
+                setattr(folders[parent_id], field, getattr(folders[parent_id], field) + delta)
+
+
+def bulk_create(items, model):
+    """
+    Returns the per-item results of creating ``items``, or None when the
+    batch lost a race against a concurrent write and nothing was inserted.
+    """
+    try:
+        return BulkCreate(items, model).run()
+    except IntegrityError:
+        return None
+
+
+def bulk_tag(add, remove, model, target_field):
+    """
+    Adds and removes ``(target, topic)`` associations of ``model`` in one
+    transaction with set-based statements. Pairs that already exist are
+    skipped when adding, pairs that reference unknown rows are reported back
+    in ``errors`` and otherwise ignored.
+    """
+    target_model = model._meta.get_field(target_field).related_model
+    target_ids = {pair[target_field] for pair in add}
+    topic_ids = {pair['topic'] for pair in add}
+    known_targets = set(target_model.objects.filter(id__in=target_ids).values_list('id', flat=True))
+    known_topics = set(Topic.objects.filter(id__in=topic_ids).values_list('id', flat=True))
+
+    errors = []
+    pairs = set()
+    for index, pair in enumerate(add):
+        if pair[target_field] not in known_targets:
+            errors.append({"index": index, "op": "add", "message": "Unknown %s %d" % (target_field, pair[target_field])})
+        elif pair['topic'] not in known_topics:
+            errors.append({"index": index, "op": "add", "message": "Unknown topic %d" % pair['topic']})
+        else:
+            pairs.add((pair[target_field], pair['topic']))
+
+    removals = {}
+    for pair in remove:
+        removals.setdefault(pair['topic'], set()).add(pair[target_field])
+
+    target_column = target_field + '_id'
+    with transaction.atomic():
+        existing = set(
+            model.objects
+            .filter(**{target_field + '__in': {target for target, _ in pairs}, 'topic__in': {topic for _, topic in pairs}})
+            .order_by()
+            .values_list(target_column, 'topic_id')
+        )
+        new_pairs = pairs - existing
+        model.objects.bulk_create(
+            [model(**{target_column: target, 'topic_id': topic}) for target, topic in new_pairs],
+            ignore_conflicts=True,
+        )
+
+        removed = 0
+        for topic_id, targets in removals.items():
+            removed += model.objects.filter(**{'topic': topic_id, target_field + '__in': targets}).delete()[0]
+
+    return {"added": len(new_pairs), "removed": removed, "errors": errors}
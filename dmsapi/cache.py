@@ -0,0 +1,242 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+
+from .metrics import cache_lookup
+from .routers import replicas_setting
+
+
+DEFAULT_DETAIL_CACHE = {
+    'BACKEND': 'lru',
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'ALIAS': 'default',
+}
+
+
+class LRUCache:
+    """
+    In-process cache bounded by entry count and age, shared by the threads
+    of one worker. Write times are kept apart from the entries, bounded the
+    same way, so that they neither evict nor count as entries.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.written = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, entries, key):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return value
+
+    def store(self, entries, key, value):
+        entries[key] = (value, time.monotonic() + self.ttl)
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            return self.lookup(self.entries, key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.store(self.entries, key, value)
+
+    def get_written(self, key):
+        with self.lock:
+            return self.lookup(self.written, key)
+
+    def set_written(self, keys, written_at):
+        with self.lock:
+            for key in keys:
+                self.store(self.written, key, written_at)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.written.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DjangoCache:
+    """
+    Shared cache backed by one of the aliases of Django's CACHES setting.
+    """
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    def get_written(self, key):
+        return self.cache.get(key + ":written")
+
+    def set_written(self, keys, written_at):
+        self.cache.set_many({key + ":written": written_at for key in keys}, self.ttl)
+
+    def delete_many(self, keys):
+        self.cache.delete_many(keys)
+
+    def clear(self):
+        self.cache.clear()
+
+    def __len__(self):
+        return 0
+
+
+class NullCache:
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def get_written(self, key):
+        return None
+
+    def set_written(self, keys, written_at):
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class DetailCache:
+    """
+    Read-through cache of the serialized payloads of the detail endpoints.
+
+    Entries are keyed by model and primary key. Writers call ``invalidate()``,
+    which drops the entries right away and once more when the surrounding
+    transaction commits. Commits also record when each entry was written,
+    and readers pass ``set()`` the time their miss started: a payload read
+    before the last commit is not cached, so a reader racing the write
+    cannot leave an entry holding the pre-commit row behind.
+
+    With read replicas, a row read from a replica may predate a commit by up
+    to the replica lag, so such payloads are not cached for ``replica_lag``
+    seconds after the commit.
+    """
+
+    def __init__(self, backend, name, replica_lag=0):
+        self.backend = backend
+        self.name = name
+        self.replica_lag = replica_lag
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(model, id):
+        return "dmsapi:detail:%s:%s" % (model._meta.model_name, id)
+
+    def get(self, model, id):
+        data = self.backend.get(self.key(model, id))
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        cache_lookup(data is not None)
+        return data
+
+    def set(self, model, id, data, missed_at, from_replica=False):
+        """
+        Caches a payload read after a miss that started at ``missed_at``, a
+        ``time.time()`` value, unless an invalidation committed since.
+        """
+        key = self.key(model, id)
+        written_at = self.backend.get_written(key)
+        if written_at is not None:
+            if from_replica:
+                missed_at -= self.replica_lag
+            if written_at >= missed_at:
+                return
+        self.backend.set(key, data)
+
+    def invalidate(self, model, ids):
+        keys = [self.key(model, id) for id in ids]
+        if not keys:
+            return
+        self.backend.delete_many(keys)
+        transaction.on_commit(lambda: self.committed(keys))
+
+    def committed(self, keys):
+        self.backend.delete_many(keys)
+        self.backend.set_written(keys, time.time())
+
+    def clear(self):
+        self.backend.clear()
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": len(self.backend),
+        }
+
+
+_detail_cache = None
+
+def get_detail_cache():
+    global _detail_cache
+    if _detail_cache is None:
+        config = getattr(settings, 'DMSAPI_DETAIL_CACHE', DEFAULT_DETAIL_CACHE)
+        if not config:
+            _detail_cache = DetailCache(NullCache(), 'none')
+        else:
+            config = {**DEFAULT_DETAIL_CACHE, **config}
+            if config['BACKEND'] == 'django':
+                backend = DjangoCache(config['ALIAS'], config['TTL'])
+            else:
+                backend = LRUCache(config['MAX_SIZE'], config['TTL'])
+            replica_lag = replicas_setting('MAX_LAG') if replicas_setting('ALIASES') else 0
+            _detail_cache = DetailCache(backend, config['BACKEND'], replica_lag)
+    return _detail_cache
+
+def reset_detail_cache(**kwargs):
+    global _detail_cache
+    if kwargs.get('setting') in (None, 'DMSAPI_DETAIL_CACHE', 'CACHES', 'DMSAPI_REPLICAS'):
+        _detail_cache = None
+
+setting_changed.connect(reset_detail_cache)
@@ -0,0 +1,127 @@
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+
+from .models import Folder
+
+
+# Columns whose value changes whenever the detail payload of a model does.
+# Folder counters are part of the payload too.
+VALIDATOR_FIELDS = {
+    Folder: ('updated_at', 'subfolder_count', 'document_count'),
+}
+CONDITIONAL_HEADERS = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_MATCH', 'HTTP_IF_UNMODIFIED_SINCE')
+
+
+class Validators:
+    """
+    ETag and Last-Modified of a response, ``last_modified`` is an aware
+    datetime or None.
+    """
+
+    def __init__(self, *parts, last_modified=None):
+        digest = hashlib.md5(":".join(str(part) for part in parts).encode()).hexdigest()
+        self.etag = quote_etag(digest)
+        self.last_modified = last_modified
+
+    @property
+    def timestamp(self):
+        if self.last_modified is None:
+            return None
+        return timegm(self.last_modified.utctimetuple())
+
+    def conditional_response(self, request):
+        """
+        Returns the 304/412 response the request headers call for, or None
+        when the full response has to be sent.
+        """
+        return get_conditional_response(request, etag=self.etag, last_modified=self.timestamp)
+
+    def apply(self, response):
+        response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.timestamp)
+        return response
+
+
+def is_conditional(request):
+    return any(header in request.META for header in CONDITIONAL_HEADERS)
+
+def validator_fields(model):
+    return VALIDATOR_FIELDS.get(model, ('updated_at',))
+
+def detail_validators(model, id, payload, *parts):
+    """
+    Validators of a detail payload, computed from the represented values so
+    that a cached payload and a fresh validator query agree. ``parts`` tell
+    apart different representations of the same row.
+    """
+    fields = validator_fields(model)
+    return Validators(
+        model._meta.model_name, id, *(payload[field] for field in fields), *parts,
+        last_modified=parse_datetime(payload['updated_at']),
+    )
+
+def load_detail_validators(model, id, serializer_class, *parts):
+    """
+    Validators of a detail payload read from the validator columns only,
+    without loading or serializing the row. Raises ``model.DoesNotExist``.
+    """
+    values = model.objects.values(*validator_fields(model)).get(id=id)
+    return represented_validators(model, id, serializer_class, values, *parts)
+
+async def aload_detail_validators(model, id, serializer_class, *parts):
+    values = await model.objects.values(*validator_fields(model)).aget(id=id)
+    return represented_validators(model, id, serializer_class, values, *parts)
+
+def represented_validators(model, id, serializer_class, values, *parts):
+    fields = serializer_class().fields
+    payload = {name: fields[name].to_representation(value) for name, value in values.items()}
+    return detail_validators(model, id, payload, *parts)
+
+def aggregates(model):
+    columns = {'count': Count('id'), 'last_id': Max('id'), 'last_modified': Max('updated_at')}
+    for field in validator_fields(model):
+        if field != 'updated_at':
+            columns[field] = Sum(field)
+    return columns
+
+def aggregate_state(queryset):
+    columns = aggregates(queryset.model)
+    aggregate = queryset.order_by().aggregate(**columns)
+    return tuple(aggregate[name] for name in columns)
+
+async def aaggregate_state(queryset):
+    columns = aggregates(queryset.model)
+    aggregate = await queryset.order_by().aaggregate(**columns)
+    return tuple(aggregate[name] for name in columns)
+
+def aggregate_validators(request, queryset, *parts):
+    """
+    Validators of a list response: the row count, latest id and update (and
+    counter totals) of ``queryset`` together with the full request path.
+    Only an ETag, as removing rows does not move the latest update back.
+    """
+    return Validators(request.get_full_path(), *aggregate_state(queryset), *parts)
+
+async def aaggregate_validators(request, queryset, *parts):
+    return Validators(request.get_full_path(), *await aaggregate_state(queryset), *parts)
+
+def tag_state(model, topic_id):
+    """
+    Count and latest id of the ``model`` (FolderTopic or DocumentTopic) rows
+    of a topic, which change when it is retagged while the tagged rows do not.
+    """
+    aggregate = model.objects.filter(topic=topic_id).aggregate(count=Count('id'), last_id=Max('id'))
+    return aggregate['count'], aggregate['last_id']
+
+async def atag_state(model, topic_id):
+    aggregate = await model.objects.filter(topic=topic_id).aaggregate(count=Count('id'), last_id=Max('id'))
+    return aggregate['count'], aggregate['last_id']
+
+def latest(*datetimes):
+    return max((value for value in datetimes if value is not None), default=None)
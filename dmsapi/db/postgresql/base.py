@@ -0,0 +1,10 @@
+"""
+PostgreSQL backend with pooled connections, see dmsapi.pool.
+"""
+from django.db.backends.postgresql import base
+
+from dmsapi.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
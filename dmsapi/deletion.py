@@ -0,0 +1,93 @@
+from django.db import router, transaction
+from django.db.models import Q
+from django.db.models.functions import Length
+
+from .cache import get_detail_cache
+from .models import Folder, Document, FolderTopic, DocumentTopic
+from .storage import release_blobs
+from .tree import subtree_documents, update_child_count
+
+
+DELETE_BATCH_SIZE = 1000
+
+
+def raw_delete(queryset):
+    # Plain DELETE without the collector, which would load every row to send
+    # the delete signals. Callers do the work of the signal receivers.
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+class SubtreeDeletion:
+    """
+    Deletes a folder with everything below it in batches of ``batch_size``
+    rows, each in its own short transaction.
+
+    Rows are selected through the materialized path and removed with
+    set-based DELETEs: documents first, then folders deepest first, so that
+    no batch leaves a committed row pointing at a deleted one. Memory use is
+    bounded by the batch size whatever the size of the subtree.
+    """
+
+    def __init__(self, folder, batch_size=None, on_progress=None):
+        self.folder = folder
+        self.batch_size = batch_size or DELETE_BATCH_SIZE
+        self.on_progress = on_progress
+        self.folders_deleted = 0
+        self.documents_deleted = 0
+
+    def totals(self):
+        return self.folder_rows().count(), subtree_documents(self.folder).count()
+
+    def folder_rows(self):
+        return Folder.objects.filter(Q(id=self.folder.id) | Q(path__startswith=self.folder.subtree_prefix))
+
+    def run(self):
+        documents = subtree_documents(self.folder)
+        while self.delete_documents(documents):
+            pass
+        while self.delete_folders():
+            pass
+
+    def delete_documents(self, documents):
+        rows = list(documents.order_by().values_list('id', 'blob')[:self.batch_size])
+        if not rows:
+            return 0
+
+        ids = [id for id, _ in rows]
+        with transaction.atomic():
+            DocumentTopic.objects.filter(document__in=ids).delete()
+            raw_delete(Document.objects.filter(id__in=ids))
+            release_blobs([blob for _, blob in rows if blob is not None])
+            get_detail_cache().invalidate(Document, ids)
+
+        self.documents_deleted += len(ids)
+        self.report()
+        return len(ids)
+
+    def delete_folders(self):
+        ids = list(
+            self.folder_rows()
+            .order_by(Length('path').desc(), 'id')
+            .values_list('id', flat=True)[:self.batch_size]
+        )
+        if not ids:
+            return 0
+
+        with transaction.atomic():
+            # Documents created in these folders since the document pass
+            while self.delete_documents(Document.objects.filter(parent__in=ids)):
+                pass
+            FolderTopic.objects.filter(folder__in=ids).delete()
+            if self.folder.id in ids:
+                parent_id = Folder.objects.values_list('parent', flat=True).get(id=self.folder.id)
+                update_child_count(Folder, parent_id, -1)
+            raw_delete(Folder.objects.filter(id__in=ids))
+            get_detail_cache().invalidate(Folder, ids)
+
+        self.folders_deleted += len(ids)
+        self.report()
+        return len(ids)
+
+    def report(self):
+        if self.on_progress is not None:
+            self.on_progress(self)
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Length, Substr
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from .cache import get_detail_cache
+from .functions import ConcatMany
+from .models import Document
+from .storage import document_content
+
+
+MAX_PATCH_OPS = 1000
+
+
+class StaleBase(Exception):
+    pass
+
+class OpsOutOfRange(Exception):
+    pass
+
+
+def ops_end(ops):
+    return max(op['offset'] + op['delete'] for op in ops)
+
+def apply_ops(text, ops):
+    """
+    Applies ``ops``, sorted and non-overlapping ``offset``/``delete``/
+    ``insert`` edits in characters of ``text``, to ``text``.
+    """
+    pieces = []
+    position = 0
+    for op in ops:
+        pieces += [text[position:op['offset']], op['insert']]
+        position = op['offset'] + op['delete']
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+def patched_content(ops):
+    """
+    Database expression applying ``ops`` to ``Document.content``, so that
+    the unchanged parts of the body never leave the database.
+    """
+    pieces = []
+    position = 0
+    for op in ops:
+        if op['offset'] > position:
+            pieces.append(Substr('content', position + 1, op['offset'] - position))
+        if op['insert']:
+            pieces.append(Value(op['insert']))
+        position = op['offset'] + op['delete']
+    pieces.append(Substr('content', position + 1))
+
+    if len(pieces) == 1:
+        return pieces[0]
+    return ConcatMany(*pieces)
+
+def patch_document_content(id, base, ops):
+    """
+    Applies ``ops`` to the body of document ``id`` as it was at version
+    (``updated_at``) ``base`` and returns the new version. Raises
+    ``StaleBase`` when the document changed since ``base``,
+    ``OpsOutOfRange`` when an edit goes past the end of the body and
+    ``Document.DoesNotExist``.
+
+    Inline bodies are edited with a single conditional UPDATE, bodies stored
+    in blobs have to be read, edited and stored again.
+    """
+    end = ops_end(ops)
+    updated_at = timezone.now()
+    with transaction.atomic():
+        updated = (
+            Document.objects
+            .filter(GreaterThanOrEqual(Length('content'), end), id=id, updated_at=base, content__isnull=False)
+            .update(content=patched_content(ops), updated_at=updated_at)
+        )
+        if updated:
+            get_detail_cache().invalidate(Document, [id])
+            return updated_at
+
+        document = Document.objects.select_for_update().get(id=id)
+        if document.updated_at != base:
+            raise StaleBase()
+        text = document_content(document)
+        if end > len(text):
+            raise OpsOutOfRange()
+        document.content = apply_ops(text, ops)
+        document.save(update_fields=['content', 'updated_at'])
+        return document.updated_at
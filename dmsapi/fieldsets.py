@@ -0,0 +1,72 @@
+from rest_framework.exceptions import ValidationError
+
+from .models import Document, Folder, HAS_CHILDREN
+
+
+# Fields returned by list endpoints when no ?fields= is given
+DEFAULT_LIST_FIELDS = ("id", "name")
+
+# Serializer fields that are not columns: the expression computing them in
+# values() queries and the columns they are derived from
+COMPUTED_FIELDS = {
+    Folder: {
+        'has_children': (HAS_CHILDREN, ('subfolder_count', 'document_count')),
+    },
+}
+
+# Columns read along with a field that maps to a column of the same name
+EXTRA_COLUMNS = {
+    Document: {
+        'content': ('blob',),
+    },
+}
+# Fields that may be stored outside of the row and are not served by lists
+DETAIL_ONLY_FIELDS = {
+    Document: ('content',),
+}
+
+
+def requested_fields(request, serializer_class, listing=False):
+    """
+    Returns the field names asked for with ``?fields=a,b``, validated against
+    the serializer, or None when the parameter is absent.
+    """
+    raw = request.GET.get("fields", None)
+    if raw is None:
+        return None
+
+    names = tuple(dict.fromkeys(name.strip() for name in raw.split(",") if name.strip()))
+    known = list(serializer_class().fields)
+    if listing:
+        excluded = DETAIL_ONLY_FIELDS.get(serializer_class.Meta.model, ())
+        known = [name for name in known if name not in excluded]
+    unknown = [name for name in names if name not in known]
+    if not names or unknown:
+        raise ValidationError([{"message": "Unknown fields: %s, allowed fields: %s" % (", ".join(unknown), ", ".join(known))}])
+    return names
+
+def detail_columns(model, names):
+    """
+    The model columns to load with ``.only()`` to serialize ``names``.
+    """
+    computed = COMPUTED_FIELDS.get(model, {})
+    extra = EXTRA_COLUMNS.get(model, {})
+    columns = []
+    for name in names:
+        columns += computed[name][1] if name in computed else (name,) + extra.get(name, ())
+    return columns
+
+def list_values(queryset, fields):
+    """
+    ``queryset.values()`` restricted to ``fields``, ``id`` is always included
+    as it keys the pagination.
+    """
+    if fields is None:
+        return queryset.values(*DEFAULT_LIST_FIELDS)
+
+    computed = COMPUTED_FIELDS.get(queryset.model, {})
+    names = ("id",) + tuple(name for name in fields if name != "id")
+    return queryset.values(
+        *(name for name in names if name not in computed),
+        **{name: computed[name][0] for name in names if name in computed}
+    )
@@ -0,0 +1,67 @@
+from django.db.models import BinaryField, Func, IntegerField, TextField
+
+
+class ByteLength(Func):
+    """
+    Length in bytes of the UTF-8 encoding of a text expression.
+    """
+    function = 'OCTET_LENGTH'
+    arity = 1
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='LENGTH(CAST(%(expressions)s AS BLOB))', **extra_context)
+
+
+class ByteSubstr(Func):
+    """
+    ``length`` bytes of the UTF-8 encoding of a text expression, starting at
+    the 1-based byte ``position``. Only the requested bytes leave the database.
+    """
+    function = 'SUBSTR'
+    arity = 3
+    output_field = BinaryField()
+
+    def as_bytes_sql(self, compiler, connection, to_bytes):
+        text, position, length = self.get_source_expressions()
+        text_sql, text_params = compiler.compile(text)
+        position_sql, position_params = compiler.compile(position)
+        length_sql, length_params = compiler.compile(length)
+        sql = "SUBSTR(%s, %s, %s)" % (to_bytes % text_sql, position_sql, length_sql)
+        return sql, (*text_params, *position_params, *length_params)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_bytes_sql(compiler, connection, "CONVERT_TO(%s, 'UTF8')")
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_bytes_sql(compiler, connection, "CAST(%s AS BLOB)")
+
+
+class ConcatMany(Func):
+    """
+    Concatenation of many non-null text expressions. Unlike ``Concat``,
+    which nests one pair per argument, the SQL stays a few levels deep,
+    within the parser and expression depth limits of the databases and
+    the recursion limit of the query compiler.
+    """
+    function = 'CONCAT'
+    output_field = TextField()
+
+    def as_pipes_sql(self, compiler, connection, **extra_context):
+        # || pairs nested as a balanced tree, a flat chain would parse into
+        # a tree one level deeper per operand
+        parts = [compiler.compile(expression) for expression in self.get_source_expressions()]
+        while len(parts) > 1:
+            pairs = [parts[i:i + 2] for i in range(0, len(parts), 2)]
+            parts = [
+                ("(%s || %s)" % (pair[0][0], pair[1][0]), (*pair[0][1], *pair[1][1])) if len(pair) == 2 else pair[0]
+                for pair in pairs
+            ]
+        return parts[0]
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # CONCAT() takes at most 100 arguments there
+        return self.as_pipes_sql(compiler, connection, **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_pipes_sql(compiler, connection, **extra_context)
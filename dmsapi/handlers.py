@@ -0,0 +1,40 @@
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler as BaseASGIHandler
+
+
+class ASGIHandler(BaseASGIHandler):
+    """
+    Django's ASGI handler, producing the parts of streaming responses in the
+    thread that ran the view. Django 4.1 iterates them in the event loop,
+    where the generators reading rows from the database cannot run.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header, value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers += [(b"Set-Cookie", cookie.output(header="").encode('ascii').strip()) for cookie in response.cookies.values()]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+
+        # Access __iter__ rather than streaming_content, as the base class does
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        end = object()
+        while (part := await next_part(parts, end)) is not end:
+            for chunk, _ in self.chunk_bytes(part):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    """
+    ``django.core.asgi.get_asgi_application()`` with the handler above.
+    """
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,172 @@
+import functools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INSTRUMENTATION = {
+    # Record the queries of every request, set to False to remove the middleware
+    'ENABLED': True,
+    # Requests taking longer than this many milliseconds are logged as warnings
+    'SLOW_REQUEST_MS': 500,
+    # Raise QueryBudgetExceeded when a view exceeds its budget instead of logging it
+    'RAISE_ON_BUDGET': False,
+}
+
+_recorders = ContextVar('dmsapi_query_recorders', default=())
+_enforce_budgets = ContextVar('dmsapi_enforce_query_budgets', default=False)
+
+
+def instrumentation_setting(name):
+    return {**DEFAULT_INSTRUMENTATION, **getattr(settings, 'DMSAPI_INSTRUMENTATION', {})}[name]
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """
+    Count, duration and SQL of the queries run while it is active. Queries
+    run again with the same parameters are duplicates, the same statement
+    with other parameters (an N+1 loop) is counted as similar.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.executions = Counter()
+
+    def add(self, sql, params, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[sql] += 1
+        self.executions[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.executions.values())
+
+    @property
+    def similar(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def repeated(self, limit=5):
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+    def summary(self):
+        return {
+            "queries": self.count,
+            "db_ms": round(self.duration * 1000, 3),
+            "duplicates": self.duplicates,
+            "similar": self.similar,
+        }
+
+
+@contextmanager
+def recording():
+    """
+    Records the queries of every database run inside the block, including
+    those run by sync_to_async threads, which copy the context.
+    """
+    recorder = QueryRecorder()
+    token = _recorders.set(_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+
+def record_query(execute, sql, params, many, context):
+    recorders = _recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for recorder in recorders:
+            recorder.add(sql, params, duration)
+
+def install_query_recorder(connection):
+    # First in the list, as connection.execute_wrapper() blocks pop the last one
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def server_timing(recorder, duration):
+    return 'db;dur=%.3f;desc="%d queries, %d duplicates", total;dur=%.3f' % (
+        recorder.duration * 1000, recorder.count, recorder.duplicates, duration * 1000,
+    )
+
+def log_request(request, response, recorder, duration):
+    match = getattr(request, 'resolver_match', None)
+    fields = {
+        "method": request.method,
+        "path": request.path,
+        "route": match.route if match is not None else None,
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 3),
+        **recorder.summary(),
+    }
+    message = "%(method)s %(path)s %(status)d in %(duration_ms).1fms, %(queries)d queries in %(db_ms).1fms (%(duplicates)d duplicates)"
+    logger.info(message, fields, extra={"request_stats": fields})
+
+    if duration * 1000 >= instrumentation_setting('SLOW_REQUEST_MS'):
+        fields["repeated"] = recorder.repeated()
+        logger.warning("Slow request: " + message, fields, extra={"request_stats": fields})
+
+
+def query_budget(max_queries):
+    """
+    Declares that the decorated view (or view method) runs at most
+    ``max_queries`` queries. Going over is logged, and fails the request
+    when RAISE_ON_BUDGET is set or inside tests using QueryBudgetMixin.
+    Queries run while a streaming response is consumed are not counted.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with recording() as recorder:
+                result = function(*args, **kwargs)
+            if recorder.count > max_queries:
+                budget_exceeded(function.__qualname__, max_queries, recorder)
+            return result
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+def budget_exceeded(name, max_queries, recorder):
+    message = "%s ran %d queries, its budget is %d" % (name, recorder.count, max_queries)
+    details = "".join("\n  %dx %s" % (count, sql) for sql, count in recorder.repeated())
+    if _enforce_budgets.get() or instrumentation_setting('RAISE_ON_BUDGET'):
+        raise QueryBudgetExceeded(message + details)
+    logger.warning(message + details)
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin failing the tests that make a view exceed its
+    ``query_budget``, with an ``assertMaxQueries`` counterpart of
+    ``assertNumQueries`` for code without a declared budget.
+    """
+
+    def setUp(self):
+        super().setUp()
+        token = _enforce_budgets.set(True)
+        self.addCleanup(_enforce_budgets.reset, token)
+
+    @contextmanager
+    def assertMaxQueries(self, max_queries):
+        with recording() as recorder:
+            yield recorder
+        if recorder.count > max_queries:
+            statements = "".join("\n  %dx %s" % (count, sql) for sql, count in recorder.statements.most_common())
+            self.fail("%d queries run, at most %d expected:%s" % (recorder.count, max_queries, statements))
@@ -0,0 +1,202 @@
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = {
+    # Running jobs without a heartbeat for this many seconds are taken over
+    'STALE_AFTER': 300,
+    # Delay before the n-th retry is RETRY_DELAY * 2 ** (n - 1) seconds
+    'RETRY_DELAY': 10,
+    'MAX_ATTEMPTS': 3,
+}
+
+_handlers = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def jobs_setting(name):
+    return {**DEFAULT_JOBS, **getattr(settings, 'DMSAPI_JOBS', {})}[name]
+
+def register(kind):
+    """
+    Registers the decorated function as the handler of jobs of ``kind``. It
+    is called with a ``JobContext`` and the job parameters and returns the
+    JSON result of the job. Handlers may run more than once and must be
+    idempotent.
+    """
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+def get_handler(kind):
+    from . import tasks  # noqa: F401
+
+    return _handlers.get(kind)
+
+def submit(kind, max_attempts=None, **params):
+    if get_handler(kind) is None:
+        raise ValueError("Unknown job kind %r" % kind)
+    return Job.objects.create(kind=kind, params=params, max_attempts=max_attempts or jobs_setting('MAX_ATTEMPTS'))
+
+def cancel(job_id):
+    """
+    Cancels a queued job right away, or asks a running one to stop at its
+    next progress report. Returns the job, or None when it does not exist.
+    """
+    now = timezone.now()
+    if not Job.objects.filter(id=job_id, status=Job.QUEUED).update(status=Job.CANCELLED, cancel_requested=True, finished_at=now):
+        Job.objects.filter(id=job_id, status=Job.RUNNING).update(cancel_requested=True)
+    return Job.objects.filter(id=job_id).first()
+
+
+class JobContext:
+    """
+    Handle given to job handlers to report progress. Reporting doubles as the
+    heartbeat and as the cancellation point of the job.
+    """
+
+    def __init__(self, job, worker):
+        self.job = job
+        self.worker = worker
+
+    def report(self, **progress):
+        updated = (
+            Job.objects
+            .filter(id=self.job.id, worker=self.worker, cancel_requested=False)
+            .update(progress=progress, heartbeat_at=timezone.now())
+        )
+        if not updated:
+            raise JobCancelled()
+        self.job.progress = progress
+
+
+def claim(worker):
+    """
+    Takes the next runnable job: a queued job that is due or a running job
+    whose worker stopped sending heartbeats. Claims are a compare-and-set on
+    the status and heartbeat, so concurrent workers never run the same job.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=jobs_setting('STALE_AFTER'))
+    candidates = (
+        Job.objects
+        .filter(Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, heartbeat_at__lt=stale))
+        .order_by('run_after', 'id')
+        .values_list('id', 'status', 'heartbeat_at')[:10]
+    )
+    for id, status, heartbeat_at in candidates:
+        claimed = (
+            Job.objects
+            .filter(id=id, status=status, heartbeat_at=heartbeat_at)
+            .update(status=Job.RUNNING, worker=worker, heartbeat_at=now, attempts=F('attempts') + 1)
+        )
+        if claimed:
+            return Job.objects.get(id=id)
+    return None
+
+def finish(job, worker, **fields):
+    fields.setdefault('finished_at', timezone.now())
+    Job.objects.filter(id=job.id, worker=worker).update(**fields)
+
+def run_job(job, worker):
+    handler = get_handler(job.kind)
+    if handler is None:
+        finish(job, worker, status=Job.FAILED, error="Unknown job kind %r" % job.kind)
+        return
+    if job.attempts > job.max_attempts:
+        finish(job, worker, status=Job.FAILED)
+        return
+
+    try:
+        result = handler(JobContext(job, worker), **job.params)
+    except JobCancelled:
+        finish(job, worker, status=Job.CANCELLED)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Job %s failed (attempt %d of %d)", job, job.attempts, job.max_attempts)
+        if job.attempts < job.max_attempts:
+            delay = jobs_setting('RETRY_DELAY') * 2 ** (job.attempts - 1)
+            finish(job, worker, status=Job.QUEUED, error=error, heartbeat_at=None,
+                   run_after=timezone.now() + timedelta(seconds=delay), finished_at=None)
+        else:
+            finish(job, worker, status=Job.FAILED, error=error)
+    else:
+        finish(job, worker, status=Job.SUCCEEDED, result=result, error="")
+
+def run_pending(worker=None, limit=None):
+    """
+    Runs due jobs in the calling thread until none is left (or ``limit`` jobs
+    ran) and returns how many ran.
+    """
+    worker = worker or default_worker_name()
+    count = 0
+    while limit is None or count < limit:
+        job = claim(worker)
+        if job is None:
+            break
+        run_job(job, worker)
+        count += 1
+    return count
+
+def default_worker_name():
+    return "%s:%d:%s" % (socket.gethostname(), os.getpid(), threading.current_thread().name)
+
+
+class WorkerPool:
+    """
+    ``concurrency`` worker threads polling the job table every
+    ``poll_interval`` seconds when it is empty.
+    """
+
+    def __init__(self, concurrency=1, poll_interval=1.0):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+
+    def work(self, once):
+        worker = default_worker_name()
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                ran = run_pending(worker, limit=1)
+                if not ran:
+                    if once:
+                        break
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            connections.close_all()
+
+    def run(self, once=False):
+        """
+        Blocks until ``stop()`` is called, or until the queue is empty when
+        ``once`` is true.
+        """
+        threads = [
+            threading.Thread(target=self.work, args=(once,), name="jobs-%d" % index, daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+
+    def stop(self):
+        self.stopping.set()
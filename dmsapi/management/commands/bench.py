@@ -0,0 +1,89 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from dmsapi.benchmark import Dataset, endpoints, run_suite, unbenched_routes
+from dmsapi.cache import get_detail_cache
+
+
+class Command(BaseCommand):
+    help = ("Seeds a throwaway test database with a synthetic dataset and measures the latency, throughput, "
+            "query count and peak memory of every API endpoint, in-process")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shape', choices=['wide', 'deep'], default='wide',
+                            help="Folders all below one root (wide) or in chains of --depth folders (deep)")
+        parser.add_argument('--folders', type=int, default=200)
+        parser.add_argument('--depth', type=int, default=8)
+        parser.add_argument('--documents', type=int, default=1000)
+        parser.add_argument('--content-size', type=int, default=2048, help="Mean document size in bytes")
+        parser.add_argument('--content-sigma', type=float, default=1.0, help="Sigma of the log-normal document sizes")
+        parser.add_argument('--topics', type=int, default=20)
+        parser.add_argument('--tags', type=int, default=2000, help="Folder and document tags to create")
+        parser.add_argument('--skew', type=float, default=1.2, help="Zipf exponent of the topic popularity")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=50, help="Timed requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per endpoint")
+        parser.add_argument('--memory-samples', type=int, default=3, help="Requests per endpoint traced for peak memory")
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help="Only run the endpoints whose name contains this text, repeatable")
+        parser.add_argument('--output', default=None, help="Also write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1")
+        dataset = Dataset(
+            options['shape'], options['folders'], options['depth'], options['documents'], options['content_size'],
+            options['content_sigma'], options['topics'], options['tags'], options['skew'], options['seed'],
+        )
+        suite = endpoints()
+        if options['endpoints']:
+            suite = [endpoint for endpoint in suite if any(text in endpoint.name for text in options['endpoints'])]
+            if not suite:
+                raise CommandError("No endpoint matches %s" % ", ".join(options['endpoints']))
+        missing = unbenched_routes(endpoints())
+        if missing:
+            self.stderr.write("Routes without a benchmark: %s" % ", ".join(missing))
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(DMSAPI_REPLICAS={'ALIASES': []}):
+                get_detail_cache().clear()
+                context = dataset.seed_database()
+                results = run_suite(context, suite, options['iterations'], options['warmup'], options['memory_samples'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write("%-44s %9s %9s %9s %9s %9s %8s %10s %s" % (
+            "endpoint", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms", "queries", "peak KB", "statuses"))
+        for result in results:
+            self.stdout.write("%-44s %9.1f %9.2f %9.2f %9.2f %9.2f %8.1f %10.1f %s" % (
+                result["endpoint"], result["throughput"] or 0, result["p50_ms"], result["p95_ms"], result["p99_ms"],
+                result["max_ms"], result["queries_per_request"], result["peak_memory_kb"],
+                " ".join("%s:%d" % item for item in result["statuses"].items()),
+            ))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({"meta": self.meta(dataset, options), "results": results}, file, indent=2)
+
+    def meta(self, dataset, options):
+        try:
+            revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            revision = None
+        return {
+            "revision": revision,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "dataset": dataset.as_dict(),
+            "iterations": options['iterations'],
+            "warmup": options['warmup'],
+            "memory_samples": options['memory_samples'],
+        }
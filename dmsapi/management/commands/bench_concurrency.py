@@ -0,0 +1,52 @@
+import json
+from urllib.parse import quote
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dmsapi.benchmark import run_concurrency_benchmark
+from dmsapi.models import Folder, Document, Topic
+
+
+class Command(BaseCommand):
+    help = ("Compares the read endpoints served by the sync views under WSGI with the async views under ASGI "
+            "at several concurrency levels, in-process against the configured database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, nargs='+', default=[100, 500, 1000])
+        parser.add_argument('--requests', type=int, default=2000, help="Requests per run")
+        parser.add_argument('--threads', type=int, default=16, help="Worker threads of the WSGI server")
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], action='append', dest='modes')
+        parser.add_argument('--url', action='append', dest='urls',
+                            help="URL to request, repeatable. Defaults to the list, detail and topic lookup endpoints")
+        parser.add_argument('--json', dest='output', default=None, help="Also write the results to this file")
+
+    def default_urls(self):
+        folder = Folder.objects.values_list('id', flat=True).first()
+        document = Document.objects.values_list('id', flat=True).first()
+        topic = Topic.objects.values_list('name', flat=True).first()
+        if folder is None or document is None or topic is None:
+            raise CommandError("The database needs at least one folder, document and topic, or pass --url")
+        return [
+            '/api/folders',
+            '/api/folders/%d' % folder,
+            '/api/documents',
+            '/api/documents/%d' % document,
+            '/api/topics',
+            '/api/folder-topics?topic_name=%s' % quote(topic),
+            '/api/document-topics?topic_name=%s' % quote(topic),
+        ]
+
+    def handle(self, *args, **options):
+        urls = options['urls'] or self.default_urls()
+        modes = options['modes'] or ['wsgi', 'asgi']
+        results = run_concurrency_benchmark(urls, options['clients'], options['requests'], options['threads'], modes)
+
+        self.stdout.write("%-5s %8s %9s %7s %10s %9s %9s %9s" % ("mode", "clients", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+        for result in results:
+            self.stdout.write("%-5s %8d %9d %7d %10.1f %9.2f %9.2f %9.2f" % (
+                result["mode"], result["clients"], result["requests"], result["errors"],
+                result["throughput"], result["p50_ms"], result["p95_ms"], result["p99_ms"],
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({"urls": urls, "results": results}, file, indent=2)
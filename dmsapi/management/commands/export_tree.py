@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dmsapi.models import Folder
+from dmsapi.transfer import TreeExporter
+
+
+class Command(BaseCommand):
+    help = "Streams a folder subtree (everything by default) to a tar archive or an NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Output path, '-' writes to stdout")
+        parser.add_argument('--format', choices=['tar', 'ndjson'], default='tar')
+        parser.add_argument('--folder', type=int, default=None, help="Root of the exported subtree")
+
+    def handle(self, *args, **options):
+        folder = None
+        if options['folder'] is not None:
+            try:
+                folder = Folder.objects.only("id", "path").get(id=options['folder'])
+            except Folder.DoesNotExist:
+                raise CommandError("Folder %d does not exist" % options['folder'])
+
+        exporter = TreeExporter(folder)
+        write = exporter.write_tar if options['format'] == 'tar' else exporter.write_ndjson
+        if options['output'] == '-':
+            stats = write(sys.stdout.buffer if options['format'] == 'tar' else sys.stdout)
+        else:
+            with open(options['output'], 'wb' if options['format'] == 'tar' else 'w') as file:
+                stats = write(file)
+
+        # stdout may carry the export itself
+        self.stderr.write(self.style.SUCCESS("Exported %s" % stats.summary()))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dmsapi.schema import generate_schema
+
+
+class Command(BaseCommand):
+    help = ("Writes the OpenAPI document of the API to DMSAPI_SCHEMA_FILE (or --output), "
+            "which the API docs then serve instead of generating it")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Defaults to the DMSAPI_SCHEMA_FILE setting")
+
+    def handle(self, *args, **options):
+        path = options['output'] or getattr(settings, 'DMSAPI_SCHEMA_FILE', None)
+        if not path:
+            raise CommandError("Pass --output or set DMSAPI_SCHEMA_FILE")
+        body = generate_schema()
+        with open(path, 'wb') as file:
+            file.write(body)
+        self.stdout.write("Wrote %d bytes to %s" % (len(body), path))
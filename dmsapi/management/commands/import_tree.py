@@ -0,0 +1,49 @@
+import shutil
+import sys
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dmsapi.models import Folder
+from dmsapi.transfer import IMPORT_BATCH_SIZE, TreeImporter, guess_format, import_entries
+
+
+class Command(BaseCommand):
+    help = "Imports a directory tree, a tar or zip archive or an NDJSON export as folders and documents"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory or archive path, '-' reads an archive from stdin")
+        parser.add_argument('--format', choices=['dir', 'tar', 'zip', 'ndjson'], default=None,
+                            help="Guessed from the source by default")
+        parser.add_argument('--parent', type=int, default=None, help="Folder to import into, the top level by default")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        source = options['source']
+        format = options['format'] or ('tar' if source == '-' else guess_format(source))
+        if format == 'dir' and source == '-':
+            raise CommandError("A directory cannot be read from stdin")
+        if options['parent'] is not None and not Folder.objects.filter(id=options['parent']).exists():
+            raise CommandError("Folder %d does not exist" % options['parent'])
+
+        importer = TreeImporter(options['parent'], batch_size=options['batch_size'])
+        if format == 'dir':
+            stats = importer.run(import_entries(source, format))
+        elif source == '-' and format == 'zip':
+            # Zip archives end with their index, stdin cannot be seeked back to
+            with tempfile.TemporaryFile() as file:
+                shutil.copyfileobj(sys.stdin.buffer, file)
+                file.seek(0)
+                stats = importer.run(import_entries(file, format))
+        elif source == '-':
+            stream = sys.stdin if format == 'ndjson' else sys.stdin.buffer
+            stats = importer.run(import_entries(stream, format))
+        else:
+            with open(source, 'r' if format == 'ndjson' else 'rb') as file:
+                stats = importer.run(import_entries(file, format))
+
+        for path, reason in importer.skipped[:20]:
+            self.stderr.write("Skipped %s: %s" % (path, reason))
+        if len(importer.skipped) > 20:
+            self.stderr.write("... and %d more skipped entries" % (len(importer.skipped) - 20))
+        self.stdout.write(self.style.SUCCESS("Imported %s" % stats.summary()))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dmsapi.models import Document
+from dmsapi.storage import blob_texts, build_content_storage, purge_blobs
+
+
+class Command(BaseCommand):
+    help = "Moves existing document bodies into compressed blobs, or back inline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=['blob', 'inline'], default=None,
+                            help="Target storage, the configured DMSAPI_CONTENT_STORAGE backend by default")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--purge', action='store_true', help="Delete blobs that are no longer referenced afterwards")
+
+    def handle(self, *args, **options):
+        storage = build_content_storage(options['to'])
+        if storage.name == 'blob':
+            pending = Document.objects.filter(content__isnull=False)
+        else:
+            pending = Document.objects.filter(blob__isnull=False)
+
+        moved = total_bytes = last_id = 0
+        while True:
+            with transaction.atomic():
+                # Locked until the batch is written, so a concurrent edit can
+                # neither be overwritten nor release the blob read here
+                batch = list(pending.select_for_update().filter(id__gt=last_id).order_by('id').only('id', 'content', 'blob')[:options['batch_size']])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                if storage.name == 'inline':
+                    texts = blob_texts(document.blob_id for document in batch)
+                    for document in batch:
+                        document.content = texts[document.blob_id]
+                total_bytes += sum(len(document.content.encode()) for document in batch)
+
+                storage.store(batch)
+                # bulk_update leaves updated_at alone, the documents did not change
+                Document.objects.bulk_update(batch, ['content', 'blob'])
+            moved += sum(1 for document in batch if (document.blob_id is not None) == (storage.name == 'blob'))
+            self.stdout.write("%d documents processed" % moved)
+
+        self.stdout.write(self.style.SUCCESS("Moved %d documents (%d bytes of content) to %s storage" % (moved, total_bytes, storage.name)))
+        if options['purge']:
+            self.stdout.write(self.style.SUCCESS("Purged %d unreferenced blobs" % purge_blobs()))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dmsapi.tree import count_drifted_folders, rebuild_child_counts
+
+
+class Command(BaseCommand):
+    help = "Recomputes the subfolder/document counters of every folder from the actual rows"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = count_drifted_folders()
+            total = rebuild_child_counts()
+
+        self.stdout.write(self.style.SUCCESS("Rebuilt counters of %d folders, %d had drifted" % (total, drifted)))
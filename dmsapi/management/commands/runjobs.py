@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from dmsapi.jobs import WorkerPool
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help="Number of worker threads")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        pool = WorkerPool(options['concurrency'], options['poll_interval'])
+        self.stdout.write("Running jobs with %d workers" % options['concurrency'])
+        try:
+            pool.run(once=options['once'])
+        except KeyboardInterrupt:
+            pool.stop()
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
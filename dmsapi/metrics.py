@@ -0,0 +1,276 @@
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+
+DEFAULT_METRICS = {
+    # Record request metrics and serve them at /metrics
+    'ENABLED': True,
+    # Directory shared by the worker processes, each writing its own file.
+    # None keeps the metrics in memory, for a single process.
+    'DIRECTORY': None,
+    # Upper bounds in seconds of the request duration histogram buckets
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUESTS = 'dmsapi_http_requests_total'
+DURATION = 'dmsapi_http_request_duration_seconds'
+IN_FLIGHT = 'dmsapi_http_requests_in_flight'
+QUERIES = 'dmsapi_db_queries_total'
+QUERY_TIME = 'dmsapi_db_query_duration_seconds_total'
+CACHE_LOOKUPS = 'dmsapi_detail_cache_lookups_total'
+CACHE_HIT_RATIO = 'dmsapi_detail_cache_hit_ratio'
+
+METRICS = {
+    REQUESTS: ('counter', "Requests answered, by method, URL pattern and status code."),
+    DURATION: ('histogram', "Time spent answering requests, by method and URL pattern."),
+    IN_FLIGHT: ('gauge', "Requests being answered by a view, by URL pattern."),
+    QUERIES: ('counter', "SQL queries run by requests, by URL pattern."),
+    QUERY_TIME: ('counter', "Time spent in SQL queries by requests, by URL pattern."),
+    CACHE_LOOKUPS: ('counter', "Detail cache lookups, by result."),
+    CACHE_HIT_RATIO: ('gauge', "Share of the detail cache lookups that were hits."),
+}
+# Values of processes that exited are dropped for these
+LIVE_METRICS = (IN_FLIGHT,)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def metrics_setting(name):
+    return {**DEFAULT_METRICS, **getattr(settings, 'DMSAPI_METRICS', {})}[name]
+
+
+class MemoryStore:
+    """
+    Sample values of one process, keyed by ``(name, labels)``.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, changes):
+        with self.lock:
+            for key, amount in changes:
+                self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self.lock:
+            return list(self.values.items())
+
+
+class FileStore(MemoryStore):
+    """
+    Sample values of one process in a memory-mapped file of ``directory``,
+    which the other processes read to aggregate them. The file is named
+    after the pid and a random suffix, as a new process reusing the pid of
+    one that exited must not overwrite its counters.
+
+    The file is a used-size header followed by entries made of the length
+    of a JSON encoded key, the key padded to 8 bytes and a double. Values
+    are updated in place and new entries are written before the header
+    grows over them, so readers never see a partial entry.
+    """
+
+    HEADER = struct.Struct('<Q')
+    LENGTH = struct.Struct('<I')
+    VALUE = struct.Struct('<d')
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, directory):
+        super().__init__()
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, 'metrics-%d-%s.db' % (self.pid, uuid.uuid4().hex))
+        self.file = open(self.path, 'x+b')
+        self.file.truncate(self.INITIAL_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), self.INITIAL_SIZE)
+        self.used = self.HEADER.size
+        self.HEADER.pack_into(self.map, 0, self.used)
+        self.positions = {}
+
+    def inc(self, changes):
+        with self.lock:
+            for key, amount in changes:
+                position = self.positions.get(key)
+                if position is None:
+                    position = self.allocate(key)
+                value = self.VALUE.unpack_from(self.map, position)[0]
+                self.VALUE.pack_into(self.map, position, value + amount)
+
+    def allocate(self, key):
+        encoded = json.dumps(key).encode()
+        padded = len(encoded) + (-(self.LENGTH.size + len(encoded)) % 8)
+        size = self.LENGTH.size + padded + self.VALUE.size
+        while self.used + size > len(self.map):
+            self.file.truncate(len(self.map) * 2)
+            self.map.resize(len(self.map) * 2)
+
+        self.LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + self.LENGTH.size:self.used + self.LENGTH.size + len(encoded)] = encoded
+        position = self.used + self.LENGTH.size + padded
+        self.VALUE.pack_into(self.map, position, 0.0)
+        self.used += size
+        self.HEADER.pack_into(self.map, 0, self.used)
+        self.positions[key] = position
+        return position
+
+    def samples(self):
+        with self.lock:
+            return list(self.read(self.map))
+
+    @classmethod
+    def read(cls, data):
+        used = cls.HEADER.unpack_from(data, 0)[0]
+        offset = cls.HEADER.size
+        while offset < used:
+            length = cls.LENGTH.unpack_from(data, offset)[0]
+            name, labels = json.loads(data[offset + cls.LENGTH.size:offset + cls.LENGTH.size + length])
+            offset += cls.LENGTH.size + length + (-(cls.LENGTH.size + length) % 8)
+            yield (name, tuple(map(tuple, labels))), cls.VALUE.unpack_from(data, offset)[0]
+            offset += cls.VALUE.size
+
+
+def read_samples(path):
+    with open(path, 'rb') as file:
+        return list(FileStore.read(file.read()))
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def get_store():
+    global _store
+    with _store_lock:
+        # A forked worker writes its own file
+        if _store is None or isinstance(_store, FileStore) and _store.pid != os.getpid():
+            directory = metrics_setting('DIRECTORY')
+            _store = FileStore(directory) if directory else MemoryStore()
+        return _store
+
+def reset_store(**kwargs):
+    global _store
+    if kwargs.get('setting') in (None, 'DMSAPI_METRICS'):
+        with _store_lock:
+            _store = None
+
+setting_changed.connect(reset_store)
+
+
+def route_label(match):
+    return "unmatched" if match is None else "/" + match.route
+
+def request_started(route):
+    get_store().inc([((IN_FLIGHT, (('route', route),)), 1)])
+
+def request_finished(method, route, status, duration, recorder, in_flight=True):
+    """
+    Records an answered request. Only a few in-place additions under one
+    lock, so that it costs microseconds.
+    """
+    buckets = metrics_setting('BUCKETS')
+    labels = (('method', method), ('route', route))
+    get_store().inc([
+        ((IN_FLIGHT, (('route', route),)), -1 if in_flight else 0),
+        ((REQUESTS, labels + (('status', str(status)),)), 1),
+        ((DURATION + '_bucket', labels + (('le', bisect_left(buckets, duration)),)), 1),
+        ((DURATION + '_sum', labels), duration),
+        ((DURATION + '_count', labels), 1),
+        ((QUERIES, (('route', route),)), recorder.count),
+        ((QUERY_TIME, (('route', route),)), recorder.duration),
+    ])
+
+def cache_lookup(hit):
+    get_store().inc([((CACHE_LOOKUPS, (('result', 'hit' if hit else 'miss'),)), 1)])
+
+
+def collect():
+    """
+    The samples of every process, summed by key. Gauges of the processes
+    that exited are left out.
+    """
+    directory = metrics_setting('DIRECTORY')
+    if not directory:
+        sources = [(None, get_store().samples())]
+    else:
+        get_store()
+        sources = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.db')):
+            pid = int(os.path.basename(path).split('-')[1])
+            try:
+                sources.append((pid, read_samples(path)))
+            except (OSError, ValueError, struct.error):
+                continue
+
+    totals = {}
+    for pid, samples in sources:
+        alive = pid is None or process_alive(pid)
+        for key, value in samples:
+            if alive or key[0] not in LIVE_METRICS:
+                totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(int(value)) if value == int(value) else repr(value)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{%s}" % ",".join('%s="%s"' % (name, escape(value)) for name, value in labels)
+
+def histogram_lines(totals):
+    buckets = list(metrics_setting('BUCKETS')) + [math.inf]
+    series = {}
+    for (name, labels), value in totals.items():
+        if name == DURATION + '_bucket':
+            *labels, (_, index) = labels
+            counts = series.setdefault(tuple(labels), [0.0] * len(buckets))
+            counts[min(int(index), len(buckets) - 1)] += value
+
+    lines = []
+    for labels in sorted(series):
+        cumulative = 0.0
+        for bound, count in zip(buckets, series[labels]):
+            cumulative += count
+            lines.append("%s_bucket%s %s" % (DURATION, format_labels(labels + (('le', format_value(float(bound))),)), format_value(cumulative)))
+        lines.append("%s_sum%s %s" % (DURATION, format_labels(labels), format_value(totals.get((DURATION + '_sum', labels), 0.0))))
+        lines.append("%s_count%s %s" % (DURATION, format_labels(labels), format_value(totals.get((DURATION + '_count', labels), 0.0))))
+    return lines
+
+def render():
+    """
+    The metrics of every process in the Prometheus text format.
+    """
+    totals = collect()
+    hits = totals.get((CACHE_LOOKUPS, (('result', 'hit'),)), 0.0)
+    misses = totals.get((CACHE_LOOKUPS, (('result', 'miss'),)), 0.0)
+    totals[(CACHE_HIT_RATIO, ())] = hits / (hits + misses) if hits + misses else 0.0
+
+    lines = []
+    for name, (kind, help) in METRICS.items():
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s %s" % (name, kind))
+        if kind == 'histogram':
+            lines.extend(histogram_lines(totals))
+            continue
+        for (_, labels), value in sorted(item for item in totals.items() if item[0][0] == name):
+            lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from contextlib import nullcontext
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+from .instrumentation import instrumentation_setting, log_request, recording, server_timing
+from .routers import STICKY_COOKIE, replicas_setting, use_primary
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+def pins_primary(request):
+    """
+    Whether ``request`` reads from the primary only: it may write, or its
+    client wrote less than STICKY_SECONDS ago.
+    """
+    if request.method not in SAFE_METHODS:
+        return True
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def primary_reads(request):
+    return use_primary() if pins_primary(request) else nullcontext()
+
+def stick_to_primary(request, response):
+    if request.method not in SAFE_METHODS:
+        seconds = replicas_setting('STICKY_SECONDS')
+        response.set_cookie(STICKY_COOKIE, "%.3f" % (time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax')
+    return response
+
+
+@sync_and_async_middleware
+def replica_stickiness_middleware(get_response):
+    """
+    Read-your-writes for clients of the replica router: writing requests
+    and the requests that follow them for STICKY_SECONDS (tracked with a
+    cookie) read from the primary.
+    """
+    if not replicas_setting('ALIASES'):
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with primary_reads(request):
+                response = await get_response(request)
+            return stick_to_primary(request, response)
+    else:
+        def middleware(request):
+            with primary_reads(request):
+                response = get_response(request)
+            return stick_to_primary(request, response)
+    return middleware
+
+
+def instrument(request, response, recorder, started):
+    duration = time.perf_counter() - started
+    response['Server-Timing'] = server_timing(recorder, duration)
+    log_request(request, response, recorder, duration)
+    return response
+
+
+@sync_and_async_middleware
+def query_instrumentation_middleware(get_response):
+    """
+    Records the number, duration and duplicates of the queries run by each
+    request and reports them in a Server-Timing header and a log record,
+    a warning for requests slower than SLOW_REQUEST_MS. Queries run while a
+    streaming response is consumed come too late to be counted.
+    """
+    if not instrumentation_setting('ENABLED'):
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            with recording() as recorder:
+                response = await get_response(request)
+            return instrument(request, response, recorder, started)
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            with recording() as recorder:
+                response = get_response(request)
+            return instrument(request, response, recorder, started)
+    return middleware
+
+
+def request_started(request, view_func, view_args, view_kwargs):
+    # Called once the URL is resolved, which saves resolving it again
+    request.metrics_route = metrics.route_label(request.resolver_match)
+    metrics.request_started(request.metrics_route)
+
+def request_finished(request, status, started, recorder):
+    route = getattr(request, 'metrics_route', None)
+    in_flight = route is not None
+    if route is None:
+        route = metrics.route_label(getattr(request, 'resolver_match', None))
+    metrics.request_finished(request.method, route, status, time.perf_counter() - started, recorder, in_flight)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Records the duration, status code and query count of each request, and
+    the requests in flight in a view, by URL pattern, for the /metrics
+    endpoint.
+    """
+    if not metrics.metrics_setting('ENABLED'):
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            status = 500
+            with recording() as recorder:
+                try:
+                    response = await get_response(request)
+                    status = response.status_code
+                finally:
+                    request_finished(request, status, started, recorder)
+            return response
+
+        async def process_view(*args):
+            request_started(*args)
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            status = 500
+            with recording() as recorder:
+                try:
+                    response = get_response(request)
+                    status = response.status_code
+                finally:
+                    request_finished(request, status, started, recorder)
+            return response
+
+        process_view = request_started
+    middleware.process_view = process_view
+    return middleware
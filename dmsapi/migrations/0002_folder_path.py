@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    # Paths are computed in memory from one read of the tree, top down
+    Folder = apps.get_model('dmsapi', 'Folder')
+    children = {}
+    for folder_id, parent_id in Folder.objects.values_list('id', 'parent_id'):
+        children.setdefault(parent_id, []).append(folder_id)
+
+    paths = {}
+    level = [(folder_id, "/") for folder_id in children.get(None, [])]
+    while level:
+        next_level = []
+        for folder_id, path in level:
+            prefix = "%s%d/" % (path, folder_id)
+            for child_id in children.get(folder_id, []):
+                paths[child_id] = prefix
+                next_level.append((child_id, prefix))
+        level = next_level
+
+    Folder.objects.bulk_update([Folder(id=id, path=path) for id, path in paths.items()], ['path'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dmsapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(db_index=True, default='/', editable=False, max_length=1024),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
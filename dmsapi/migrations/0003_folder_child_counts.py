@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_children(apps, schema_editor):
+    Folder = apps.get_model('dmsapi', 'Folder')
+    Document = apps.get_model('dmsapi', 'Document')
+
+    def child_count(model):
+        children = model.objects.filter(parent=OuterRef('pk')).order_by().values('parent').annotate(count=Count('id'))
+        return Coalesce(Subquery(children.values('count')), 0)
+
+    Folder.objects.update(subfolder_count=child_count(Folder), document_count=child_count(Document))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dmsapi', '0002_folder_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='subfolder_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='document_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_children, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='folder',
+            name='has_children',
+        ),
+    ]
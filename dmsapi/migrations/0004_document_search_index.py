@@ -0,0 +1,86 @@
+from django.db import migrations
+
+
+POSTGRES_FORWARD = [
+    "ALTER TABLE dmsapi_document ADD COLUMN search_vector tsvector",
+    """
+    CREATE FUNCTION dmsapi_document_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('pg_catalog.english', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('pg_catalog.english', coalesce(NEW.content, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, content ON dmsapi_document
+    FOR EACH ROW EXECUTE PROCEDURE dmsapi_document_search_vector()
+    """,
+    "UPDATE dmsapi_document SET name = name",
+    "CREATE INDEX dmsapi_document_search_vector_idx ON dmsapi_document USING gin (search_vector)",
+]
+POSTGRES_BACKWARD = [
+    "DROP TRIGGER dmsapi_document_search_vector_update ON dmsapi_document",
+    "DROP FUNCTION dmsapi_document_search_vector()",
+    "ALTER TABLE dmsapi_document DROP COLUMN search_vector",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE dmsapi_document_fts USING fts5(
+        name, content, content='dmsapi_document', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_fts_insert AFTER INSERT ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(rowid, name, content) VALUES (new.id, new.name, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_fts_delete AFTER DELETE ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(dmsapi_document_fts, rowid, name, content) VALUES ('delete', old.id, old.name, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_fts_update AFTER UPDATE OF name, content ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(dmsapi_document_fts, rowid, name, content) VALUES ('delete', old.id, old.name, old.content);
+        INSERT INTO dmsapi_document_fts(rowid, name, content) VALUES (new.id, new.name, new.content);
+    END
+    """,
+    "INSERT INTO dmsapi_document_fts(dmsapi_document_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER dmsapi_document_fts_update",
+    "DROP TRIGGER dmsapi_document_fts_delete",
+    "DROP TRIGGER dmsapi_document_fts_insert",
+    "DROP TABLE dmsapi_document_fts",
+]
+
+
+def run_statements(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index of Document.name and Document.content, maintained by the
+    database itself so every write path (including bulk_create and raw
+    updates) keeps it current. Other database vendors get no index and fall
+    back to an unindexed scan.
+    """
+
+    dependencies = [
+        ('dmsapi', '0003_folder_child_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_statements({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
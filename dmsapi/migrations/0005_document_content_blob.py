@@ -0,0 +1,153 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from dmsapi.storage import register_sqlite_functions
+
+
+POSTGRES_DOCUMENT_VECTOR = """
+    CREATE OR REPLACE FUNCTION dmsapi_document_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('pg_catalog.english', coalesce(NEW.name, '')), 'A') ||
+            setweight(%s, 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+POSTGRES_TRIGGER = """
+    CREATE TRIGGER dmsapi_document_search_vector_update
+    BEFORE INSERT OR UPDATE OF %s ON dmsapi_document
+    FOR EACH ROW EXECUTE PROCEDURE dmsapi_document_search_vector()
+"""
+
+POSTGRES_FORWARD = [
+    "ALTER TABLE dmsapi_contentblob ADD COLUMN search_vector tsvector",
+    POSTGRES_DOCUMENT_VECTOR % """CASE WHEN NEW.content IS NULL
+        THEN coalesce((SELECT b.search_vector FROM dmsapi_contentblob b WHERE b.hash = NEW.blob_id), ''::tsvector)
+        ELSE to_tsvector('pg_catalog.english', NEW.content) END""",
+    "DROP TRIGGER dmsapi_document_search_vector_update ON dmsapi_document",
+    POSTGRES_TRIGGER % "name, content, blob_id",
+]
+POSTGRES_BACKWARD = [
+    POSTGRES_DOCUMENT_VECTOR % "to_tsvector('pg_catalog.english', coalesce(NEW.content, ''))",
+    "DROP TRIGGER dmsapi_document_search_vector_update ON dmsapi_document",
+    POSTGRES_TRIGGER % "name, content",
+    "ALTER TABLE dmsapi_contentblob DROP COLUMN search_vector",
+]
+
+SQLITE_TEXT = "coalesce(%(row)s.content, (SELECT dmsapi_inflate(b.codec, b.data) FROM dmsapi_contentblob b WHERE b.hash = %(row)s.blob_id))"
+
+# Altering Document.content rebuilds the table on SQLite, which drops its triggers
+SQLITE_FORWARD = [
+    "DROP TRIGGER IF EXISTS dmsapi_document_fts_update",
+    "DROP TRIGGER IF EXISTS dmsapi_document_fts_delete",
+    "DROP TRIGGER IF EXISTS dmsapi_document_fts_insert",
+    "DROP TABLE dmsapi_document_fts",
+    """
+    CREATE VIEW dmsapi_document_text AS
+    SELECT d.id, d.name, coalesce(d.content, dmsapi_inflate(b.codec, b.data)) AS content
+    FROM dmsapi_document d LEFT JOIN dmsapi_contentblob b ON b.hash = d.blob_id
+    """,
+    """
+    CREATE VIRTUAL TABLE dmsapi_document_fts USING fts5(
+        name, content, content='dmsapi_document_text', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_fts_insert AFTER INSERT ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(rowid, name, content) VALUES (new.id, new.name, %s);
+    END
+    """ % (SQLITE_TEXT % {'row': 'new'}),
+    """
+    CREATE TRIGGER dmsapi_document_fts_delete AFTER DELETE ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(dmsapi_document_fts, rowid, name, content) VALUES ('delete', old.id, old.name, %s);
+    END
+    """ % (SQLITE_TEXT % {'row': 'old'}),
+    """
+    CREATE TRIGGER dmsapi_document_fts_update AFTER UPDATE OF name, content, blob_id ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(dmsapi_document_fts, rowid, name, content) VALUES ('delete', old.id, old.name, %s);
+        INSERT INTO dmsapi_document_fts(rowid, name, content) VALUES (new.id, new.name, %s);
+    END
+    """ % (SQLITE_TEXT % {'row': 'old'}, SQLITE_TEXT % {'row': 'new'}),
+    "INSERT INTO dmsapi_document_fts(dmsapi_document_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER dmsapi_document_fts_update",
+    "DROP TRIGGER dmsapi_document_fts_delete",
+    "DROP TRIGGER dmsapi_document_fts_insert",
+    "DROP TABLE dmsapi_document_fts",
+    "DROP VIEW dmsapi_document_text",
+    """
+    CREATE VIRTUAL TABLE dmsapi_document_fts USING fts5(
+        name, content, content='dmsapi_document', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_fts_insert AFTER INSERT ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(rowid, name, content) VALUES (new.id, new.name, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_fts_delete AFTER DELETE ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(dmsapi_document_fts, rowid, name, content) VALUES ('delete', old.id, old.name, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER dmsapi_document_fts_update AFTER UPDATE OF name, content ON dmsapi_document BEGIN
+        INSERT INTO dmsapi_document_fts(dmsapi_document_fts, rowid, name, content) VALUES ('delete', old.id, old.name, old.content);
+        INSERT INTO dmsapi_document_fts(rowid, name, content) VALUES (new.id, new.name, new.content);
+    END
+    """,
+    "INSERT INTO dmsapi_document_fts(dmsapi_document_fts) VALUES ('rebuild')",
+]
+
+
+def run_statements(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            register_sqlite_functions(schema_editor.connection.connection)
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    """
+    Optional storage of document bodies in shared, compressed blobs. The
+    search index keeps covering them: on PostgreSQL each blob carries its own
+    tsvector, on SQLite the FTS table reads a view that inflates blob bodies.
+    """
+
+    dependencies = [
+        ('dmsapi', '0004_document_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentBlob',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('codec', models.CharField(max_length=8)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='content',
+            field=models.TextField(blank=True, default='', null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='blob',
+            field=models.ForeignKey(blank=True, default=None, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='dmsapi.contentblob'),
+        ),
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_statements({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
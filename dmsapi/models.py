@@ -1,10 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+
+# Query-side equivalent of Folder.has_children, for use in annotate()/values()
+HAS_CHILDREN = ExpressionWrapper(Q(subfolder_count__gt=0) | Q(document_count__gt=0), output_field=BooleanField())
 
 # Create your models here.
 class Folder(models.Model):
     name = models.CharField(max_length=30, null=False)
     parent = models.ForeignKey('self', default=None, blank=True, null=True, on_delete=models.CASCADE)
-    has_children = models.BooleanField(default=False, blank=True, null=False)
+    subfolder_count = models.PositiveIntegerField(default=0, editable=False)
+    document_count = models.PositiveIntegerField(default=0, editable=False)
+    # Materialized path of ancestor ids, e.g. "/1/5/" for a child of folder 5
+    path = models.CharField(max_length=1024, default="/", editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -15,10 +24,59 @@ class Folder(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def has_children(self):
+        return self.subfolder_count > 0 or self.document_count > 0
+
+    @property
+    def subtree_prefix(self):
+        return "%s%d/" % (self.path, self.id)
+
+    def save(self, *args, **kwargs):
+        old_prefix = self.subtree_prefix if self.id is not None else None
+        self.path = "/" if self.parent is None else self.parent.subtree_prefix
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'parent' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'path'}
+
+        super().save(*args, **kwargs)
+
+        if old_prefix is not None and old_prefix != self.subtree_prefix:
+            Folder.move_subtree_paths(old_prefix, self.subtree_prefix)
+
+    @staticmethod
+    def move_subtree_paths(old_prefix, new_prefix):
+        """
+        Rewrites the paths of the folders below ``old_prefix`` with one UPDATE.
+        ``path`` is not part of any payload, so their ``updated_at`` and
+        cached payloads are left alone.
+        """
+        return Folder.objects.filter(path__startswith=old_prefix).update(
+            path=Concat(Value(new_prefix), Substr('path', len(old_prefix) + 1), output_field=models.CharField()),
+        )
+
+class ContentBlob(models.Model):
+    """
+    Compressed document body shared by every document with the same content,
+    keyed by the SHA-256 of its UTF-8 encoding.
+    """
+    hash = models.CharField(max_length=64, primary_key=True)
+    codec = models.CharField(max_length=8)
+    data = models.BinaryField()
+    # Uncompressed size in bytes
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.hash
+
 class Document(models.Model):
     name = models.CharField(max_length=30, null=False)
     parent = models.ForeignKey(Folder, default=None, blank=True, null=True, on_delete=models.CASCADE)
-    content = models.TextField(default="", blank=True)
+    # NULL when the body is stored in ``blob`` instead
+    content = models.TextField(default="", blank=True, null=True)
+    blob = models.ForeignKey(ContentBlob, default=None, blank=True, null=True, editable=False, on_delete=models.PROTECT)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -29,6 +87,19 @@ class Document(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        from .storage import store_content
+
+        update_fields = kwargs.get('update_fields')
+        if 'content' in self.get_deferred_fields() or (update_fields is not None and 'content' not in update_fields):
+            return super().save(*args, **kwargs)
+
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'blob'}
+        with transaction.atomic():
+            store_content([self])
+            super().save(*args, **kwargs)
+
 class Topic(models.Model):
     name = models.CharField(max_length=30, null=False, unique=True)
     short_desc = models.CharField(max_length=60, null=False)
@@ -67,3 +138,45 @@ class DocumentTopic(models.Model):
 
     def __str__(self):
         return str(self.document.id) + " " + str(self.topic.id)
+
+class Job(models.Model):
+    """
+    Unit of background work, claimed and run by the `runjobs` workers.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUSES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    )
+
+    kind = models.CharField(max_length=64)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=QUEUED)
+    progress = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(default=None, blank=True, null=True)
+    error = models.TextField(default="", blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=64, default="", blank=True)
+    heartbeat_at = models.DateTimeField(default=None, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(default=None, blank=True, null=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return "%s #%d" % (self.kind, self.id)
@@ -0,0 +1,104 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import get_detail_cache
+from .models import Folder, Document
+from .tree import apply_child_count_deltas
+
+
+class MoveError(Exception):
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def lock_rows(model, ids, parent_id):
+    """
+    Locks and reads the moved rows and the target folder. For folders this
+    is a single query, which is also all the cycle check needs.
+    """
+    if model == Folder:
+        locked = set(ids) if parent_id is None else set(ids) | {parent_id}
+        rows = Folder.objects.select_for_update().filter(id__in=locked).order_by('id').values('id', 'name', 'parent', 'path')
+        rows = {row['id']: row for row in rows}
+        target = rows.get(parent_id) if parent_id in ids else rows.pop(parent_id, None)
+        return rows, target
+
+    rows = Document.objects.select_for_update().filter(id__in=ids).order_by('id').values('id', 'name', 'parent')
+    target = None
+    if parent_id is not None:
+        target = Folder.objects.select_for_update().filter(id=parent_id).values('id', 'path').first()
+    return {row['id']: row for row in rows}, target
+
+def move_nodes(model, ids, parent_id):
+    """
+    Moves the folders or documents ``ids`` under folder ``parent_id`` (None
+    for the top level) and returns the ids of the rows that changed parent.
+
+    Raises ``MoveError`` when a row or the target does not exist, when a
+    folder would end up below itself or when names would collide. The
+    materialized paths of moved subtrees and the child counters of the old
+    and new parents are updated in the same transaction.
+    """
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic():
+        rows, target = lock_rows(model, ids, parent_id)
+
+        unknown = [id for id in ids if id not in rows]
+        if unknown:
+            raise MoveError("Unknown %s ids: %s" % (model._meta.model_name, ", ".join(map(str, unknown))))
+        if parent_id is not None and target is None:
+            raise MoveError("Unknown parent folder %s" % parent_id)
+
+        if model == Folder and target is not None:
+            for row in rows.values():
+                if row['id'] == parent_id or target['path'].startswith("%s%d/" % (row['path'], row['id'])):
+                    raise MoveError("Folder %d cannot be moved below itself" % row['id'])
+
+        moved = [row for row in rows.values() if row['parent'] != parent_id]
+        if not moved:
+            return []
+        check_names(model, moved, parent_id)
+
+        moved_ids = [row['id'] for row in moved]
+        invalidated = list(moved_ids)
+        updated_at = timezone.now()
+        if model == Folder:
+            # Entries of the whole moved subtrees go, not only of their roots
+            below = Q()
+            for row in moved:
+                below |= Q(path__startswith="%s%d/" % (row['path'], row['id']))
+            invalidated += Folder.objects.filter(below).values_list('id', flat=True)
+
+            path = "/" if target is None else "%s%d/" % (target['path'], target['id'])
+            # Deepest first, so that moving a folder along with one of its
+            # descendants rewrites the descendant's subtree only once
+            for row in sorted(moved, key=lambda row: len(row['path']), reverse=True):
+                Folder.move_subtree_paths("%s%d/" % (row['path'], row['id']), "%s%d/" % (path, row['id']))
+            Folder.objects.filter(id__in=moved_ids).update(parent=parent_id, path=path, updated_at=updated_at)
+        else:
+            Document.objects.filter(id__in=moved_ids).update(parent=parent_id, updated_at=updated_at)
+
+        deltas = {parent_id: len(moved)}
+        for row in moved:
+            deltas[row['parent']] = deltas.get(row['parent'], 0) - 1
+        apply_child_count_deltas(model, deltas)
+        get_detail_cache().invalidate(model, invalidated)
+
+    return moved_ids
+
+def check_names(model, moved, parent_id):
+    names = Counter(row['name'] for row in moved)
+    duplicated = {name for name, count in names.items() if count > 1}
+    existing = set(
+        model.objects
+        .filter(parent=parent_id, name__in=names)
+        .exclude(id__in=[row['id'] for row in moved])
+        .values_list('name', flat=True)
+    )
+    if duplicated | existing:
+        raise MoveError("Name duplication not allowed: %s" % ", ".join(sorted(duplicated | existing)))
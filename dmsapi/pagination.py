@@ -0,0 +1,33 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key.
+
+    Pages are only produced when the client asks for them with ``limit`` or
+    ``cursor``, so plain list requests keep returning the full array. The
+    cursor is opaque to clients and encodes the last seen ``id``, which keeps
+    the cost of a deep page identical to the first one.
+    """
+    ordering = 'id'
+    page_size = None
+    default_page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        # DRF falls back to page_size, the full list here, on a bad limit
+        limit = request.query_params.get(self.page_size_query_param)
+        if limit is not None:
+            try:
+                valid = int(limit) > 0
+            except ValueError:
+                valid = False
+            if not valid:
+                raise ValidationError([{"message": "Parameter 'limit' must be a positive integer"}])
+        page_size = super().get_page_size(request)
+        if page_size is None and self.cursor_query_param in request.query_params:
+            return self.default_page_size
+        return page_size
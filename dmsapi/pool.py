@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+from collections import deque
+from functools import partial
+
+from django.db.utils import OperationalError
+
+
+DEFAULT_POOL = {
+    # Connections open at once, idle and in use, per process and database
+    'MAX_SIZE': 20,
+    # Idle connections are closed after this many seconds
+    'MAX_IDLE': 300,
+    # Connections are closed once this old, None keeps them forever
+    'MAX_LIFETIME': 3600,
+    # Seconds to wait for a connection when MAX_SIZE are in use
+    'TIMEOUT': 10,
+    # Connections idle for more than this many seconds are checked before reuse
+    'CHECK_AFTER': 30,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class PooledConnection:
+
+    def __init__(self, connection, created_at):
+        self.connection = connection
+        self.created_at = created_at
+        self.released_at = created_at
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections of one database, shared by the
+    threads (and so the WSGI requests or ASGI sync threads) of a process.
+
+    ``acquire()`` hands out the most recently released idle connection, so
+    that rarely needed ones age out, after checking it with ``check`` when
+    it sat idle for more than ``check_after`` seconds. When ``max_size``
+    connections are in use it waits up to ``timeout`` seconds for one to be
+    released and then raises ``PoolTimeout``.
+    """
+
+    def __init__(self, max_size, max_idle, max_lifetime, timeout, check_after):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check_after = check_after
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.in_use = {}
+        self.size = 0
+        self.pid = os.getpid()
+        self.counters = dict.fromkeys(('created', 'reused', 'closed', 'check_failures', 'waits', 'timeouts'), 0)
+
+    def expired(self, entry, now):
+        return self.max_lifetime is not None and now - entry.created_at >= self.max_lifetime
+
+    def take(self):
+        """
+        An idle connection, a slot to open a new one (None) or a timeout,
+        closing expired idle connections on the way.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            self.after_fork()
+            waited = False
+            while True:
+                now = time.monotonic()
+                stale = [entry for entry in self.idle if now - entry.released_at >= self.max_idle or self.expired(entry, now)]
+                for entry in stale:
+                    self.idle.remove(entry)
+                    self.discard(entry)
+                if self.idle:
+                    return self.idle.pop()
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None
+
+                if not waited:
+                    self.counters['waits'] += 1
+                    waited = True
+                if now >= deadline or not self.condition.wait(deadline - now):
+                    if not self.idle and self.size >= self.max_size:
+                        self.counters['timeouts'] += 1
+                        raise PoolTimeout("No database connection available after %ss (pool size %d)" % (self.timeout, self.max_size))
+
+    def acquire(self, connect, check):
+        while True:
+            entry = self.take()
+            if entry is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                entry = PooledConnection(connection, time.monotonic())
+                counter = 'created'
+            elif time.monotonic() - entry.released_at >= self.check_after and not check(entry.connection):
+                with self.condition:
+                    self.counters['check_failures'] += 1
+                    self.discard(entry)
+                continue
+            else:
+                counter = 'reused'
+
+            with self.condition:
+                self.counters[counter] += 1
+                self.in_use[id(entry.connection)] = entry
+            return entry.connection
+
+    def release(self, connection, reusable=True):
+        with self.condition:
+            entry = self.in_use.pop(id(connection), None)
+            if entry is None:
+                # Opened before a fork or by another pool
+                close_quietly(connection)
+                return
+            entry.released_at = time.monotonic()
+            if reusable and not self.expired(entry, entry.released_at):
+                self.idle.append(entry)
+            else:
+                self.discard(entry)
+            self.condition.notify()
+
+    def discard(self, entry):
+        # Called with the condition held
+        close_quietly(entry.connection)
+        self.size -= 1
+        self.counters['closed'] += 1
+        self.condition.notify()
+
+    def after_fork(self):
+        # Connections inherited from the parent process belong to it
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle.clear()
+            self.in_use.clear()
+            self.size = 0
+
+    def close_idle(self):
+        with self.condition:
+            while self.idle:
+                self.discard(self.idle.pop())
+
+    def stats(self):
+        with self.condition:
+            return {
+                "max_size": self.max_size,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": len(self.in_use),
+                **self.counters,
+            }
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+def pool_config(settings_dict):
+    return {**DEFAULT_POOL, **(settings_dict.get('POOL') or {})}
+
+def get_pool(alias, settings_dict):
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            config = pool_config(settings_dict)
+            pool = _pools[alias] = ConnectionPool(
+                config['MAX_SIZE'], config['MAX_IDLE'], config['MAX_LIFETIME'], config['TIMEOUT'], config['CHECK_AFTER'],
+            )
+        return pool
+
+def pool_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_idle()
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Database wrapper taking its connections from the process-wide pool of
+    its alias (configured by the ``POOL`` key of the database settings) and
+    giving them back when Django closes them, at the end of every request
+    with ``CONN_MAX_AGE = 0``.
+    """
+
+    def get_new_connection(self, conn_params):
+        connect = partial(super().get_new_connection, conn_params)
+        return get_pool(self.alias, self.settings_dict).acquire(connect, self.check_pooled_connection)
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # A connection closed inside an atomic block stays referenced by
+        # this wrapper, it must not be handed to another one
+        reusable = not self.in_atomic_block and (not self.errors_occurred or self.is_usable())
+        if reusable:
+            reusable = self.reset_pooled_connection(self.connection)
+        with self.wrap_database_errors:
+            get_pool(self.alias, self.settings_dict).release(self.connection, reusable)
+
+    def reset_pooled_connection(self, connection):
+        """
+        Ends any transaction left open, returns whether ``connection`` can
+        be reused.
+        """
+        try:
+            connection.rollback()
+        except self.Database.Error:
+            return False
+        return True
+
+    def check_pooled_connection(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            finally:
+                cursor.close()
+            connection.rollback()
+        except self.Database.Error:
+            return False
+        return True
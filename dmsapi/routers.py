@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+DEFAULT_REPLICAS = {
+    # Database aliases of the read replicas of the default database
+    'ALIASES': [],
+    # Seconds during which a client that wrote reads from the primary
+    'STICKY_SECONDS': 5,
+    # Replicas lagging by more than this many seconds are not read from
+    'MAX_LAG': 2,
+    # Seconds between two lag checks of a replica
+    'CHECK_INTERVAL': 5,
+}
+STICKY_COOKIE = 'dmsapi_primary_until'
+
+# Replication delay in seconds, by database vendor. Vendors without a query
+# (SQLite files used as local stand-ins) are taken as up to date.
+LAG_QUERIES = {
+    'postgresql': (
+        "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    ),
+}
+
+_replica_reads = ContextVar('dmsapi_replica_reads', default=False)
+_pinned = ContextVar('dmsapi_pinned', default=False)
+_checks = {}
+_checks_lock = threading.Lock()
+
+
+def replicas_setting(name):
+    return {**DEFAULT_REPLICAS, **getattr(settings, 'DMSAPI_REPLICAS', {})}[name]
+
+@contextmanager
+def replica_reads():
+    """
+    Lets the reads made inside the block go to a replica. Everything else
+    reads from the primary, so that code reading a row to update it never
+    sees a stale one.
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+@contextmanager
+def use_primary():
+    """
+    Sends every read made inside the block to the primary, replica reads
+    included.
+    """
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+def is_replica(alias):
+    return alias in replicas_setting('ALIASES')
+
+def replica_lag(alias):
+    query = LAG_QUERIES.get(connections[alias].vendor)
+    if query is None:
+        return 0
+    with connections[alias].cursor() as cursor:
+        cursor.execute(query)
+        lag = cursor.fetchone()[0]
+    return float(lag or 0)
+
+def replica_usable(alias):
+    """
+    Whether ``alias`` answers and lags by at most MAX_LAG seconds, checked
+    at most once per CHECK_INTERVAL seconds per process.
+    """
+    now = time.monotonic()
+    with _checks_lock:
+        checked = _checks.get(alias)
+    if checked is not None and now - checked[0] < replicas_setting('CHECK_INTERVAL'):
+        return checked[1]
+
+    try:
+        usable = replica_lag(alias) <= replicas_setting('MAX_LAG')
+    except DatabaseError:
+        usable = False
+    with _checks_lock:
+        _checks[alias] = (now, usable)
+    return usable
+
+def reset_replica_checks():
+    with _checks_lock:
+        _checks.clear()
+
+
+class ReplicaRouter:
+    """
+    Sends the reads made inside ``replica_reads()`` blocks to a random
+    usable replica, falling back to the primary when none is usable or when
+    the reads are pinned to it (``use_primary()``, requests of clients that
+    wrote recently). Writes always go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or _pinned.get():
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in replicas_setting('ALIASES') if replica_usable(alias)]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Also for rows read from a replica, which Django would save there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas_setting('ALIASES')}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,879 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import SwaggerUIRenderer
+from drf_yasg.utils import swagger_auto_schema
+
+from . import views
+from .conditional import Validators
+from .models import Job
+
+
+# Imported on the first request for the API docs (or by the generate_schema
+# command), so that workers load the views without drf_yasg.
+
+INFO = {
+    'title': "Spekit API",
+    'default_version': '1.0.0',
+    'description': "API documentation of Spekit App",
+}
+
+fields_parameter = openapi.Parameter(
+    'fields', openapi.IN_QUERY,
+    description=("Comma separated list of the fields to return, only those columns are read"),
+    type=openapi.TYPE_STRING,
+    required=False
+)
+list_parameters = [
+    fields_parameter,
+    openapi.Parameter(
+        'limit', openapi.IN_QUERY,
+        description=("Page size, enables cursor pagination when given"),
+        type=openapi.TYPE_INTEGER,
+        required=False
+    ),
+    openapi.Parameter(
+        'cursor', openapi.IN_QUERY,
+        description=("Opaque cursor taken from the 'next' or 'previous' link of a page"),
+        type=openapi.TYPE_STRING,
+        required=False
+    ),
+    openapi.Parameter(
+        'stream', openapi.IN_QUERY,
+        description=("Stream the full list instead of paginating it, either 'ndjson' or 'json'"),
+        type=openapi.TYPE_STRING,
+        enum=['ndjson', 'json'],
+        required=False
+    )
+]
+
+folder_pair_schema = openapi.Items(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'folder': openapi.Schema(type=openapi.TYPE_INTEGER),
+        'topic': openapi.Schema(type=openapi.TYPE_INTEGER)
+    }
+)
+document_pair_schema = openapi.Items(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'document': openapi.Schema(type=openapi.TYPE_INTEGER),
+        'topic': openapi.Schema(type=openapi.TYPE_INTEGER)
+    }
+)
+move_request_schema = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    required=['ids', 'parent'],
+    properties={
+        'ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_INTEGER)),
+        'parent': openapi.Schema(type=openapi.TYPE_INTEGER)
+    }
+)
+move_response_schema = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'moved': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_INTEGER))
+    }
+)
+job_schema = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+        'kind': openapi.Schema(type=openapi.TYPE_STRING),
+        'params': openapi.Schema(type=openapi.TYPE_OBJECT),
+        'status': openapi.Schema(type=openapi.TYPE_STRING, enum=[status for status, _ in Job.STATUSES]),
+        'progress': openapi.Schema(type=openapi.TYPE_OBJECT),
+        'result': openapi.Schema(type=openapi.TYPE_OBJECT),
+        'error': openapi.Schema(type=openapi.TYPE_STRING),
+        'attempts': openapi.Schema(type=openapi.TYPE_INTEGER),
+        'max_attempts': openapi.Schema(type=openapi.TYPE_INTEGER),
+        'run_after': openapi.Schema(type=openapi.TYPE_STRING),
+        'cancel_requested': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+        'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+        'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+        'finished_at': openapi.Schema(type=openapi.TYPE_STRING),
+    }
+)
+
+# swagger_auto_schema arguments of the view methods
+OPERATIONS = {
+    (views.FolderView, 'post'): dict(
+        operation_description=(
+            "Also accepts an array of up to 5000 items, created in one transaction. "
+            "The response then lists a per-item status with either 'data' or 'errors'."
+        ),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['name'],
+            properties={
+                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                'parent': openapi.Schema(type=openapi.TYPE_INTEGER)
+            }
+        ),
+        responses={
+            201: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    'subfolder_count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'document_count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.FolderView, 'get'): dict(
+        manual_parameters=list_parameters,
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Items(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    }
+                )
+            )
+        }
+    ),
+    (views.FolderView, 'delete'): dict(
+        operation_description=(
+            "Deletes the folder with its whole subtree in batches. With 'async' set to true the "
+            "deletion is queued as a job and 202 is returned, its progress is served at "
+            "/api/jobs/<job id>."
+        ),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['id'],
+            properties={
+                'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                'async': openapi.Schema(type=openapi.TYPE_BOOLEAN)
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={}
+            ),
+            202: job_schema
+        }
+    ),
+    (views.FolderMoveView, 'post'): dict(
+        operation_description=(
+            "Moves up to 5000 folders under the folder 'parent' (null for the top level) in one "
+            "transaction, a folder cannot be moved below itself. Returns the ids that changed parent."
+        ),
+        request_body=move_request_schema,
+        responses={
+            200: move_response_schema
+        }
+    ),
+    (views.FolderDetailsView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Folder id whose details are required as output"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            ),
+            fields_parameter
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    'subfolder_count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'document_count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.FolderDetailsView, 'patch'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Folder id whose details are to be modified"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            )
+        ],
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=[],
+            properties={
+                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                'parent': openapi.Schema(type=openapi.TYPE_INTEGER)
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    'subfolder_count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'document_count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.FolderTreeView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Folder id whose subtree is required as output"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            )
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    'folders': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_OBJECT)),
+                    'documents': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Items(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                            }
+                        )
+                    ),
+                }
+            )
+        }
+    ),
+    (views.DocumentView, 'post'): dict(
+        operation_description=(
+            "Also accepts an array of up to 5000 items, created in one transaction. "
+            "The response then lists a per-item status with either 'data' or 'errors'."
+        ),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['name'],
+            properties={
+                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                'content': openapi.Schema(type=openapi.TYPE_STRING)
+            }
+        ),
+        responses={
+            201: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'content': openapi.Schema(type=openapi.TYPE_STRING),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.DocumentView, 'get'): dict(
+        manual_parameters=list_parameters,
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Items(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    }
+                )
+            )
+        }
+    ),
+    (views.DocumentView, 'delete'): dict(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['id'],
+            properties={
+                'id': openapi.Schema(type=openapi.TYPE_INTEGER)
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={}
+            )
+        }
+    ),
+    (views.DocumentMoveView, 'post'): dict(
+        operation_description=(
+            "Moves up to 5000 documents under the folder 'parent' (null for the top level) in one "
+            "transaction. Returns the ids that changed parent."
+        ),
+        request_body=move_request_schema,
+        responses={
+            200: move_response_schema
+        }
+    ),
+    (views.DocumentDetailsView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Document id whose details are required as output"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            ),
+            openapi.Parameter(
+                'content', openapi.IN_QUERY,
+                description=("Pass 'false' to leave out the content, which is then never read from the database"),
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            fields_parameter
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'content': openapi.Schema(type=openapi.TYPE_STRING),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.DocumentDetailsView, 'patch'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Document id whose details are to be modified"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            )
+        ],
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=[],
+            properties={
+                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                'content': openapi.Schema(type=openapi.TYPE_STRING)
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'content': openapi.Schema(type=openapi.TYPE_STRING),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.DocumentContentView, 'get'): dict(
+        operation_description=(
+            "Streams the content of a document as UTF-8 text. Supports single byte ranges "
+            "through the Range header (206 Partial Content) and conditional requests."
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Document id whose content is required as output"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            ),
+            openapi.Parameter(
+                'Range', openapi.IN_HEADER,
+                description=("Single byte range, e.g. 'bytes=0-1023'"),
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ],
+        responses={
+            200: openapi.Schema(type=openapi.TYPE_STRING),
+            206: openapi.Schema(type=openapi.TYPE_STRING),
+        }
+    ),
+    (views.DocumentContentView, 'patch'): dict(
+        operation_description=(
+            "Edits the content with a list of operations instead of replacing it. Offsets and "
+            "lengths count characters (code points) of the base version, operations must be "
+            "sorted by offset and must not overlap. The base version is either given as 'base' "
+            "(the 'updated_at' of the document) or as an If-Match header holding the ETag of "
+            "the content, 412 is returned when the document changed since."
+        ),
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['ops'],
+            properties={
+                'base': openapi.Schema(type=openapi.TYPE_STRING),
+                'ops': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Items(
+                        type=openapi.TYPE_OBJECT,
+                        properties={
+                            'offset': openapi.Schema(type=openapi.TYPE_INTEGER),
+                            'delete': openapi.Schema(type=openapi.TYPE_INTEGER),
+                            'insert': openapi.Schema(type=openapi.TYPE_STRING),
+                        }
+                    )
+                )
+            }
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                'If-Match', openapi.IN_HEADER,
+                description=("ETag of the content the operations apply to"),
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.TopicView, 'post'): dict(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['name', 'short_desc'],
+            properties={
+                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                'long_desc': openapi.Schema(type=openapi.TYPE_STRING)
+            }
+        ),
+        responses={
+            201: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                    'long_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.TopicView, 'get'): dict(
+        manual_parameters=list_parameters,
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Items(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    }
+                )
+            )
+        }
+    ),
+    (views.TopicView, 'delete'): dict(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['id'],
+            properties={
+                'id': openapi.Schema(type=openapi.TYPE_INTEGER)
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={}
+            )
+        }
+    ),
+    (views.TopicDetailsView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Topic id whose details are required as output"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            ),
+            fields_parameter
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                    'long_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.TopicDetailsView, 'patch'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Topic id whose details are to be modified"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            )
+        ],
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=[],
+            properties={
+                'name': openapi.Schema(type=openapi.TYPE_STRING),
+                'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                'long_desc': openapi.Schema(type=openapi.TYPE_STRING)
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                    'long_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.SearchView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'q', openapi.IN_QUERY,
+                description=("Search terms, matched against document names and contents"),
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                'topic_name', openapi.IN_QUERY,
+                description=("Only return documents tagged with this topic"),
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'folder', openapi.IN_QUERY,
+                description=("Only return documents inside the subtree of this folder id"),
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'limit', openapi.IN_QUERY,
+                description=("Maximum number of results, at most 100"),
+                type=openapi.TYPE_INTEGER,
+                required=False
+            )
+        ],
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Items(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'name': openapi.Schema(type=openapi.TYPE_STRING),
+                        'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'rank': openapi.Schema(type=openapi.TYPE_NUMBER),
+                        'snippet': openapi.Schema(type=openapi.TYPE_STRING),
+                    }
+                )
+            )
+        }
+    ),
+    (views.JobDetailsView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'id', openapi.IN_QUERY,
+                description=("Job id whose status and progress are required as output"),
+                type=openapi.TYPE_INTEGER,
+                required=True
+            )
+        ],
+        responses={
+            200: job_schema
+        }
+    ),
+    (views.JobCancelView, 'post'): dict(
+        operation_description=(
+            "Cancels a queued job, or asks a running job to stop at its next progress report. "
+            "Finished jobs are left as they are."
+        ),
+        responses={
+            200: job_schema
+        }
+    ),
+    (views.CacheStatsView, 'get'): dict(
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'backend': openapi.Schema(type=openapi.TYPE_STRING),
+                    'hits': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'misses': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'hit_ratio': openapi.Schema(type=openapi.TYPE_NUMBER),
+                    'size': openapi.Schema(type=openapi.TYPE_INTEGER),
+                }
+            )
+        }
+    ),
+    (views.DatabasePoolStatsView, 'get'): dict(
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                additional_properties=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'max_size': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'size': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'idle': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'in_use': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'created': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'reused': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'closed': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'check_failures': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'waits': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'timeouts': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    }
+                )
+            )
+        }
+    ),
+    (views.MetricsView, 'get'): dict(
+        operation_description=(
+            "Request duration histograms, requests in flight, status code and SQL query counters by URL pattern, "
+            "and detail cache lookups, in the Prometheus text format. Summed over the worker processes when "
+            "DMSAPI_METRICS['DIRECTORY'] is set."
+        ),
+        responses={200: openapi.Schema(type=openapi.TYPE_STRING)}
+    ),
+    (views.FolderTopicView, 'post'): dict(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['folder', 'topic'],
+            properties={
+                'folder': openapi.Schema(type=openapi.TYPE_INTEGER),
+                'topic': openapi.Schema(type=openapi.TYPE_INTEGER)
+            }
+        ),
+        responses={
+            201: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'folder': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'topic': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.FolderTopicView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'topic_name', openapi.IN_QUERY,
+                description=("Topic name whose associated folders are required in the output"),
+                type=openapi.TYPE_STRING,
+                required=True
+            )
+        ] + list_parameters,
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Items(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    }
+                )
+            )
+        }
+    ),
+    (views.FolderTopicBulkView, 'post'): dict(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'add': openapi.Schema(type=openapi.TYPE_ARRAY, items=folder_pair_schema),
+                'remove': openapi.Schema(type=openapi.TYPE_ARRAY, items=folder_pair_schema),
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'added': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'removed': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'errors': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_OBJECT)),
+                }
+            )
+        }
+    ),
+    (views.DocumentTopicView, 'post'): dict(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['document', 'topic'],
+            properties={
+                'document': openapi.Schema(type=openapi.TYPE_INTEGER),
+                'topic': openapi.Schema(type=openapi.TYPE_INTEGER)
+            }
+        ),
+        responses={
+            201: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'document': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'topic': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
+                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
+                }
+            )
+        }
+    ),
+    (views.DocumentTopicView, 'get'): dict(
+        manual_parameters=[
+            openapi.Parameter(
+                'topic_name', openapi.IN_QUERY,
+                description=("Topic name whose associated documents are required in the output"),
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                'folder_name', openapi.IN_QUERY,
+                description=("Folder name whose documents are required in the output"),
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ] + list_parameters,
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Items(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    }
+                )
+            )
+        }
+    ),
+    (views.DocumentTopicBulkView, 'post'): dict(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'add': openapi.Schema(type=openapi.TYPE_ARRAY, items=document_pair_schema),
+                'remove': openapi.Schema(type=openapi.TYPE_ARRAY, items=document_pair_schema),
+            }
+        ),
+        responses={
+            200: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'added': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'removed': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'errors': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_OBJECT)),
+                }
+            )
+        }
+    ),
+}
+
+_applied = False
+_compiled = None
+_lock = threading.Lock()
+
+
+class CompiledSchema:
+    """
+    JSON encoded OpenAPI document, with the validators it is served under.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.validators = Validators('openapi', hashlib.sha256(body).hexdigest())
+
+
+def apply_operations():
+    # Sets what swagger_auto_schema decorators on the view methods used to
+    global _applied
+    if not _applied:
+        for (view_class, method), arguments in OPERATIONS.items():
+            swagger_auto_schema(**arguments)(view_class.__dict__[method])
+        _applied = True
+
+def generate_schema():
+    """
+    The OpenAPI document of the API routes, without a host so that clients
+    use the one serving it.
+    """
+    apply_operations()
+    generator = OpenAPISchemaGenerator(openapi.Info(**INFO))
+    return OpenAPICodecJson(validators=[]).encode(generator.get_schema(request=None, public=True))
+
+def get_schema():
+    """
+    The schema written by ``manage.py generate_schema`` to
+    DMSAPI_SCHEMA_FILE when it exists, generated on the first call
+    otherwise, then kept in memory.
+    """
+    global _compiled
+    with _lock:
+        if _compiled is None:
+            path = getattr(settings, 'DMSAPI_SCHEMA_FILE', None)
+            try:
+                with open(path, 'rb') as file:
+                    body = file.read()
+            except (TypeError, OSError):
+                body = generate_schema()
+            _compiled = CompiledSchema(body)
+        return _compiled
+
+def reset_schema():
+    global _compiled
+    with _lock:
+        _compiled = None
+
+def render_ui(request):
+    # The page only needs the title and version, it fetches the schema itself
+    swagger = openapi.Swagger(info=openapi.Info(**INFO), paths=openapi.Paths(paths={}), _prefix='/')
+    return SwaggerUIRenderer().render(swagger, renderer_context={'request': request})
@@ -0,0 +1,179 @@
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import ContentBlob, Document, DocumentTopic, Folder
+from .storage import blob_texts
+
+
+DOCUMENT_TABLE = Document._meta.db_table
+FOLDER_TABLE = Folder._meta.db_table
+DOCUMENT_TOPIC_TABLE = DocumentTopic._meta.db_table
+BLOB_TABLE = ContentBlob._meta.db_table
+FTS_TABLE = DOCUMENT_TABLE + '_fts'
+
+SNIPPET_START = '<b>'
+SNIPPET_STOP = '</b>'
+
+
+def filter_sql(topic_id=None, folder=None):
+    """
+    SQL conditions on ``d`` (the document table) restricting the results to a
+    topic and/or a folder subtree, with their parameters.
+    """
+    conditions, params = [], []
+    if topic_id is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM %s dt WHERE dt.document_id = d.id AND dt.topic_id = %%s)" % DOCUMENT_TOPIC_TABLE
+        )
+        params.append(topic_id)
+    if folder is not None:
+        conditions.append(
+            "d.parent_id IN (SELECT f.id FROM %s f WHERE f.id = %%s OR f.path LIKE %%s)" % FOLDER_TABLE
+        )
+        params += [folder.id, folder.subtree_prefix + '%']
+    return "".join(" AND " + condition for condition in conditions), params
+
+def plain_snippet(text, terms):
+    position = max(text.lower().find(terms[0].lower()), 0) if terms else 0
+    return text[max(position - 40, 0):position + 80]
+
+def fetch(sql, params):
+    with connections[router.db_for_read(Document)].cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """
+    Ranked search over a weighted tsvector column kept up to date by a
+    trigger and indexed with GIN (see migrations 0004 and 0005). Headlines
+    are only computed for the returned rows, in Python for bodies stored in
+    blobs.
+    """
+    config = 'pg_catalog.english'
+
+    def index_blobs(self, connection, texts):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "UPDATE %s SET search_vector = to_tsvector(%%s, %%s) WHERE hash = %%s" % BLOB_TABLE,
+                [(self.config, text, digest) for digest, text in texts.items()],
+            )
+
+    def search(self, query, topic_id, folder, limit):
+        conditions, params = filter_sql(topic_id, folder)
+        sql = (
+            "SELECT r.id, r.name, r.parent_id AS parent, r.rank, r.blob_id AS blob, "
+            "ts_headline(%%s, r.content, r.query, 'StartSel=%s, StopSel=%s, MaxFragments=2, MinWords=5, MaxWords=20') AS snippet "
+            "FROM ("
+            "SELECT d.id, d.name, d.parent_id, d.content, d.blob_id, q.query, ts_rank(d.search_vector, q.query) AS rank "
+            "FROM %s d, websearch_to_tsquery(%%s, %%s) AS q(query) "
+            "WHERE d.search_vector @@ q.query%s "
+            "ORDER BY rank DESC, d.id LIMIT %%s"
+            ") r ORDER BY r.rank DESC, r.id"
+        ) % (SNIPPET_START, SNIPPET_STOP, DOCUMENT_TABLE, conditions)
+        results = fetch(sql, [self.config, self.config, query] + params + [limit])
+
+        texts = blob_texts(result["blob"] for result in results if result["blob"] is not None)
+        terms = re.findall(r'\w+', query)
+        for result in results:
+            blob = result.pop("blob")
+            if blob is not None:
+                result["snippet"] = plain_snippet(texts[blob], terms)
+        return results
+
+
+class SQLiteSearchBackend:
+    """
+    Ranked search through an FTS5 table over the document text view, kept up
+    to date by triggers (see migrations 0004 and 0005). Blob bodies are read
+    through the ``dmsapi_inflate()`` function registered on each connection.
+    """
+
+    def index_blobs(self, connection, texts):
+        pass
+
+    @staticmethod
+    def match_expression(query):
+        terms = re.findall(r'\w+', query)
+        return " ".join('"%s"' % term for term in terms)
+
+    def search(self, query, topic_id, folder, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+
+        conditions, params = filter_sql(topic_id, folder)
+        sql = (
+            "SELECT d.id, d.name, d.parent_id AS parent, -bm25(%s, 10.0, 1.0) AS rank, "
+            "snippet(%s, 1, '%s', '%s', '...', 16) AS snippet "
+            "FROM %s JOIN %s d ON d.id = %s.rowid "
+            "WHERE %s MATCH %%s%s "
+            "ORDER BY bm25(%s, 10.0, 1.0), d.id LIMIT %%s"
+        ) % (FTS_TABLE, FTS_TABLE, SNIPPET_START, SNIPPET_STOP, FTS_TABLE, DOCUMENT_TABLE, FTS_TABLE, FTS_TABLE, conditions, FTS_TABLE)
+        return fetch(sql, [expression] + params + [limit])
+
+
+class ScanSearchBackend:
+    """
+    Unindexed fallback for databases without a full-text engine, matching
+    every term with a case-insensitive scan. Bodies stored in blobs are
+    matched in Python. Only meant for development.
+    """
+
+    def index_blobs(self, connection, texts):
+        pass
+
+    def search(self, query, topic_id, folder, limit):
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+
+        documents = Document.objects.all()
+        for term in terms:
+            documents = documents.filter(Q(name__icontains=term) | Q(content__icontains=term) | Q(content=None))
+        if topic_id is not None:
+            documents = documents.filter(documenttopic__topic=topic_id)
+        if folder is not None:
+            documents = documents.filter(Q(parent=folder.id) | Q(parent__path__startswith=folder.subtree_prefix))
+
+        rows = list(documents.values("id", "name", "parent", "content", "blob"))
+        texts = blob_texts(row["blob"] for row in rows if row["blob"] is not None)
+
+        results = []
+        for row in rows:
+            content = row["content"] if row["blob"] is None else texts[row["blob"]]
+            text = (row["name"] + " " + content).lower()
+            if not all(term.lower() in text for term in terms):
+                continue
+            results.append({
+                "id": row["id"],
+                "name": row["name"],
+                "parent": row["parent"],
+                "rank": sum(text.count(term.lower()) for term in terms),
+                "snippet": plain_snippet(content, terms),
+            })
+        results.sort(key=lambda result: (-result["rank"], result["id"]))
+        return results[:limit]
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+def search_documents(query, topic_id=None, folder=None, limit=20):
+    vendor = connections[router.db_for_read(Document)].vendor
+    backend = SEARCH_BACKENDS.get(vendor, ScanSearchBackend)()
+    return backend.search(query, topic_id, folder, limit)
+
+def index_blobs(texts):
+    """
+    Indexes the ``{hash: text}`` of newly stored blobs where the search
+    backend keeps a per-blob index.
+    """
+    connection = connections[router.db_for_write(ContentBlob)]
+    backend = SEARCH_BACKENDS.get(connection.vendor, ScanSearchBackend)()
+    backend.index_blobs(connection, texts)
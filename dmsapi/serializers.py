@@ -1,18 +1,44 @@
 from rest_framework import serializers
-from .models import Folder, Document, Topic, FolderTopic, DocumentTopic
+from .models import Folder, Document, Topic, FolderTopic, DocumentTopic, Job
+from .delta import MAX_PATCH_OPS
+from .storage import document_content
 
 
-class FolderSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """
+    Keeps only the fields named by the ``fields`` keyword argument, so that
+    callers can leave deferred columns untouched.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class FolderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    has_children = serializers.BooleanField(read_only=True)
+
     class Meta:
         model = Folder
-        fields = "__all__"
+        exclude = ("path",)
+
+class ContentField(serializers.CharField):
+    """
+    Document body, read from wherever the content storage put it.
+    """
+
+    def get_attribute(self, instance):
+        return document_content(instance)
+
+class DocumentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    content = ContentField(required=False, allow_blank=True)
 
-class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = "__all__"
+        exclude = ("blob",)
 
-class TopicSerializer(serializers.ModelSerializer):
+class TopicSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Topic
         fields = "__all__"
@@ -25,4 +51,64 @@ class FolderTopicSerializer(serializers.ModelSerializer):
 class DocumentTopicSerializer(serializers.ModelSerializer):
     class Meta:
         model = DocumentTopic
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        exclude = ("worker", "heartbeat_at")
+
+class BulkFolderItemSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=30)
+    parent = serializers.IntegerField(required=False, allow_null=True)
+    ref = serializers.CharField(required=False, max_length=64)
+    parent_ref = serializers.CharField(required=False, max_length=64)
+
+    def validate(self, attrs):
+        if attrs.get('parent') is not None and attrs.get('parent_ref') is not None:
+            raise serializers.ValidationError("Only one of 'parent' and 'parent_ref' may be given")
+        return attrs
+
+class BulkDocumentItemSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=30)
+    parent = serializers.IntegerField(required=False, allow_null=True)
+    content = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False, default="")
+
+class MoveSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    parent = serializers.IntegerField(allow_null=True)
+
+class FolderTopicPairSerializer(serializers.Serializer):
+    folder = serializers.IntegerField()
+    topic = serializers.IntegerField()
+
+class DocumentTopicPairSerializer(serializers.Serializer):
+    document = serializers.IntegerField()
+    topic = serializers.IntegerField()
+
+class BulkFolderTopicSerializer(serializers.Serializer):
+    add = FolderTopicPairSerializer(many=True, required=False, default=list)
+    remove = FolderTopicPairSerializer(many=True, required=False, default=list)
+
+class BulkDocumentTopicSerializer(serializers.Serializer):
+    add = DocumentTopicPairSerializer(many=True, required=False, default=list)
+    remove = DocumentTopicPairSerializer(many=True, required=False, default=list)
+
+class ContentOpSerializer(serializers.Serializer):
+    offset = serializers.IntegerField(min_value=0)
+    delete = serializers.IntegerField(min_value=0, default=0)
+    insert = serializers.CharField(allow_blank=True, trim_whitespace=False, default="")
+
+class ContentPatchSerializer(serializers.Serializer):
+    base = serializers.DateTimeField(required=False)
+    ops = ContentOpSerializer(many=True, allow_empty=False)
+
+    def validate_ops(self, ops):
+        if len(ops) > MAX_PATCH_OPS:
+            raise serializers.ValidationError("At most %d operations can be applied at once" % MAX_PATCH_OPS)
+        end = 0
+        for op in ops:
+            if op['offset'] < end:
+                raise serializers.ValidationError("Operations must be sorted by offset and must not overlap")
+            end = op['offset'] + op['delete']
+        return ops
@@ -0,0 +1,36 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import get_detail_cache
+from .instrumentation import install_query_recorder
+from .models import Folder, Document, Topic
+from .storage import register_sqlite_functions, release_blobs
+
+
+@receiver(post_save, sender=Folder)
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Folder)
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=Topic)
+def invalidate_detail_cache(sender, instance, **kwargs):
+    # post_delete is also sent for every row removed by an on_delete cascade
+    get_detail_cache().invalidate(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Document)
+def release_document_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        release_blobs([instance.blob_id])
+
+
+@receiver(connection_created)
+def register_database_functions(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        register_sqlite_functions(connection.connection)
+
+
+@receiver(connection_created)
+def record_queries(sender, connection, **kwargs):
+    install_query_recorder(connection)
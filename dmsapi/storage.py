@@ -0,0 +1,211 @@
+import hashlib
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db.models import F
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .models import ContentBlob
+
+
+DEFAULT_CONTENT_STORAGE = {
+    'BACKEND': 'inline',
+    'CODEC': 'zlib',
+    'LEVEL': 6,
+    # Bodies smaller than this many bytes stay inline
+    'MIN_SIZE': 256,
+}
+
+
+def compress(codec, data, level):
+    if codec == 'zlib':
+        return zlib.compress(data, level)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError("Unknown codec %r" % codec)
+
+def decompress(codec, data):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured("Reading zstd compressed documents requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown codec %r" % codec)
+
+def inflate(codec, data):
+    """
+    Text of a blob, also registered as the ``dmsapi_inflate()`` SQL function
+    on SQLite so the search triggers can index blob bodies.
+    """
+    if data is None:
+        return None
+    return decompress(codec, bytes(data)).decode()
+
+def register_sqlite_functions(connection):
+    connection.create_function('dmsapi_inflate', 2, inflate, deterministic=True)
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def acquire_blobs(texts, codec, level):
+    """
+    Takes one reference on the blob of each text (a text listed twice takes
+    two), inserting the blobs that do not exist yet. Returns the hashes in
+    the order of ``texts``.
+    """
+    from .search import index_blobs
+
+    encoded = [text.encode() for text in texts]
+    hashes = [content_hash(data) for data in encoded]
+    counts = Counter(hashes)
+    existing = set(ContentBlob.objects.filter(hash__in=counts).values_list('hash', flat=True))
+
+    new = {digest: data for digest, data in zip(hashes, encoded) if digest not in existing}
+    if new:
+        ContentBlob.objects.bulk_create(
+            [ContentBlob(hash=digest, codec=codec, data=compress(codec, data, level), size=len(data)) for digest, data in new.items()],
+            ignore_conflicts=True,
+        )
+        index_blobs({digest: data.decode() for digest, data in new.items()})
+
+    change_ref_counts(counts)
+    return hashes
+
+def release_blobs(hashes):
+    """
+    Drops one reference per listed hash. Unreferenced blobs are kept until
+    ``purge_blobs()`` so that a concurrent writer can still reuse them.
+    """
+    change_ref_counts({digest: -count for digest, count in Counter(hashes).items()})
+
+def change_ref_counts(counts):
+    by_delta = {}
+    for digest, delta in counts.items():
+        if digest is not None and delta != 0:
+            by_delta.setdefault(delta, []).append(digest)
+
+    for delta, hashes in by_delta.items():
+        ContentBlob.objects.filter(hash__in=hashes).update(ref_count=F('ref_count') + delta)
+
+def purge_blobs():
+    return ContentBlob.objects.filter(ref_count=0).delete()[0]
+
+
+class InlineStorage:
+    """
+    Keeps document bodies in ``Document.content``. Bodies that were moved to
+    blobs are brought back inline when they are next written.
+    """
+    name = 'inline'
+
+    def store(self, documents):
+        changed = [document for document in documents if document.content is not None]
+        release_blobs([document.blob_id for document in changed if document.blob_id is not None])
+        for document in changed:
+            document.blob_id = None
+
+
+class BlobStorage:
+    """
+    Keeps document bodies of at least ``min_size`` bytes compressed in
+    ``ContentBlob`` rows shared by identical documents, ``Document.content``
+    is then NULL.
+    """
+    name = 'blob'
+
+    def __init__(self, codec, level, min_size):
+        if codec == 'zstd' and zstandard is None:
+            raise ImproperlyConfigured("The zstd codec requires the 'zstandard' package")
+        if codec not in ('zlib', 'zstd'):
+            raise ImproperlyConfigured("Unknown content codec %r" % codec)
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+
+    def store(self, documents):
+        changed = [document for document in documents if document.content is not None]
+        release_blobs([document.blob_id for document in changed if document.blob_id is not None])
+
+        moved = [document for document in changed if len(document.content.encode()) >= self.min_size]
+        hashes = acquire_blobs([document.content for document in moved], self.codec, self.level)
+        for document in changed:
+            document.blob_id = None
+        for document, digest in zip(moved, hashes):
+            document._blob_text = (digest, document.content)
+            document.blob_id, document.content = digest, None
+
+
+def build_content_storage(backend=None):
+    config = {**DEFAULT_CONTENT_STORAGE, **getattr(settings, 'DMSAPI_CONTENT_STORAGE', {})}
+    backend = backend or config['BACKEND']
+    if backend == 'blob':
+        return BlobStorage(config['CODEC'], config['LEVEL'], config['MIN_SIZE'])
+    if backend == 'inline':
+        return InlineStorage()
+    raise ImproperlyConfigured("Unknown content storage %r" % backend)
+
+_content_storage = None
+
+def get_content_storage():
+    global _content_storage
+    if _content_storage is None:
+        _content_storage = build_content_storage()
+    return _content_storage
+
+def reset_content_storage(**kwargs):
+    global _content_storage
+    if kwargs.get('setting') in (None, 'DMSAPI_CONTENT_STORAGE'):
+        _content_storage = None
+
+setting_changed.connect(reset_content_storage)
+
+
+def store_content(documents):
+    """
+    Moves the bodies of ``documents`` assigned since they were loaded to
+    where the configured storage keeps them, updating blob references.
+    Must run before the documents are saved and in the same transaction.
+    """
+    get_content_storage().store(documents)
+
+def document_content(document):
+    """
+    The body of a document, wherever it is stored.
+    """
+    if document.content is not None:
+        return document.content
+
+    stored = getattr(document, '_blob_text', None)
+    if stored is not None and stored[0] == document.blob_id:
+        return stored[1]
+
+    blob = ContentBlob.objects.only('codec', 'data').get(hash=document.blob_id)
+    text = inflate(blob.codec, blob.data)
+    document._blob_text = (document.blob_id, text)
+    return text
+
+async def aload_content(document):
+    """
+    Reads the blob of ``document`` ahead of serialization, so that
+    ``document_content()`` does not query the database from an event loop.
+    """
+    if 'content' in document.get_deferred_fields() or document.content is not None or document.blob_id is None:
+        return
+    blob = await ContentBlob.objects.only('codec', 'data').aget(hash=document.blob_id)
+    document._blob_text = (document.blob_id, inflate(blob.codec, blob.data))
+
+def blob_texts(hashes):
+    """
+    ``{hash: text}`` of the given blobs, read with one query.
+    """
+    blobs = ContentBlob.objects.filter(hash__in=set(hashes)).values_list('hash', 'codec', 'data')
+    return {digest: inflate(codec, data) for digest, codec, data in blobs}
@@ -0,0 +1,32 @@
+from .deletion import SubtreeDeletion
+from .jobs import register
+from .models import Folder
+from .tree import rebuild_child_counts
+
+
+@register('delete_subtree')
+def delete_subtree(job, folder):
+    try:
+        root = Folder.objects.only("id", "parent", "path").get(id=folder)
+    except Folder.DoesNotExist:
+        # Already deleted by an earlier attempt
+        return {"folders_deleted": 0, "documents_deleted": 0}
+
+    deletion = SubtreeDeletion(root)
+    folders_total, documents_total = deletion.totals()
+
+    def report(deletion):
+        job.report(
+            folders_total=folders_total, folders_deleted=deletion.folders_deleted,
+            documents_total=documents_total, documents_deleted=deletion.documents_deleted,
+        )
+
+    report(deletion)
+    deletion.on_progress = report
+    deletion.run()
+    return {"folders_deleted": deletion.folders_deleted, "documents_deleted": deletion.documents_deleted}
+
+
+@register('rebuild_child_counts')
+def rebuild_counters(job):
+    return {"folders": rebuild_child_counts()}
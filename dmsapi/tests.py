@@ -1,11 +1,51 @@
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import OperationalError, close_old_connections, connection
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 
-from .models import Folder, Document
+from . import async_views, views
+from .async_views import read_view
+from .benchmark import Dataset, endpoints, run_suite, unbenched_routes
+from .cache import LRUCache, get_detail_cache
+from . import metrics, schema
+from .delta import MAX_PATCH_OPS
+from .handlers import ASGIHandler
+from .instrumentation import QueryBudgetExceeded, QueryBudgetMixin, query_budget, recording
+from .jobs import JobCancelled, JobContext, claim, register, run_pending, submit
+from .middleware import pins_primary
+from .models import ContentBlob, Folder, Document, Topic, FolderTopic, DocumentTopic, Job
+from .pool import ConnectionPool, PooledDatabaseWrapperMixin, PoolTimeout, close_pools, pool_stats
+from .routers import STICKY_COOKIE, ReplicaRouter, replica_reads, reset_replica_checks, use_primary
+from .transfer import TreeExporter, TreeImporter, tar_entries
+from .tree import rebuild_child_counts
+from .urls import api_urlpatterns
 
 # Create your tests here.
-class TestCases(APITestCase):
+class DmsTestCase(QueryBudgetMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Test transactions are rolled back without sending delete signals
+        get_detail_cache().clear()
+
+
+class TestCases(DmsTestCase):
 
     def create_folder(self, name, parent=None):
         data = {
@@ -198,3 +238,1390 @@ class TestCases(APITestCase):
         self.TestGetOneTopic()
         self.TestPatchTopic()
         self.TestDeleteTopic()
+
+
+class ListTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            Folder.objects.create(name="folder %d" % i)
+
+    def test_unpaginated_list(self):
+        response = self.client.get("/api/folders")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+
+    def test_invalid_limit(self):
+        for limit in ("0", "-1", "ten"):
+            response = self.client.get("/api/folders", {"limit": limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get("/api/folders", {"limit": 5000})
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_cursor_pages(self):
+        response = self.client.get("/api/folders", {"limit": 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f["name"] for f in response.data["results"]], ["folder 0", "folder 1"])
+        self.assertIsNone(response.data["previous"])
+
+        seen = [f["name"] for f in response.data["results"]]
+        while response.data["next"] is not None:
+            response = self.client.get(response.data["next"])
+            seen += [f["name"] for f in response.data["results"]]
+
+        self.assertEqual(seen, ["folder %d" % i for i in range(5)])
+
+        response = self.client.get(response.data["previous"])
+        self.assertEqual([f["name"] for f in response.data["results"]], ["folder 2", "folder 3"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/folders", {"cursor": "garbage"})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stream_ndjson(self):
+        response = self.client.get("/api/folders", {"stream": "ndjson"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["name"] for line in lines], ["folder %d" % i for i in range(5)])
+
+    def test_stream_json(self):
+        response = self.client.get("/api/folders", {"stream": "json"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(rows), 5)
+
+        response = self.client.get("/api/topics", {"stream": "json"})
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), [])
+
+    def test_stream_starts_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/folders", {"stream": "ndjson"})
+        self.assertNotIn("ETag", response)
+
+        response = self.client.get("/api/folders", {"stream": "ndjson"}, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertIn("ETag", response)
+
+
+class TopicLookupTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.topic = Topic.objects.create(name="Alpha", short_desc="alpha")
+        self.folder = Folder.objects.create(name="tagged")
+        self.other = Folder.objects.create(name="other")
+        for i in range(20):
+            document = Document.objects.create(name="doc %d" % i, parent=self.folder if i % 2 else self.other)
+            DocumentTopic.objects.create(document=document, topic=self.topic)
+        for folder in (self.folder, self.other):
+            FolderTopic.objects.create(folder=folder, topic=self.topic)
+
+    def test_folders_by_topic_query_count(self):
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/folder-topics", {"topic_name": "Alpha"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f["name"] for f in response.data], ["tagged", "other"])
+
+    def test_documents_by_topic_query_count(self):
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/document-topics", {"topic_name": "Alpha"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 20)
+
+    def test_documents_by_topic_and_folder_query_count(self):
+        with self.assertNumQueries(5):
+            response = self.client.get("/api/document-topics", {"topic_name": "Alpha", "folder_name": "tagged"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 10)
+
+    def test_unknown_topic_or_folder(self):
+        response = self.client.get("/api/document-topics", {"topic_name": "Beta"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get("/api/document-topics", {"topic_name": "Alpha", "folder_name": "missing"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_retagging_changes_etag(self):
+        etag = self.client.get("/api/folder-topics", {"topic_name": "Alpha"})["ETag"]
+
+        FolderTopic.objects.filter(folder=self.other).delete()
+        FolderTopic.objects.create(folder=Folder.objects.create(name="third"), topic=self.topic)
+        Folder.objects.filter(name="third").update(updated_at=self.other.updated_at)
+
+        response = self.client.get("/api/folder-topics", {"topic_name": "Alpha"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f["name"] for f in response.data], ["tagged", "third"])
+
+
+class FolderTreeTestCases(DmsTestCase):
+
+    def create_chain(self, depth):
+        parent = None
+        chain = []
+        for level in range(depth):
+            parent = Folder.objects.create(name="level %d" % level, parent=parent)
+            Document.objects.create(name="doc %d" % level, parent=parent)
+            chain.append(parent)
+        rebuild_child_counts()
+        return chain
+
+    def test_paths(self):
+        chain = self.create_chain(3)
+
+        self.assertEqual([folder.path for folder in chain], ["/", "/%d/" % chain[0].id, "/%d/%d/" % (chain[0].id, chain[1].id)])
+
+    def test_tree_query_count(self):
+        chain = self.create_chain(16)
+
+        with self.assertNumQueries(5):
+            response = self.client.get("/api/folders/%d/tree" % chain[0].id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        node, depth = response.data, 0
+        while node["folders"]:
+            self.assertEqual(node["documents"], [{"id": node["documents"][0]["id"], "name": "doc %d" % depth}])
+            node, depth = node["folders"][0], depth + 1
+        self.assertEqual(depth, 15)
+
+    def test_reparent_rewrites_descendant_paths(self):
+        chain = self.create_chain(3)
+        other = Folder.objects.create(name="other")
+
+        response = self.client.patch("/api/folders/%d" % chain[1].id, {"parent": other.id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Folder.objects.get(id=chain[2].id).path, "/%d/%d/" % (other.id, chain[1].id))
+        response = self.client.get("/api/folders/%d/tree" % other.id)
+        self.assertEqual(response.data["folders"][0]["folders"][0]["id"], chain[2].id)
+
+    def test_missing_folder(self):
+        response = self.client.get("/api/folders/999/tree")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ChildCounterTestCases(DmsTestCase):
+
+    def test_counters_follow_writes(self):
+        parent = self.client.post("/api/folders", {"name": "parent"}).data
+        child = self.client.post("/api/folders", {"name": "child", "parent": parent["id"]}).data
+        document = self.client.post("/api/documents", {"name": "doc", "parent": parent["id"]}).data
+
+        folder = Folder.objects.get(id=parent["id"])
+        self.assertEqual((folder.subfolder_count, folder.document_count), (1, 1))
+        self.assertTrue(self.client.get("/api/folders/%d" % parent["id"]).data["has_children"])
+
+        self.client.patch("/api/documents/%d" % document["id"], {"parent": child["id"]})
+        self.assertEqual(Folder.objects.get(id=parent["id"]).document_count, 0)
+        self.assertEqual(Folder.objects.get(id=child["id"]).document_count, 1)
+
+        self.client.delete("/api/documents", {"id": document["id"]})
+        self.client.delete("/api/folders", {"id": child["id"]})
+        self.assertFalse(self.client.get("/api/folders/%d" % parent["id"]).data["has_children"])
+
+    def test_delete_does_not_load_siblings(self):
+        parent = Folder.objects.create(name="parent")
+        for i in range(10):
+            Document.objects.create(name="doc %d" % i, parent=parent)
+        Folder.objects.filter(id=parent.id).update(document_count=10)
+        document_id = Document.objects.filter(parent=parent).first().id
+
+        with self.assertNumQueries(6):
+            self.client.delete("/api/documents", {"id": document_id})
+
+        self.assertEqual(Folder.objects.get(id=parent.id).document_count, 9)
+
+    def test_rebuild_command(self):
+        parent = Folder.objects.create(name="parent")
+        Folder.objects.create(name="child", parent=parent)
+        Document.objects.create(name="doc", parent=parent)
+        Folder.objects.filter(id=parent.id).update(subfolder_count=5)
+
+        out = StringIO()
+        call_command("rebuild_folder_counters", stdout=out)
+
+        folder = Folder.objects.get(id=parent.id)
+        self.assertEqual((folder.subfolder_count, folder.document_count), (1, 1))
+        self.assertIn("1 had drifted", out.getvalue())
+
+
+class BulkCreateTestCases(DmsTestCase):
+
+    def test_bulk_folders_with_in_batch_parents(self):
+        existing = Folder.objects.create(name="existing")
+        items = [
+            {"name": "child", "parent_ref": "root"},
+            {"name": "root", "ref": "root"},
+            {"name": "grandchild", "parent_ref": "child", "ref": "leaf"},
+            {"name": "under existing", "parent": existing.id},
+        ]
+        items[0]["ref"] = "child"
+
+        response = self.client.post("/api/folders", items)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result["status"] for result in response.data], [201] * 4)
+        root = Folder.objects.get(name="root")
+        grandchild = Folder.objects.get(name="grandchild")
+        self.assertEqual(grandchild.parent.parent, root)
+        self.assertEqual(grandchild.path, "/%d/%d/" % (root.id, grandchild.parent_id))
+        self.assertEqual(Folder.objects.get(id=existing.id).subfolder_count, 1)
+        self.assertTrue(response.data[1]["data"]["has_children"])
+
+    def test_bulk_reports_item_errors(self):
+        Folder.objects.create(name="taken")
+        items = [
+            {"name": "taken"},
+            {"name": "fine"},
+            {"name": "orphan", "parent": 999},
+            {"name": "x" * 31},
+            {"name": "child of bad", "parent_ref": "bad"},
+            {"name": "fine"},
+        ]
+
+        response = self.client.post("/api/folders", items)
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result["status"] for result in response.data], [400, 201, 400, 400, 400, 400])
+        self.assertEqual(Folder.objects.count(), 2)
+
+    def test_bulk_documents_single_insert(self):
+        parent = Folder.objects.create(name="parent")
+        items = [{"name": "doc %d" % i, "parent": parent.id, "content": "text %d" % i} for i in range(100)]
+
+        with self.assertNumQueries(6):
+            response = self.client.post("/api/documents", items)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Document.objects.filter(parent=parent).count(), 100)
+        self.assertEqual(Folder.objects.get(id=parent.id).document_count, 100)
+        self.assertEqual(response.data[5]["data"]["content"], "text 5")
+
+
+class BulkTagTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.alpha = Topic.objects.create(name="Alpha", short_desc="alpha")
+        self.beta = Topic.objects.create(name="Beta", short_desc="beta")
+        self.documents = [Document.objects.create(name="doc %d" % i) for i in range(50)]
+        DocumentTopic.objects.create(document=self.documents[0], topic=self.alpha)
+        DocumentTopic.objects.create(document=self.documents[1], topic=self.beta)
+
+    def test_add_skips_existing_pairs(self):
+        data = {
+            "add": [{"document": document.id, "topic": self.alpha.id} for document in self.documents]
+            + [{"document": 999, "topic": self.alpha.id}],
+            "remove": [{"document": self.documents[1].id, "topic": self.beta.id}],
+        }
+
+        with self.assertNumQueries(7):
+            response = self.client.post("/api/document-topics/bulk", data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["added"], 49)
+        self.assertEqual(response.data["removed"], 1)
+        self.assertEqual(response.data["errors"], [{"index": 50, "op": "add", "message": "Unknown document 999"}])
+        self.assertEqual(DocumentTopic.objects.filter(topic=self.alpha).count(), 50)
+        self.assertFalse(DocumentTopic.objects.filter(topic=self.beta).exists())
+
+    def test_folder_pairs(self):
+        folder = Folder.objects.create(name="folder")
+
+        response = self.client.post("/api/folder-topics/bulk", {"add": [{"folder": folder.id, "topic": self.beta.id}]})
+        self.assertEqual(response.data["added"], 1)
+
+        response = self.client.post("/api/folder-topics/bulk", {"remove": [{"folder": folder.id, "topic": self.beta.id}]})
+        self.assertEqual(response.data["removed"], 1)
+        self.assertFalse(FolderTopic.objects.exists())
+
+    def test_invalid_payload(self):
+        response = self.client.post("/api/folder-topics/bulk", {"add": [{"folder": "x"}]})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DetailCacheTestCases(DmsTestCase):
+
+    def test_hits_and_invalidation_on_patch(self):
+        folder = Folder.objects.create(name="folder")
+
+        self.client.get("/api/folders/%d" % folder.id)
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/folders/%d" % folder.id)
+        self.assertEqual(response.data["name"], "folder")
+
+        self.client.patch("/api/folders/%d" % folder.id, {"name": "renamed"})
+        response = self.client.get("/api/folders/%d" % folder.id)
+        self.assertEqual(response.data["name"], "renamed")
+
+        stats = self.client.get("/api/cache/stats").data
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_invalidation_on_counter_change_and_cascade(self):
+        parent = self.client.post("/api/folders", {"name": "parent"}).data
+        child = self.client.post("/api/folders", {"name": "child", "parent": parent["id"]}).data
+        document = self.client.post("/api/documents", {"name": "doc", "parent": child["id"]}).data
+        self.assertTrue(self.client.get("/api/folders/%d" % parent["id"]).data["has_children"])
+        self.assertEqual(self.client.get("/api/documents/%d" % document["id"]).status_code, status.HTTP_200_OK)
+
+        self.client.delete("/api/folders", {"id": child["id"]})
+
+        self.assertFalse(self.client.get("/api/folders/%d" % parent["id"]).data["has_children"])
+        self.assertEqual(self.client.get("/api/documents/%d" % document["id"]).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_read_racing_a_commit_is_not_cached(self):
+        folder = Folder.objects.create(name="folder")
+        cache = get_detail_cache()
+        stale = {"id": folder.id, "name": "folder"}
+
+        missed_at = time.time()
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.invalidate(Folder, [folder.id])
+        cache.set(Folder, folder.id, stale, missed_at)
+        self.assertIsNone(cache.get(Folder, folder.id))
+
+        cache.set(Folder, folder.id, stale, time.time())
+        self.assertEqual(cache.get(Folder, folder.id), stale)
+
+    def test_lru_bounds(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+        cache = LRUCache(max_size=2, ttl=-1)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_lru_write_times_kept_apart(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set_written(["a", "b", "c"], 1.0)
+
+        self.assertEqual((len(cache), cache.get("a")), (1, 1))
+        self.assertEqual((cache.get_written("a"), cache.get_written("c")), (None, 1.0))
+        self.assertIsNone(cache.get("a:written"))
+
+    @override_settings(DMSAPI_DETAIL_CACHE={"BACKEND": "django"}, CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_django_backend(self):
+        topic = Topic.objects.create(name="Alpha", short_desc="alpha")
+
+        self.client.get("/api/topics/%d" % topic.id)
+        with self.assertNumQueries(0):
+            self.client.get("/api/topics/%d" % topic.id)
+        self.assertEqual(get_detail_cache().stats()["backend"], "django")
+
+
+class ConditionalGetTestCases(DmsTestCase):
+
+    def test_detail_not_modified(self):
+        document = Document.objects.create(name="doc", content="x" * 1000)
+        response = self.client.get("/api/documents/%d" % document.id)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+
+        get_detail_cache().clear()
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/documents/%d" % document.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch("/api/documents/%d" % document.id, {"content": "changed"})
+        response = self.client.get("/api/documents/%d" % document.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_folder_etag_follows_counters(self):
+        folder = self.client.post("/api/folders", {"name": "folder"}).data
+        etag = self.client.get("/api/folders/%d" % folder["id"])["ETag"]
+
+        self.client.post("/api/documents", {"name": "doc", "parent": folder["id"]})
+
+        response = self.client.get("/api/folders/%d" % folder["id"], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_folder_last_modified_follows_counters(self):
+        folder = Folder.objects.create(name="folder")
+        Folder.objects.filter(id=folder.id).update(updated_at=folder.updated_at - timedelta(minutes=5))
+        last_modified = self.client.get("/api/folders/%d" % folder.id)["Last-Modified"]
+
+        self.client.post("/api/documents", {"name": "doc", "parent": folder.id})
+
+        response = self.client.get("/api/folders/%d" % folder.id, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["has_children"])
+
+    def test_list_etag_follows_counters(self):
+        folder = Folder.objects.create(name="folder")
+        etag = self.client.get("/api/folders", {"fields": "id,has_children"})["ETag"]
+
+        self.client.post("/api/documents", {"name": "doc", "parent": folder.id})
+        Folder.objects.filter(id=folder.id).update(updated_at=folder.updated_at)
+
+        response = self.client.get("/api/folders", {"fields": "id,has_children"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{"id": folder.id, "has_children": True}])
+
+    def test_list_etag_follows_deletions(self):
+        Topic.objects.create(name="Alpha", short_desc="alpha")
+        beta = Topic.objects.create(name="Beta", short_desc="beta")
+        etag = self.client.get("/api/topics")["ETag"]
+
+        beta.delete()
+
+        response = self.client.get("/api/topics", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_not_modified(self):
+        Topic.objects.create(name="Alpha", short_desc="alpha")
+        response = self.client.get("/api/topics")
+        etag = response["ETag"]
+
+        response = self.client.get("/api/topics", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.assertNotIn("Last-Modified", response)
+
+        Topic.objects.create(name="Beta", short_desc="beta")
+        response = self.client.get("/api/topics", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_page_not_modified(self):
+        for i in range(4):
+            Folder.objects.create(name="folder %d" % i)
+        response = self.client.get("/api/folders", {"limit": 2})
+
+        response = self.client.get("/api/folders", {"limit": 2}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class SearchTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name="reports")
+        self.subfolder = Folder.objects.create(name="2022", parent=self.folder)
+        self.topic = Topic.objects.create(name="Finance", short_desc="finance")
+        self.budget = Document.objects.create(name="budget", parent=self.subfolder, content="The quarterly budget was approved by the board.")
+        self.notes = Document.objects.create(name="notes", content="Budget discussions went on. Budget again, and budget once more.")
+        Document.objects.create(name="recipe", content="Flour, sugar and eggs.")
+        DocumentTopic.objects.create(document=self.budget, topic=self.topic)
+        rebuild_child_counts()
+
+    def search(self, **params):
+        response = self.client.get("/api/search", params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_ranked_results_with_snippets(self):
+        results = self.search(q="budget")
+
+        self.assertEqual({result["id"] for result in results}, {self.budget.id, self.notes.id})
+        self.assertEqual(results[0]["id"], self.budget.id)
+        self.assertIn("<b>", results[1]["snippet"])
+
+    def test_filters(self):
+        self.assertEqual([r["id"] for r in self.search(q="budget", topic_name="Finance")], [self.budget.id])
+        self.assertEqual([r["id"] for r in self.search(q="budget", folder=self.folder.id)], [self.budget.id])
+        self.assertEqual(self.search(q="budget", folder=self.folder.id, topic_name="Finance")[0]["name"], "budget")
+
+    def test_index_follows_writes(self):
+        self.client.patch("/api/documents/%d" % self.notes.id, {"content": "nothing to see"})
+        self.client.post("/api/documents", [{"name": "minutes", "content": "the budget, in short"}])
+        self.client.delete("/api/documents", {"id": self.budget.id})
+
+        self.assertEqual([r["name"] for r in self.search(q="budget")], ["minutes"])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get("/api/search").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get("/api/search", {"q": "x", "folder": 999}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.search(q="'\"*"), [])
+
+
+class DocumentContentTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.content = "héllo wörld " * 1000
+        self.document = Document.objects.create(name="big", content=self.content)
+        self.url = "/api/documents/%d/content" % self.document.id
+
+    def test_full_content_in_chunks(self):
+        with mock.patch("dmsapi.views.CONTENT_CHUNK_SIZE", 1000), self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_ACCEPT="text/plain")
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(len(chunks), 14)
+        self.assertEqual(b"".join(chunks).decode(), self.content)
+
+    def test_byte_ranges(self):
+        encoded = self.content.encode()
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1-5")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"], "bytes 1-5/%d" % len(encoded))
+        self.assertEqual(b"".join(response.streaming_content), encoded[1:6])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-4")
+        self.assertEqual(b"".join(response.streaming_content), encoded[-4:])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=%d-" % len(encoded))
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_rewritten_while_read(self):
+        parse_range = views.parse_range
+
+        def rewrite_once(header, size):
+            if size > 5:
+                Document.objects.filter(id=self.document.id).update(content="short", updated_at=self.document.updated_at + timedelta(seconds=1))
+            return parse_range(header, size)
+
+        # Outside the view budget, reading twice is the point
+        with mock.patch("dmsapi.views.parse_range", side_effect=rewrite_once):
+            response = views.get_content(RequestFactory().get(self.url), self.document.id)
+        self.assertEqual(b"".join(response.streaming_content), b"short")
+        self.assertEqual(response["Content-Length"], "5")
+
+    def test_stale_if_range_sends_everything(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_without_content(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/documents/%d" % self.document.id, {"content": "false"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("content", response.data)
+        self.assertNotIn('"content"', queries[0]["sql"])
+
+
+class SparseFieldsetTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name="folder")
+        self.document = Document.objects.create(name="doc", parent=self.folder, content="x" * 1000)
+        rebuild_child_counts()
+
+    def test_list_fields(self):
+        response = self.client.get("/api/folders", {"fields": "name,has_children"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{"id": self.folder.id, "name": "folder", "has_children": True}])
+
+        response = self.client.get("/api/documents", {"fields": "parent", "stream": "ndjson"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"id": self.document.id, "parent": self.folder.id}])
+
+    def test_detail_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/documents/%d" % self.document.id, {"fields": "name"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"name": "doc"})
+        self.assertNotIn('"content"', queries[0]["sql"])
+
+        etag = response["ETag"]
+        full = self.client.get("/api/documents/%d" % self.document.id)
+        self.assertNotEqual(full["ETag"], etag)
+        response = self.client.get("/api/documents/%d" % self.document.id, {"fields": "name"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get("/api/folders/%d" % self.folder.id, {"fields": "has_children"})
+        self.assertEqual(response.data, {"has_children": True})
+
+    def test_unknown_fields(self):
+        response = self.client.get("/api/folders/%d" % self.folder.id, {"fields": "name,path"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get("/api/topics", {"fields": ""})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(DMSAPI_CONTENT_STORAGE={"BACKEND": "blob", "MIN_SIZE": 16})
+class ContentStorageTestCases(DmsTestCase):
+
+    body = " ".join(["Standard template for quarterly reports."] * 50)
+
+    def test_deduplicated_blobs(self):
+        first = self.client.post("/api/documents", {"name": "a", "content": self.body}).data
+        second = self.client.post("/api/documents", [{"name": "b", "content": self.body}, {"name": "c", "content": "short"}], format="json").data
+
+        self.assertEqual(first["content"], self.body)
+        self.assertEqual(second[0]["data"]["content"], self.body)
+        blob = ContentBlob.objects.get()
+        self.assertEqual((blob.ref_count, blob.size), (2, len(self.body)))
+        self.assertLess(len(blob.data), blob.size)
+        self.assertEqual(Document.objects.filter(content=None).count(), 2)
+        self.assertEqual(Document.objects.get(name="c").content, "short")
+
+        get_detail_cache().clear()
+        self.assertEqual(self.client.get("/api/documents/%d" % first["id"]).data["content"], self.body)
+        response = self.client.get("/api/documents/%d/content" % first["id"], HTTP_RANGE="bytes=0-7")
+        self.assertEqual(b"".join(response.streaming_content), b"Standard")
+
+        self.client.patch("/api/documents/%d" % first["id"], {"content": "Rewritten body of the first document"})
+        self.client.delete("/api/documents", {"id": second[0]["data"]["id"]})
+        self.assertEqual(ContentBlob.objects.get(hash=blob.hash).ref_count, 0)
+        self.assertEqual(self.client.get("/api/documents/%d" % first["id"]).data["content"], "Rewritten body of the first document")
+
+    def test_conditional_read_of_a_blob(self):
+        document = self.client.post("/api/documents", {"name": "report", "content": self.body}).data
+        etag = self.client.get("/api/documents/%d" % document["id"])["ETag"]
+        self.client.patch("/api/documents/%d" % document["id"], {"name": "renamed"})
+
+        get_detail_cache().clear()
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/documents/%d" % document["id"], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["content"], self.body)
+
+    def test_search_covers_blobs(self):
+        document = self.client.post("/api/documents", {"name": "report", "content": self.body}).data
+
+        results = self.client.get("/api/search", {"q": "quarterly"}).data
+        self.assertEqual([result["id"] for result in results], [document["id"]])
+        self.assertIn("<b>quarterly</b>", results[0]["snippet"])
+
+        self.client.patch("/api/documents/%d" % document["id"], {"content": "Nothing to see " * 5})
+        self.assertEqual(self.client.get("/api/search", {"q": "quarterly"}).data, [])
+
+    def test_migrate_command(self):
+        with override_settings(DMSAPI_CONTENT_STORAGE={"BACKEND": "inline"}):
+            for name in ("a", "b", "c"):
+                Document.objects.create(name=name, content=self.body)
+
+        call_command("migrate_document_content", stdout=StringIO())
+        self.assertEqual(Document.objects.filter(content=None).count(), 3)
+        self.assertEqual(ContentBlob.objects.get().ref_count, 3)
+
+        call_command("migrate_document_content", to="inline", purge=True, stdout=StringIO())
+        self.assertEqual(list(Document.objects.values_list("content", flat=True)), [self.body] * 3)
+        self.assertFalse(ContentBlob.objects.exists())
+
+
+class ContentPatchTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.client.post("/api/documents", {"name": "doc", "content": "Hello world, this is the body."}).data
+        self.url = "/api/documents/%d/content" % self.document["id"]
+
+    def test_patch_with_base(self):
+        ops = [{"offset": 0, "delete": 5, "insert": "Goodbye"}, {"offset": 11, "delete": 0, "insert": "!"}]
+        # Version lookup and one UPDATE, plus the savepoint pair
+        with self.assertNumQueries(4):
+            response = self.client.patch(self.url, {"base": self.document["updated_at"], "ops": ops}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Document.objects.get().content, "Goodbye world!, this is the body.")
+        self.assertEqual(self.client.get("/api/documents/%d" % self.document["id"]).data["content"], "Goodbye world!, this is the body.")
+
+        response = self.client.patch(self.url, {"base": self.document["updated_at"], "ops": ops}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_patch_with_if_match(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        response = self.client.patch(self.url, {"ops": [{"offset": 30, "insert": " The end."}]}, format="json", HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(b"".join(self.client.get(self.url).streaming_content), b"Hello world, this is the body. The end.")
+
+        response = self.client.patch(self.url, {"ops": [{"offset": 0, "delete": 1}]}, format="json", HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_patch_with_most_ops(self):
+        text = "abcdefghij" * MAX_PATCH_OPS
+        document = Document.objects.create(name="long", content=text)
+        ops = [{"offset": 10 * i + 1, "delete": 2, "insert": "-"} for i in range(MAX_PATCH_OPS)]
+
+        response = self.client.patch("/api/documents/%d/content" % document.id, {"base": document.updated_at, "ops": ops}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Document.objects.get(id=document.id).content, "a-defghij" * MAX_PATCH_OPS)
+
+    def test_invalid_patches(self):
+        base = self.document["updated_at"]
+        cases = [
+            ({"ops": [{"offset": 0, "delete": 1}]}, status.HTTP_428_PRECONDITION_REQUIRED),
+            ({"base": base, "ops": [{"offset": 5, "delete": 2}, {"offset": 6}]}, status.HTTP_400_BAD_REQUEST),
+            ({"base": base, "ops": [{"offset": 25, "delete": 10}]}, status.HTTP_400_BAD_REQUEST),
+            ({"base": base, "ops": []}, status.HTTP_400_BAD_REQUEST),
+        ]
+        for body, expected in cases:
+            self.assertEqual(self.client.patch(self.url, body, format="json").status_code, expected)
+        self.assertEqual(Document.objects.get().content, "Hello world, this is the body.")
+
+    @override_settings(DMSAPI_CONTENT_STORAGE={"BACKEND": "blob", "MIN_SIZE": 0})
+    def test_patch_blob_content(self):
+        document = self.client.post("/api/documents", {"name": "blob", "content": "abcdef"}).data
+
+        response = self.client.patch(
+            "/api/documents/%d/content" % document["id"],
+            {"base": document["updated_at"], "ops": [{"offset": 2, "delete": 2, "insert": "XY"}]}, format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get("/api/documents/%d" % document["id"]).data["content"], "abXYef")
+        self.assertEqual(ContentBlob.objects.get(hash=Document.objects.get(id=document["id"]).blob_id).ref_count, 1)
+
+
+class SubtreeDeletionTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.topic = Topic.objects.create(name="Alpha", short_desc="alpha")
+        self.top = Folder.objects.create(name="top")
+        self.root = Folder.objects.create(name="root", parent=self.top)
+        self.sibling = Folder.objects.create(name="sibling", parent=self.top)
+        parents = [self.root]
+        for depth in range(3):
+            parents = [Folder.objects.create(name="f%d-%d" % (depth, i), parent=parent) for parent in parents for i in range(2)]
+            for folder in parents:
+                document = Document.objects.create(name="doc", parent=folder)
+                DocumentTopic.objects.create(document=document, topic=self.topic)
+                FolderTopic.objects.create(folder=folder, topic=self.topic)
+        Document.objects.create(name="kept", parent=self.sibling)
+        rebuild_child_counts()
+
+    @mock.patch("dmsapi.deletion.DELETE_BATCH_SIZE", 3)
+    def test_batched_delete(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete("/api/folders", {"id": self.root.id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(Folder.objects.values_list("name", flat=True)), ["top", "sibling"])
+        self.assertEqual(list(Document.objects.values_list("name", flat=True)), ["kept"])
+        self.assertFalse(FolderTopic.objects.exists() or DocumentTopic.objects.exists())
+        self.assertEqual(Folder.objects.get(id=self.top.id).subfolder_count, 1)
+        # No statement selects whole rows the way the collector does
+        self.assertFalse(any('"dmsapi_folder"."name"' in query["sql"] for query in queries))
+
+    def test_async_delete(self):
+        response = self.client.delete("/api/folders", {"id": self.root.id, "async": True}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], "queued")
+        self.assertEqual(Folder.objects.count(), 17)
+
+        self.assertEqual(run_pending(), 1)
+        job = self.client.get(response["Location"]).data
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["progress"]["folders_total"], 15)
+        self.assertEqual(job["result"], {"folders_deleted": 15, "documents_deleted": 14})
+        self.assertEqual(Folder.objects.count(), 2)
+
+
+class MoveTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.a = Folder.objects.create(name="a")
+        self.b = Folder.objects.create(name="b", parent=self.a)
+        self.c = Folder.objects.create(name="c", parent=self.b)
+        self.d = Folder.objects.create(name="d")
+        self.document = Document.objects.create(name="doc", parent=self.b)
+        rebuild_child_counts()
+
+    def test_cycles_rejected(self):
+        for target in (self.a, self.c):
+            response = self.client.post("/api/folders/move", {"ids": [self.a.id], "parent": target.id}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch("/api/folders/%d" % self.a.id, {"parent": self.c.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(Folder.objects.get(id=self.a.id).parent_id)
+
+    def test_move_folders(self):
+        response = self.client.post("/api/folders/move", {"ids": [self.b.id, self.c.id], "parent": self.d.id}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data["moved"]), [self.b.id, self.c.id])
+        folders = {folder.name: folder for folder in Folder.objects.all()}
+        self.assertEqual((folders["b"].path, folders["c"].path), ("/%d/" % self.d.id, "/%d/" % self.d.id))
+        self.assertEqual((folders["a"].subfolder_count, folders["b"].subfolder_count, folders["d"].subfolder_count), (0, 0, 2))
+        self.assertFalse(self.client.get("/api/folders/%d" % self.a.id).data["has_children"])
+        tree = self.client.get("/api/folders/%d/tree" % self.d.id).data
+        self.assertEqual([folder["name"] for folder in tree["folders"]], ["b", "c"])
+
+    def test_move_drops_cached_subtree(self):
+        grandchild = Folder.objects.create(name="e", parent=self.c)
+        self.client.get("/api/folders/%d" % grandchild.id)
+
+        self.client.post("/api/folders/move", {"ids": [self.b.id], "parent": self.d.id}, format="json")
+
+        self.assertIsNone(get_detail_cache().get(Folder, grandchild.id))
+        response = self.client.get("/api/folders/%d" % grandchild.id)
+        self.assertEqual(response.data["parent"], self.c.id)
+        self.assertEqual(Folder.objects.get(id=grandchild.id).path, "/%d/%d/%d/" % (self.d.id, self.b.id, self.c.id))
+
+    def test_patch_parent_moves_subtree(self):
+        self.client.get("/api/folders/%d" % self.c.id)
+        response = self.client.patch("/api/folders/%d" % self.b.id, {"parent": self.d.id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Folder.objects.get(id=self.c.id).path, "/%d/%d/" % (self.d.id, self.b.id))
+        cached = self.client.get("/api/folders/%d" % self.c.id)
+        get_detail_cache().clear()
+        self.assertEqual(cached.data, self.client.get("/api/folders/%d" % self.c.id).data)
+        self.assertEqual(Folder.objects.get(id=self.d.id).subfolder_count, 1)
+        self.assertEqual(Folder.objects.get(id=self.a.id).subfolder_count, 0)
+
+    def test_move_documents(self):
+        Document.objects.create(name="doc", parent=self.d)
+
+        response = self.client.post("/api/documents/move", {"ids": [self.document.id], "parent": self.d.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post("/api/documents/move", {"ids": [self.document.id], "parent": self.c.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Document.objects.get(id=self.document.id).parent_id, self.c.id)
+        self.assertEqual(Folder.objects.get(id=self.b.id).document_count, 0)
+        self.assertEqual(Folder.objects.get(id=self.c.id).document_count, 1)
+
+
+@register('test_flaky')
+def flaky_job(job, fail_times):
+    job.report(step=job.job.attempts)
+    if job.job.attempts <= fail_times:
+        raise RuntimeError("attempt %d failed" % job.job.attempts)
+    return {"attempts": job.job.attempts}
+
+
+class JobTestCases(DmsTestCase):
+
+    @override_settings(DMSAPI_JOBS={"RETRY_DELAY": 0})
+    def test_retries(self):
+        job = submit('test_flaky', fail_times=1)
+
+        with self.assertLogs('dmsapi.jobs', 'ERROR'):
+            self.assertEqual(run_pending(), 2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), (Job.SUCCEEDED, 2, {"attempts": 2}))
+
+        job = submit('test_flaky', fail_times=5, max_attempts=2)
+        with self.assertLogs('dmsapi.jobs', 'ERROR'):
+            run_pending()
+        response = self.client.get("/api/jobs/%d" % job.id)
+        self.assertEqual((response.data["status"], response.data["attempts"]), ("failed", 2))
+        self.assertIn("attempt 2 failed", response.data["error"])
+
+    def test_cancel(self):
+        queued = submit('test_flaky', fail_times=0)
+        response = self.client.post("/api/jobs/%d/cancel" % queued.id)
+        self.assertEqual(response.data["status"], "cancelled")
+        self.assertEqual(run_pending(), 0)
+
+        running = submit('test_flaky', fail_times=0)
+        job = claim("worker")
+        self.client.post("/api/jobs/%d/cancel" % running.id)
+        with self.assertRaises(JobCancelled):
+            JobContext(job, "worker").report(step=1)
+
+        self.assertEqual(self.client.get("/api/jobs/0").status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(DMSAPI_JOBS={"STALE_AFTER": -1})
+    def test_stale_job_taken_over(self):
+        job = submit('test_flaky', fail_times=0)
+
+        self.assertEqual(claim("dead worker").id, job.id)
+        self.assertEqual(claim("other worker").id, job.id)
+        self.assertEqual(Job.objects.get(id=job.id).worker, "other worker")
+
+
+class TransferTestCases(DmsTestCase):
+
+    def make_tar(self, files):
+        buffer = BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as archive:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                if data is None:
+                    info.type = tarfile.DIRTYPE
+                    archive.addfile(info)
+                else:
+                    info.size = len(data)
+                    archive.addfile(info, BytesIO(data))
+        buffer.seek(0)
+        return buffer
+
+    def test_import_archive(self):
+        target = Folder.objects.create(name="target")
+        archive = self.make_tar({
+            "docs/a/b/deep.txt": b"deep",
+            "docs/readme.md": b"# Readme",
+            "docs/a": None,
+            "docs/image.png": b"\x89PNG\x00",
+            "docs/%s.txt" % ("x" * 40): b"long name",
+        })
+
+        importer = TreeImporter(target.id, batch_size=2)
+        stats = importer.run(tar_entries(archive))
+
+        self.assertEqual((stats.folders, stats.documents), (3, 2))
+        self.assertEqual(len(importer.skipped), 2)
+        deep = Document.objects.get(name="deep.txt")
+        self.assertEqual(Folder.objects.get(id=deep.parent_id).path, "/%d/%d/%d/" % (
+            target.id, Folder.objects.get(name="docs").id, Folder.objects.get(name="a").id,
+        ))
+        self.assertEqual(Folder.objects.get(id=target.id).subfolder_count, 1)
+        self.assertEqual(Folder.objects.get(name="docs").document_count, 1)
+
+        # Importing again merges folders and skips existing documents
+        archive.seek(0)
+        stats = TreeImporter(target.id).run(tar_entries(archive))
+        self.assertEqual((stats.folders, stats.documents, Folder.objects.count()), (0, 0, 4))
+
+    def test_export_round_trip(self):
+        root = Folder.objects.create(name="root")
+        child = Folder.objects.create(name="child", parent=root)
+        Document.objects.create(name="one.txt", parent=child, content="one")
+        Document.objects.create(name="top.txt", parent=root, content="top")
+
+        ndjson = StringIO()
+        TreeExporter(root).write_ndjson(ndjson)
+        rows = [json.loads(line) for line in ndjson.getvalue().splitlines()]
+        self.assertEqual([row["path"] for row in rows], [["root"], ["root", "child"], ["root", "child", "one.txt"], ["root", "top.txt"]])
+
+        buffer = BytesIO()
+        TreeExporter(root).write_tar(buffer)
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer) as archive:
+            self.assertEqual(archive.extractfile("root/child/one.txt").read(), b"one")
+
+        copy = Folder.objects.create(name="copy")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.ndjson")
+            call_command("export_tree", path, format="ndjson", folder=root.id, stderr=StringIO())
+            call_command("import_tree", path, parent=copy.id, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Document.objects.get(name="one.txt", parent__parent__parent=copy).content, "one")
+        self.assertEqual(Folder.objects.get(name="root", parent=copy).path, "/%d/" % copy.id)
+
+    def test_import_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "a", "b", "empty"))
+            with open(os.path.join(directory, "a", "b", "note.txt"), "w") as file:
+                file.write("note")
+            call_command("import_tree", directory, batch_size=1, stdout=StringIO(), stderr=StringIO())
+
+        note = Document.objects.get(name="note.txt")
+        self.assertEqual(note.content, "note")
+        self.assertEqual(Folder.objects.get(id=note.parent_id).document_count, 1)
+        self.assertEqual(Folder.objects.get(name="a", parent=None).subfolder_count, 1)
+
+    def test_import_zip_from_stdin(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("a/note.txt", "note")
+        stdin = mock.Mock(buffer=Unseekable(buffer.getvalue()))
+
+        with mock.patch("sys.stdin", stdin):
+            call_command("import_tree", "-", format="zip", stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Document.objects.get(name="note.txt", parent__name="a").content, "note")
+
+        with self.assertRaises(CommandError):
+            call_command("import_tree", "-", format="dir", stdout=StringIO(), stderr=StringIO())
+
+
+class AsyncReadTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        self.topic = Topic.objects.create(name="Alpha", short_desc="alpha")
+        self.folder = Folder.objects.create(name="folder")
+        self.document = Document.objects.create(name="doc", parent=self.folder, content="body")
+        Folder.objects.create(name="child", parent=self.folder)
+        FolderTopic.objects.create(folder=self.folder, topic=self.topic)
+        DocumentTopic.objects.create(document=self.document, topic=self.topic)
+
+    async def get(self, view_class, read, path, **kwargs):
+        view = read_view(view_class, read, async_reads=True)
+        return await view(self.factory.get(path, accept="application/json"), **kwargs)
+
+    async def test_responses_match_sync_views(self):
+        cases = [
+            (views.FolderView, async_views.folder_list, "/api/folders?fields=id,name,has_children", {}),
+            (views.FolderDetailsView, async_views.folder_details, "/api/folders/%d" % self.folder.id, {"id": self.folder.id}),
+            (views.DocumentDetailsView, async_views.document_details, "/api/documents/%d?content=false" % self.document.id, {"id": self.document.id}),
+            (views.TopicView, async_views.topic_list, "/api/topics", {}),
+            (views.DocumentTopicView, async_views.topic_documents, "/api/document-topics?topic_name=Alpha", {}),
+        ]
+        for view_class, read, path, kwargs in cases:
+            response = await self.get(view_class, read, path, **kwargs)
+            expected = await sync_to_async(self.client.get)(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), expected.json())
+            self.assertEqual(response["ETag"], expected["ETag"])
+
+    async def test_detail(self):
+        path = "/api/documents/%d" % self.document.id
+        response = await self.get(views.DocumentDetailsView, async_views.document_details, path, id=self.document.id)
+        self.assertEqual(json.loads(response.content)["content"], "body")
+
+        view = read_view(views.DocumentDetailsView, async_views.document_details, async_reads=True)
+        cached = await view(self.factory.get(path, **{"if-none-match": response["ETag"]}), id=self.document.id)
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = await self.get(views.FolderDetailsView, async_views.folder_details, "/api/folders/0", id=0)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.get(views.FolderView, async_views.folder_list, "/api/folders?fields=path")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_other_requests_use_sync_view(self):
+        view = read_view(views.FolderView, async_views.folder_list, async_reads=True)
+        response = await view(self.factory.post("/api/folders", {"name": "new"}, content_type="application/json"))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = await self.get(views.FolderView, async_views.folder_list, "/api/folders?limit=1")
+        self.assertEqual(len(response.data["results"]), 1)
+
+
+# URLconf of ASGITestCases, with the async read views
+urlpatterns = api_urlpatterns(async_reads=True)
+
+
+@override_settings(ROOT_URLCONF="dmsapi.tests")
+class ASGITestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # As the test client does, keep the connection of the test transaction
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    async def request(self, path, query=""):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": [(b"accept", b"application/json")]}
+        await ASGIHandler()(scope, receive, send)
+        return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+    async def test_streamed_rows(self):
+        for name in ("a", "b"):
+            await Folder.objects.acreate(name=name)
+
+        code, body = await self.request("/api/folders", "stream=ndjson")
+        self.assertEqual(code, status.HTTP_200_OK)
+        self.assertEqual([json.loads(line)["name"] for line in body.decode().splitlines()], ["a", "b"])
+
+        code, body = await self.request("/api/folders", "fields=id,name")
+        self.assertEqual([folder["name"] for folder in json.loads(body)], ["a", "b"])
+
+    async def test_streamed_content(self):
+        document = await Document.objects.acreate(name="doc", content="x" * 1000)
+        blob = await sync_to_async(self.client.post)("/api/documents", {"name": "report", "content": " ".join(["quarterly"] * 500)})
+
+        code, body = await self.request("/api/documents/%d/content" % document.id)
+        self.assertEqual((code, body), (status.HTTP_200_OK, b"x" * 1000))
+
+        code, body = await self.request("/api/documents/%d/content" % blob.data["id"])
+        self.assertEqual(body.decode(), " ".join(["quarterly"] * 500))
+
+
+class Unseekable(BytesIO):
+
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise OSError("not seekable")
+
+    def tell(self):
+        raise OSError("not seekable")
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PooledSQLiteWrapper(PooledDatabaseWrapperMixin, sqlite3_base.DatabaseWrapper):
+    pass
+
+
+class ConnectionPoolTestCases(DmsTestCase):
+
+    def make_pool(self, **kwargs):
+        return ConnectionPool(**{"max_size": 2, "max_idle": 60, "max_lifetime": None, "timeout": 0.01, "check_after": 30, **kwargs})
+
+    def test_reuse_and_limits(self):
+        pool = self.make_pool()
+        first = pool.acquire(FakeConnection, lambda connection: True)
+        second = pool.acquire(FakeConnection, lambda connection: True)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection, lambda connection: True)
+
+        pool.release(first)
+        self.assertIs(pool.acquire(FakeConnection, lambda connection: True), first)
+        pool.release(second, reusable=False)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.stats(), {
+            "max_size": 2, "size": 1, "idle": 0, "in_use": 1,
+            "created": 2, "reused": 1, "closed": 1, "check_failures": 0, "waits": 1, "timeouts": 1,
+        })
+
+    def test_idle_connections_are_checked_and_expire(self):
+        pool = self.make_pool(max_idle=60, check_after=10)
+        connection = pool.acquire(FakeConnection, lambda connection: True)
+        pool.release(connection)
+
+        now = time.monotonic()
+        with mock.patch("dmsapi.pool.time.monotonic", return_value=now + 20):
+            replacement = pool.acquire(FakeConnection, lambda connection: False)
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        pool.release(replacement)
+
+        with mock.patch("dmsapi.pool.time.monotonic", return_value=now + 100):
+            self.assertIsNot(pool.acquire(FakeConnection, lambda connection: True), replacement)
+        self.assertTrue(replacement.closed)
+        self.assertEqual(pool.stats()["check_failures"], 1)
+
+    def test_database_wrapper(self):
+        self.addCleanup(close_pools)
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = PooledSQLiteWrapper({**connection.settings_dict, "NAME": os.path.join(directory, "pool.db")}, alias="pooltest")
+            wrapper.ensure_connection()
+            raw = wrapper.connection
+            wrapper.close()
+            wrapper.ensure_connection()
+            self.assertIs(wrapper.connection, raw)
+            with wrapper.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            wrapper.close()
+
+            self.assertEqual(pool_stats()["pooltest"]["reused"], 1)
+            self.assertEqual(pool_stats()["pooltest"]["idle"], 1)
+            close_pools()
+
+        response = self.client.get("/api/db/pool")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ReplicaRouterTestCases(DmsTestCase):
+    replicas = {"ALIASES": ["replica1", "replica2"], "STICKY_SECONDS": 5, "MAX_LAG": 2, "CHECK_INTERVAL": 5}
+
+    def setUp(self):
+        super().setUp()
+        reset_replica_checks()
+        self.addCleanup(reset_replica_checks)
+
+    def test_routing_and_lag_fallback(self):
+        router = ReplicaRouter()
+        lags = {"replica1": 0, "replica2": 10}
+        with override_settings(DMSAPI_REPLICAS=self.replicas), mock.patch("dmsapi.routers.replica_lag", side_effect=lags.get) as lag:
+            self.assertEqual(router.db_for_read(Folder), "default")
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Folder), "replica1")
+                self.assertEqual(router.db_for_read(Document), "replica1")
+                with use_primary():
+                    self.assertEqual(router.db_for_read(Folder), "default")
+            self.assertEqual(router.db_for_write(Folder), "default")
+            # Checked once per interval
+            self.assertEqual(lag.call_count, 2)
+
+            reset_replica_checks()
+            lag.side_effect = OperationalError("replica down")
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Folder), "default")
+
+    def test_clients_stick_to_primary_after_writing(self):
+        with override_settings(DMSAPI_REPLICAS={**self.replicas, "ALIASES": ["default"]}):
+            response = self.client.post("/api/folders", {"name": "folder"})
+            cookie = response.cookies[STICKY_COOKIE]
+            self.assertEqual(cookie["max-age"], 5)
+
+            factory = RequestFactory()
+            self.assertTrue(pins_primary(factory.get("/api/folders", HTTP_COOKIE="%s=%s" % (STICKY_COOKIE, cookie.value))))
+            self.assertFalse(pins_primary(factory.get("/api/folders")))
+            self.assertTrue(pins_primary(factory.delete("/api/folders")))
+
+    def test_replica_reads_do_not_cache_recent_writes(self):
+        folder = Folder.objects.create(name="folder")
+        with override_settings(DMSAPI_REPLICAS={**self.replicas, "ALIASES": ["default"]}):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch("/api/folders/%d" % folder.id, {"name": "renamed"})
+            self.client.cookies.clear()
+
+            self.assertEqual(self.client.get("/api/folders/%d" % folder.id).data["name"], "renamed")
+            self.assertIsNone(get_detail_cache().get(Folder, folder.id))
+
+            with mock.patch("dmsapi.cache.time.time", return_value=time.time() + 3):
+                self.client.get("/api/folders/%d" % folder.id)
+            self.assertEqual(get_detail_cache().get(Folder, folder.id)["name"], "renamed")
+
+
+class BenchTestCases(DmsTestCase):
+
+    def test_dataset_shapes(self):
+        wide = Dataset(shape='wide', folders=6).folder_paths()
+        self.assertEqual(wide[:2], [('bench', 'f0'), ('bench', 'f1')])
+        deep = Dataset(shape='deep', folders=5, depth=3).folder_paths()
+        self.assertEqual(len(deep), 5)
+        self.assertEqual(deep[2], ('bench', 'c0-0', 'c0-1', 'c0-2'))
+        self.assertEqual(deep[4], ('bench', 'c1-0', 'c1-1'))
+
+    def test_every_endpoint_succeeds(self):
+        self.assertEqual(unbenched_routes(endpoints()), [])
+        context = Dataset(folders=4, documents=6, topics=3, tags=10).seed_database()
+        self.assertEqual(Document.objects.filter(parent__path__startswith="/%d/" % context.root).count(), 6)
+
+        results = run_suite(context, endpoints(), iterations=2, memory_samples=1)
+        for result in results:
+            self.assertEqual([code for code in result["statuses"] if code >= "400"], [], result["endpoint"])
+            self.assertIsNotNone(result["p95_ms"])
+
+
+class InstrumentationTestCases(DmsTestCase):
+
+    def test_server_timing_and_request_log(self):
+        Folder.objects.create(name="folder")
+        with self.assertLogs("dmsapi.instrumentation", "INFO") as logs:
+            response = self.client.get("/api/folders")
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[0-9.]+;desc="2 queries, 0 duplicates", total;dur=[0-9.]+$')
+        stats = logs.records[0].request_stats
+        self.assertEqual((stats["route"], stats["status"], stats["queries"]), ("api/folders", 200, 2))
+
+    def test_slow_requests_are_logged_as_warnings(self):
+        with override_settings(DMSAPI_INSTRUMENTATION={"SLOW_REQUEST_MS": 0}):
+            with self.assertLogs("dmsapi.instrumentation", "WARNING") as logs:
+                self.client.get("/api/topics")
+        self.assertTrue(logs.output[0].startswith("WARNING:dmsapi.instrumentation:Slow request: GET /api/topics 200"))
+
+    def test_duplicate_and_similar_queries(self):
+        folders = [Folder.objects.create(name="f%d" % index) for index in range(3)]
+        with recording() as recorder:
+            for folder in folders + folders[:1]:
+                Folder.objects.get(id=folder.id)
+        self.assertEqual((recorder.count, recorder.duplicates, recorder.similar), (4, 1, 3))
+
+    def test_query_budget(self):
+        @query_budget(1)
+        def view():
+            return [Folder.objects.count(), Document.objects.count()]
+
+        with self.assertRaisesRegex(QueryBudgetExceeded, "ran 2 queries, its budget is 1"):
+            view()
+        with self.assertMaxQueries(1):
+            self.client.get("/api/jobs/0")
+
+
+class MetricsTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset_store()
+
+    def test_request_metrics(self):
+        folder = Folder.objects.create(name="folder")
+        self.client.get("/api/folders/%d" % folder.id)
+        self.client.get("/api/folders/%d" % folder.id)
+        self.client.get("/api/folders/0")
+        self.client.get("/missing")
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        labels = 'method="GET",route="/api/folders/<int:id>"'
+        self.assertIn('dmsapi_http_requests_total{%s,status="200"} 2' % labels, text)
+        self.assertIn('dmsapi_http_requests_total{%s,status="404"} 1' % labels, text)
+        self.assertIn('dmsapi_http_requests_total{method="GET",route="unmatched",status="404"} 1', text)
+        self.assertIn('dmsapi_http_request_duration_seconds_bucket{%s,le="+Inf"} 3' % labels, text)
+        self.assertIn('dmsapi_http_request_duration_seconds_count{%s} 3' % labels, text)
+        self.assertIn('dmsapi_http_requests_in_flight{route="/metrics"} 1', text)
+        self.assertIn('dmsapi_http_requests_in_flight{route="/api/folders/<int:id>"} 0', text)
+        self.assertIn('dmsapi_db_queries_total{route="/api/folders/<int:id>"} 2', text)
+        self.assertIn('dmsapi_detail_cache_lookups_total{result="hit"} 1', text)
+        self.assertIn('dmsapi_detail_cache_hit_ratio 0.3333333333333333', text)
+
+    def test_file_store_sums_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DMSAPI_METRICS={"DIRECTORY": directory}):
+                store = metrics.get_store()
+                store.inc([((metrics.REQUESTS, (("status", "200"),)), 1), ((metrics.IN_FLIGHT, ()), 1)])
+                store.inc([((metrics.REQUESTS, (("status", "200"),)), 2)])
+
+                # Files left by another process, alive or not
+                for pid in (os.getppid(), 2 ** 22 + 1):
+                    other = metrics.FileStore.__new__(metrics.FileStore)
+                    with mock.patch("dmsapi.metrics.os.getpid", return_value=pid):
+                        other.__init__(directory)
+                    other.inc([((metrics.REQUESTS, (("status", "200"),)), 4), ((metrics.IN_FLIGHT, ()), 1)])
+
+                totals = metrics.collect()
+        self.assertEqual(totals[(metrics.REQUESTS, (("status", "200"),))], 11)
+        self.assertEqual(totals[(metrics.IN_FLIGHT, ())], 2)
+
+    def test_file_store_keeps_counters_of_a_reused_pid(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DMSAPI_METRICS={"DIRECTORY": directory}):
+                for count in (4, 1):
+                    store = metrics.FileStore.__new__(metrics.FileStore)
+                    with mock.patch("dmsapi.metrics.os.getpid", return_value=2 ** 22 + 1):
+                        store.__init__(directory)
+                    store.inc([((metrics.REQUESTS, (("status", "200"),)), count)])
+
+                totals = metrics.collect()
+        self.assertEqual(totals[(metrics.REQUESTS, (("status", "200"),))], 5)
+
+
+class SchemaTestCases(DmsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        schema.reset_schema()
+        self.addCleanup(schema.reset_schema)
+
+    def test_schema_is_served_with_an_etag(self):
+        response = self.client.get("/?format=openapi")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        document = json.loads(response.content)
+        self.assertIn("/api/folders/{id}", document["paths"])
+        self.assertIn("/metrics", document["paths"])
+        self.assertNotIn("/", document["paths"])
+        self.assertEqual(document["paths"]["/api/folders/move"]["post"]["parameters"][0]["schema"]["required"], ["ids", "parent"])
+
+        with mock.patch("dmsapi.schema.generate_schema") as generate:
+            cached = self.client.get("/?format=openapi", HTTP_IF_NONE_MATCH=response["ETag"])
+        generate.assert_not_called()
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_precompiled_schema_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "openapi.json")
+            call_command("generate_schema", output=path, stdout=StringIO())
+            with open(path, "rb") as file:
+                body = file.read()
+            self.assertIn(b'"/api/search"', body)
+
+            with override_settings(DMSAPI_SCHEMA_FILE=path), mock.patch("dmsapi.schema.generate_schema") as generate:
+                response = self.client.get("/", HTTP_ACCEPT="application/json")
+        generate.assert_not_called()
+        self.assertEqual(response.content, body)
@@ -0,0 +1,342 @@
+import json
+import os
+import posixpath
+import tarfile
+import time
+import zipfile
+from io import BytesIO
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Length
+
+from .models import Folder, Document
+from .storage import blob_texts, store_content
+from .tree import apply_child_count_deltas
+
+
+NAME_MAX_LENGTH = Folder._meta.get_field('name').max_length
+IMPORT_BATCH_SIZE = 1000
+# Flush the pending documents once their bodies reach this many bytes
+IMPORT_BATCH_BYTES = 16 * 1024 * 1024
+EXPORT_CHUNK_SIZE = 500
+
+FOLDER = 'folder'
+DOCUMENT = 'document'
+
+
+class Throughput:
+    """
+    Row and byte counters of an import or export, with their rates.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.folders = 0
+        self.documents = 0
+        self.bytes = 0
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rows = self.folders + self.documents
+        return "%d folders, %d documents, %.1f MB in %.2fs (%.0f rows/s, %.2f MB/s)" % (
+            self.folders, self.documents, self.bytes / 1e6, elapsed, rows / elapsed, self.bytes / 1e6 / elapsed,
+        )
+
+
+def split_path(name):
+    """
+    Folder names of an archive member path, or None when the path leaves the
+    archive root.
+    """
+    parts = [part for part in posixpath.normpath(name.replace("\\", "/")).split("/") if part not in ("", ".")]
+    if ".." in parts:
+        return None
+    return tuple(parts)
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+def directory_entries(root):
+    """
+    ``(kind, parts, read)`` entries of a directory tree, parents first.
+    """
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        base = split_path(os.path.relpath(directory, root))
+        for name in dirnames:
+            yield FOLDER, base + (name,), None
+        for name in sorted(filenames):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield DOCUMENT, base + (name,), lambda path=path: read_file(path)
+
+def tar_entries(fileobj):
+    # Stream mode reads the archive front to back without seeking
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            parts = split_path(member.name)
+            if not parts:
+                continue
+            if member.isdir():
+                yield FOLDER, parts, None
+            elif member.isfile():
+                data = archive.extractfile(member).read()
+                yield DOCUMENT, parts, lambda data=data: data
+
+def zip_entries(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            parts = split_path(info.filename)
+            if not parts:
+                continue
+            if info.is_dir():
+                yield FOLDER, parts, None
+            else:
+                yield DOCUMENT, parts, lambda info=info: archive.read(info)
+
+def ndjson_entries(fileobj):
+    for line in fileobj:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if row["type"] == FOLDER:
+            yield FOLDER, tuple(row["path"]), None
+        else:
+            yield DOCUMENT, tuple(row["path"]), lambda content=row["content"]: content.encode()
+
+
+class TreeImporter:
+    """
+    Recreates a stream of folder and document entries below ``parent`` (a
+    folder id, or None for the top level).
+
+    Entries are buffered and written with ``bulk_create`` in batches, each in
+    its own transaction, so memory use is bounded by the batch size apart
+    from the map of imported folder ids. Pending folders are inserted one tree
+    level at a time, which lets entries come in any order. Existing folders
+    with the same name are merged into, documents whose name is already taken
+    are skipped.
+    """
+
+    def __init__(self, parent=None, batch_size=IMPORT_BATCH_SIZE, batch_bytes=IMPORT_BATCH_BYTES):
+        self.parent = parent
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.folder_ids = {(): parent}
+        self.paths = {}
+        # Folders that existed before the import, whose names may collide
+        self.existing = {parent}
+        self.pending_folders = set()
+        self.pending_documents = []
+        self.pending_bytes = 0
+        self.skipped = []
+        self.stats = Throughput()
+
+    def run(self, entries):
+        for kind, parts, read in entries:
+            if kind == FOLDER:
+                self.add_folder(parts)
+            else:
+                self.add_document(parts, read())
+        self.flush()
+        return self.stats
+
+    def skip(self, parts, reason):
+        self.skipped.append(("/".join(parts), reason))
+
+    def add_folder(self, parts):
+        if parts in self.folder_ids or parts in self.pending_folders:
+            return True
+        if len(parts[-1]) > NAME_MAX_LENGTH:
+            self.skip(parts, "name longer than %d characters" % NAME_MAX_LENGTH)
+            return False
+        if not self.add_folder(parts[:-1]):
+            return False
+        self.pending_folders.add(parts)
+        if len(self.pending_folders) >= self.batch_size:
+            self.flush()
+        return True
+
+    def add_document(self, parts, data):
+        if len(parts[-1]) > NAME_MAX_LENGTH:
+            return self.skip(parts, "name longer than %d characters" % NAME_MAX_LENGTH)
+        try:
+            text = data.decode()
+        except UnicodeDecodeError:
+            return self.skip(parts, "not UTF-8 text")
+        if "\x00" in text:
+            return self.skip(parts, "binary content")
+        if not self.add_folder(parts[:-1]):
+            return self.skip(parts, "parent folder skipped")
+
+        self.pending_documents.append((parts, text))
+        self.pending_bytes += len(data)
+        if len(self.pending_documents) >= self.batch_size or self.pending_bytes >= self.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        with transaction.atomic():
+            self.flush_folders()
+            self.flush_documents()
+
+    def taken_names(self, model, parents, names):
+        existing = [parent for parent in parents if parent in self.existing]
+        if not existing:
+            return {}
+        parent_filter = Q(parent__in=[parent for parent in existing if parent is not None])
+        if None in existing:
+            parent_filter |= Q(parent=None)
+        rows = model.objects.filter(parent_filter, name__in=names).values_list('parent', 'name', 'id')
+        return {(parent, name): id for parent, name, id in rows}
+
+    def flush_folders(self):
+        deltas = {}
+        for depth in sorted({len(parts) for parts in self.pending_folders}):
+            level = sorted(parts for parts in self.pending_folders if len(parts) == depth)
+            parents = {self.folder_ids[parts[:-1]] for parts in level}
+            taken = self.taken_names(Folder, parents, {parts[-1] for parts in level})
+            unknown = [parent for parent in parents if parent is not None and parent not in self.paths]
+            self.paths.update(Folder.objects.filter(id__in=unknown).values_list('id', 'path'))
+
+            created = []
+            for parts in level:
+                parent = self.folder_ids[parts[:-1]]
+                if (parent, parts[-1]) in taken:
+                    self.folder_ids[parts] = taken[(parent, parts[-1])]
+                    self.existing.add(self.folder_ids[parts])
+                    continue
+                path = "/" if parent is None else "%s%d/" % (self.paths[parent], parent)
+                created.append((parts, Folder(name=parts[-1], parent_id=parent, path=path)))
+
+            Folder.objects.bulk_create([folder for _, folder in created])
+            for parts, folder in created:
+                self.folder_ids[parts] = folder.id
+                self.paths[folder.id] = folder.path
+                deltas[folder.parent_id] = deltas.get(folder.parent_id, 0) + 1
+            self.stats.folders += len(created)
+
+        self.pending_folders.clear()
+        apply_child_count_deltas(Folder, deltas)
+
+    def flush_documents(self):
+        rows = [(self.folder_ids[parts[:-1]], parts, text) for parts, text in self.pending_documents]
+        taken = self.taken_names(Document, {parent for parent, _, _ in rows}, {parts[-1] for _, parts, _ in rows})
+
+        documents = []
+        seen = set()
+        for parent, parts, text in rows:
+            if (parent, parts[-1]) in taken or (parent, parts[-1]) in seen:
+                self.skip(parts, "a document with this name exists")
+                continue
+            seen.add((parent, parts[-1]))
+            documents.append(Document(name=parts[-1], parent_id=parent, content=text))
+            self.stats.bytes += len(text.encode())
+
+        store_content(documents)
+        Document.objects.bulk_create(documents)
+        deltas = {}
+        for document in documents:
+            deltas[document.parent_id] = deltas.get(document.parent_id, 0) + 1
+        apply_child_count_deltas(Document, deltas)
+
+        self.stats.documents += len(documents)
+        self.pending_documents = []
+        self.pending_bytes = 0
+
+
+class TreeExporter:
+    """
+    Streams the subtree of ``folder`` (everything when None) folder by folder
+    and then document by document, reading documents in chunks so that
+    memory use does not grow with the number or size of the documents.
+    """
+
+    def __init__(self, folder=None, chunk_size=EXPORT_CHUNK_SIZE):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.stats = Throughput()
+
+    def folders(self):
+        if self.folder is None:
+            return Folder.objects.all()
+        return Folder.objects.filter(Q(id=self.folder.id) | Q(path__startswith=self.folder.subtree_prefix))
+
+    def documents(self):
+        if self.folder is None:
+            return Document.objects.all()
+        return Document.objects.filter(Q(parent=self.folder.id) | Q(parent__path__startswith=self.folder.subtree_prefix))
+
+    def entries(self):
+        """
+        ``(kind, parts, content)`` of every folder, parents first, then of
+        every document, paths relative to the parent of the exported folder.
+        """
+        names = {}
+        for id, parent, name in self.folders().order_by(Length('path'), 'id').values_list('id', 'parent', 'name').iterator():
+            names[id] = names.get(parent, ()) + (name,) if id != getattr(self.folder, 'id', None) else (name,)
+            self.stats.folders += 1
+            yield FOLDER, names[id], None
+
+        rows = self.documents().order_by('id').values_list('parent', 'name', 'content', 'blob').iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            texts = blob_texts(blob for _, _, _, blob in chunk if blob is not None)
+            for parent, name, content, blob in chunk:
+                content = content if blob is None else texts[blob]
+                self.stats.documents += 1
+                self.stats.bytes += len(content.encode())
+                yield DOCUMENT, names.get(parent, ()) + (name,), content
+
+    def write_ndjson(self, stream):
+        for kind, parts, content in self.entries():
+            row = {"type": kind, "path": list(parts)}
+            if kind == DOCUMENT:
+                row["content"] = content
+            stream.write(json.dumps(row) + "\n")
+        return self.stats
+
+    def write_tar(self, fileobj):
+        with tarfile.open(fileobj=fileobj, mode='w|') as archive:
+            for kind, parts, content in self.entries():
+                info = tarfile.TarInfo("/".join(parts))
+                info.mtime = int(time.time())
+                if kind == FOLDER:
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                    archive.addfile(info)
+                else:
+                    data = content.encode()
+                    info.size = len(data)
+                    info.mode = 0o644
+                    archive.addfile(info, BytesIO(data))
+        return self.stats
+
+
+def import_entries(source, format):
+    """
+    Entries of ``source``, a path (or a binary file for archives) in one of
+    the 'dir', 'tar', 'zip' or 'ndjson' formats.
+    """
+    if format == 'dir':
+        return directory_entries(source)
+    if format == 'tar':
+        return tar_entries(source)
+    if format == 'zip':
+        return zip_entries(source)
+    if format == 'ndjson':
+        return ndjson_entries(source)
+    raise ValueError("Unknown format %r" % format)
+
+def guess_format(path):
+    if os.path.isdir(path):
+        return 'dir'
+    if path.endswith('.zip'):
+        return 'zip'
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'tar'
@@ -0,0 +1,98 @@
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce, Now
+
+from .cache import get_detail_cache
+from .models import Folder, Document, HAS_CHILDREN
+
+
+# Folder column counting the children of each model. Counter updates also
+# set updated_at, which backs the Last-Modified and ETag of the folders.
+CHILD_COUNTERS = {
+    Folder: 'subfolder_count',
+    Document: 'document_count',
+}
+
+def update_child_count(model, parent_id, delta):
+    if parent_id is None or delta == 0:
+        return
+
+    field = CHILD_COUNTERS[model]
+    Folder.objects.filter(id=parent_id).update(**{field: F(field) + delta}, updated_at=Now())
+    get_detail_cache().invalidate(Folder, [parent_id])
+
+def apply_child_count_deltas(model, deltas):
+    """
+    Applies ``{parent_id: delta}`` to the counters with one UPDATE per
+    distinct delta rather than one per parent.
+    """
+    field = CHILD_COUNTERS[model]
+    by_delta = {}
+    for parent_id, delta in deltas.items():
+        if parent_id is not None and delta != 0:
+            by_delta.setdefault(delta, []).append(parent_id)
+
+    for delta, parent_ids in by_delta.items():
+        Folder.objects.filter(id__in=parent_ids).update(**{field: F(field) + delta}, updated_at=Now())
+        get_detail_cache().invalidate(Folder, parent_ids)
+
+def child_count_subquery(model):
+    children = model.objects.filter(parent=OuterRef('pk')).order_by().values('parent').annotate(count=Count('id'))
+    return Coalesce(Subquery(children.values('count')), 0)
+
+def child_counts():
+    """
+    The actual child counts of a folder, by counter field, and the filter
+    of the folders whose counters differ from them.
+    """
+    counts = {field: child_count_subquery(model) for model, field in CHILD_COUNTERS.items()}
+    drifted = Q()
+    for field, count in counts.items():
+        drifted |= ~Q(**{field: count})
+    return counts, drifted
+
+def count_drifted_folders(folders=None):
+    if folders is None:
+        folders = Folder.objects.all()
+    return folders.filter(child_counts()[1]).count()
+
+def rebuild_child_counts(folders=None):
+    """
+    Recomputes the child counters of ``folders`` (all folders by default)
+    from the actual rows, in a single UPDATE.
+    """
+    if folders is None:
+        folders = Folder.objects.all()
+
+    counts, drifted = child_counts()
+    get_detail_cache().clear()
+    # Only the folders whose counters were wrong change
+    return folders.update(**counts, updated_at=Case(When(drifted, then=Now()), default=F('updated_at')))
+
+def subtree_folders(folder):
+    return Folder.objects.filter(path__startswith=folder.subtree_prefix)
+
+def subtree_documents(folder):
+    return Document.objects.filter(Q(parent=folder.id) | Q(parent__path__startswith=folder.subtree_prefix))
+
+def build_tree(folder):
+    """
+    Returns the nested subtree rooted at ``folder``.
+
+    Reads the descendants with one query per table through the materialized
+    path, whatever the depth of the tree.
+    """
+    root = {"id": folder.id, "name": folder.name, "has_children": folder.has_children}
+    nodes = {folder.id: root}
+    for node in subtree_folders(folder).values("id", "name", "parent", has_children=HAS_CHILDREN):
+        nodes[node["id"]] = node
+
+    for node in nodes.values():
+        node["folders"] = []
+        node["documents"] = []
+    for node in list(nodes.values())[1:]:
+        nodes[node.pop("parent")]["folders"].append(node)
+
+    for document in subtree_documents(folder).values("id", "name", "parent"):
+        nodes[document.pop("parent")]["documents"].append(document)
+
+    return root
@@ -1,29 +1,39 @@
 # from django.urls import include, path
 from django.urls import re_path, path
 from rest_framework import routers
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view as swagger_get_schema_view
 
-from . import views
+from . import async_views, views
+from .async_views import read_view
 
 
-schema_view = swagger_get_schema_view(
-    openapi.Info(
-        title="Spekit API",
-        default_version='1.0.0',
-        description="API documentation of Spekit App",
-    ),
-    public=True,
-)
+def api_urlpatterns(async_reads=None):
+    """
+    The API routes, with the read endpoints served by async views when
+    ``async_reads`` (by default the DMSAPI_ASYNC_READS setting) is true.
+    """
+    return [
+        path('api/folders', read_view(views.FolderView, async_views.folder_list, async_reads)),
+        path('api/folders/<int:id>', read_view(views.FolderDetailsView, async_views.folder_details, async_reads)),
+        path('api/folders/<int:id>/tree', views.FolderTreeView.as_view()),
+        path('api/folders/move', views.FolderMoveView.as_view()),
+        path('api/documents', read_view(views.DocumentView, async_views.document_list, async_reads)),
+        path('api/documents/move', views.DocumentMoveView.as_view()),
+        path('api/documents/<int:id>', read_view(views.DocumentDetailsView, async_views.document_details, async_reads)),
+        path('api/documents/<int:id>/content', views.DocumentContentView.as_view()),
+        path('api/topics', read_view(views.TopicView, async_views.topic_list, async_reads)),
+        path('api/topics/<int:id>', read_view(views.TopicDetailsView, async_views.topic_details, async_reads)),
+        path('api/search', views.SearchView.as_view()),
+        path('api/cache/stats', views.CacheStatsView.as_view()),
+        path('api/db/pool', views.DatabasePoolStatsView.as_view()),
+        path('metrics', views.MetricsView.as_view()),
+        path('api/jobs/<int:id>', views.JobDetailsView.as_view()),
+        path('api/jobs/<int:id>/cancel', views.JobCancelView.as_view()),
+        path('api/folder-topics', read_view(views.FolderTopicView, async_views.topic_folders, async_reads)),
+        path('api/folder-topics/bulk', views.FolderTopicBulkView.as_view()),
+        path('api/document-topics', read_view(views.DocumentTopicView, async_views.topic_documents, async_reads)),
+        path('api/document-topics/bulk', views.DocumentTopicBulkView.as_view()),
+    ]
 
 urlpatterns = [
-    path('', schema_view.with_ui('swagger', cache_timeout=0), name="swagger-schema"),
-    path('api/folders', views.FolderView.as_view()),
-    path('api/folders/<int:id>', views.FolderDetailsView.as_view()),
-    path('api/documents', views.DocumentView.as_view()),
-    path('api/documents/<int:id>', views.DocumentDetailsView.as_view()),
-    path('api/topics', views.TopicView.as_view()),
-    path('api/topics/<int:id>', views.TopicDetailsView.as_view()),
-    path('api/folder-topics', views.FolderTopicView.as_view()),
-    path('api/document-topics', views.DocumentTopicView.as_view()),
-]
+    path('', views.ApiDocsView.as_view(), name="swagger-schema"),
+] + api_urlpatterns()
@@ -1,14 +1,46 @@
+import re
+import time
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import BigIntegerField
+from django.db.models.functions import Coalesce
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.utils.decorators import method_decorator
-from drf_yasg.utils import swagger_auto_schema
-from drf_yasg import openapi
 
 from .serializers import FolderSerializer, DocumentSerializer, TopicSerializer, FolderTopicSerializer, DocumentTopicSerializer
-from .models import Folder, Document, Topic, FolderTopic, DocumentTopic
+from .serializers import BulkFolderTopicSerializer, BulkDocumentTopicSerializer, ContentPatchSerializer, JobSerializer, MoveSerializer
+from .models import Folder, Document, Topic, FolderTopic, DocumentTopic, Job
+from .pagination import IdCursorPagination
+from .bulk import BULK_MAX_ITEMS, bulk_create, bulk_tag
+from .cache import get_detail_cache
+from .conditional import Validators, aggregate_state, aggregate_validators, detail_validators, is_conditional, latest, load_detail_validators, tag_state, validator_fields
+from .deletion import SubtreeDeletion
+from .delta import OpsOutOfRange, StaleBase, patch_document_content
+from . import jobs, metrics
+from .fieldsets import detail_columns, list_values, requested_fields
+from .instrumentation import query_budget
+from .functions import ByteLength, ByteSubstr
+from .move import MoveError, move_nodes
+from .negotiation import IgnoreClientContentNegotiation
+from .pool import pool_stats
+from .routers import is_replica, replica_reads
+from .search import search_documents
+from .storage import blob_texts
+from .tree import CHILD_COUNTERS, build_tree, subtree_documents, subtree_folders, update_child_count
+
+
+STREAM_CHUNK_SIZE = 2000
+CONTENT_CHUNK_SIZE = 256 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
 
 
 def create(data, model, serializer_class, check_parent=False):
@@ -21,51 +53,280 @@ def create(data, model, serializer_class, check_parent=False):
                 return Response([{"message": "Name duplication not allowed"}], status=status.HTTP_400_BAD_REQUEST)
 
     if ser.is_valid():
-        ser.save()
-
-        if check_parent and data.get('parent') is not None:
-            parent = Folder.objects.get(id=data.get('parent'))
-            parent.has_children = True
-            parent.save()
+        with transaction.atomic():
+            ser.save()
+            if check_parent:
+                update_child_count(model, ser.instance.parent_id, 1)
 
         return Response(ser.data, status=status.HTTP_201_CREATED)
     return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
 
-def get_all(model):
-    data = model.objects.values("id", "name")
-    # serializer = serializer_class(data, many=True)
+def parse_range(header, size):
+    """
+    Returns the ``(first, last)`` byte positions of a single-range ``Range``
+    header, None when the header should be ignored, or False when the range
+    cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or "")
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first > last or first >= size:
+        return False
+    return first, last
+
+def stream_bytes(data):
+    for position in range(0, len(data), CONTENT_CHUNK_SIZE):
+        yield data[position:position + CONTENT_CHUNK_SIZE]
+
+def get_content(request, id):
+    try:
+        state = Document.objects.values("updated_at", "blob", size=Coalesce(ByteLength("content"), "blob__size", output_field=BigIntegerField())).get(id=id)
+    except Document.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
 
-    return Response(list(data), status=status.HTTP_200_OK)
+    size = state["size"]
+    validators = Validators("content", id, state["updated_at"], last_modified=state["updated_at"])
+    not_modified = validators.conditional_response(request)
+    if not_modified is not None:
+        return not_modified
+
+    byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range is not None and if_range != validators.etag:
+        byte_range = None
+    if byte_range is False:
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response["Content-Range"] = "bytes */%d" % size
+        return response
+
+    # The body is read once here, the response only slices it: a substring
+    # per chunk would encode the whole text again for each of them
+    first, last = byte_range or (0, size - 1)
+    if state["blob"] is not None:
+        # Compressed bodies cannot be read by range, inflate once and slice
+        data = blob_texts([state["blob"]])[state["blob"]].encode()[first:last + 1]
+    else:
+        data = (
+            Document.objects.filter(id=id, updated_at=state["updated_at"])
+            .values_list(ByteSubstr('content', first + 1, last - first + 1), flat=True)
+            .first()
+        )
+        if data is None:
+            # Deleted or rewritten since its size was read, start over
+            return get_content(request, id)
+    response = StreamingHttpResponse(
+        stream_bytes(bytes(data)),
+        content_type="text/plain; charset=utf-8",
+        status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+    )
+    response["Content-Length"] = str(last - first + 1)
+    response["Accept-Ranges"] = "bytes"
+    if byte_range:
+        response["Content-Range"] = "bytes %d-%d/%d" % (first, last, size)
+    return validators.apply(response)
+
+def patch_content(request, id):
+    ser = ContentPatchSerializer(data=request.data)
+    if not ser.is_valid():
+        return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
 
-def get_one(id, model, serializer_class):
     try:
-        obj = model.objects.get(id=id)
-    except model.DoesNotExist:
+        updated_at = Document.objects.values_list("updated_at", flat=True).get(id=id)
+    except Document.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-    serializer = serializer_class(obj)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    base = ser.validated_data.get('base')
+    if base is None and "HTTP_IF_MATCH" not in request.META:
+        return Response([{"message": "Either 'base' or an If-Match header is required"}], status=status.HTTP_428_PRECONDITION_REQUIRED)
+    validators = Validators("content", id, updated_at, last_modified=updated_at)
+    if (base is not None and base != updated_at) or validators.conditional_response(request) is not None:
+        return Response([{"message": "The document changed since the base version"}], status=status.HTTP_412_PRECONDITION_FAILED)
 
-def delete_one(data, model, has_parent=False):
     try:
-        obj = model.objects.get(id=data.get('id'))
-    except model.DoesNotExist:
+        updated_at = patch_document_content(id, updated_at, ser.validated_data['ops'])
+    except Document.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
+    except StaleBase:
+        return Response([{"message": "The document changed since the base version"}], status=status.HTTP_412_PRECONDITION_FAILED)
+    except OpsOutOfRange:
+        return Response([{"message": "Operations go past the end of the content"}], status=status.HTTP_400_BAD_REQUEST)
+
+    validators = Validators("content", id, updated_at, last_modified=updated_at)
+    return validators.apply(Response({"id": id, "updated_at": updated_at}, status=status.HTTP_200_OK))
+
+def create_many(data, model):
+    if len(data) > BULK_MAX_ITEMS:
+        return Response([{"message": "At most %d items can be created at once" % BULK_MAX_ITEMS}], status=status.HTTP_400_BAD_REQUEST)
+
+    results = bulk_create(data, model)
+    if results is None:
+        return Response([{"message": "Conflicting concurrent write, nothing was created"}], status=status.HTTP_409_CONFLICT)
+
+    failed = sum(1 for result in results if result["status"] != status.HTTP_201_CREATED)
+    if failed == 0:
+        return Response(results, status=status.HTTP_201_CREATED)
+    if failed == len(results):
+        return Response(results, status=status.HTTP_400_BAD_REQUEST)
+    return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+def tag_many(data, model, serializer_class, target_field):
+    ser = serializer_class(data=data)
+    if not ser.is_valid():
+        return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    add, remove = ser.validated_data['add'], ser.validated_data['remove']
+    if len(add) + len(remove) > BULK_MAX_ITEMS:
+        return Response([{"message": "At most %d pairs can be changed at once" % BULK_MAX_ITEMS}], status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(bulk_tag(add, remove, model, target_field), status=status.HTTP_200_OK)
+
+def stream_rows(queryset, mode):
+    encoder = DjangoJSONEncoder()
+    rows = (encoder.encode(row) for row in queryset.iterator(chunk_size=STREAM_CHUNK_SIZE))
+    chunks = iter(lambda: list(islice(rows, STREAM_CHUNK_SIZE)), [])
+
+    if mode == 'ndjson':
+        for chunk in chunks:
+            yield "\n".join(chunk) + "\n"
+        return
+
+    prefix = "["
+    for chunk in chunks:
+        yield prefix + ",".join(chunk)
+        prefix = ","
+    yield "[]" if prefix == "[" else "]"
+
+def stream_response(queryset, mode):
+    # The rows are read after the view returned, from the database chosen now
+    queryset = queryset.using(queryset.db)
+    response = StreamingHttpResponse(stream_rows(queryset, mode), content_type=STREAM_CONTENT_TYPES[mode])
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def list_response(request, queryset, state=None):
+    """
+    Serves the rows of ``queryset`` as a list, page or stream with an ETag.
+    ``state`` returns the state of anything else the list depends on.
+    """
+    parts = lambda: () if state is None else state()
+    mode = request.query_params.get('stream')
+    if mode is not None:
+        if mode not in STREAM_CONTENT_TYPES:
+            return Response([{"message": "Parameter 'stream' must be one of: ndjson, json"}], status=status.HTTP_400_BAD_REQUEST)
+        if not is_conditional(request):
+            # Aggregating a huge export would hold back its first byte
+            return stream_response(queryset, mode)
+        validators = aggregate_validators(request, queryset, *parts())
+        return validators.conditional_response(request) or validators.apply(stream_response(queryset, mode))
+
+    paginator = IdCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    if page is None:
+        validators = aggregate_validators(request, queryset, *parts())
+        return validators.conditional_response(request) or validators.apply(Response(list(queryset), status=status.HTTP_200_OK))
+
+    # Validate only the id window of the page so deep pages stay cheap
+    ids = [row["id"] for row in page]
+    window = queryset.filter(id__gte=min(ids), id__lte=max(ids)) if ids else queryset.none()
+    validators = aggregate_validators(request, window, paginator.get_next_link(), paginator.get_previous_link(), *parts())
+    return validators.conditional_response(request) or validators.apply(paginator.get_paginated_response(page))
+
+@replica_reads()
+def get_all(request, model, serializer_class):
+    data = list_values(model.objects.all(), requested_fields(request, serializer_class, listing=True))
+    # serializer = serializer_class(data, many=True)
 
-    if has_parent:
-        parent = obj.parent
+    return list_response(request, data)
+
+@replica_reads()
+def get_one(request, id, model, serializer_class, fields=None):
+    """
+    Serves a detail payload, from the cache when possible. When ``fields``
+    is given only those fields (and the columns backing the validators) are
+    read from the database.
+    """
+    cache = get_detail_cache()
+    missed_at = time.time()
+    data = cache.get(model, id)
+    parts = () if fields is None else (",".join(fields),)
+
+    if data is None and is_conditional(request):
+        try:
+            validators = load_detail_validators(model, id, serializer_class, *parts)
+        except model.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        not_modified = validators.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+
+    if data is None:
+        if fields is None:
+            try:
+                obj = model.objects.get(id=id)
+            except model.DoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            data = dict(serializer_class(obj).data)
+            cache.set(model, id, data, missed_at, from_replica=is_replica(obj._state.db))
+        else:
+            loaded = set(fields) | set(validator_fields(model))
+            try:
+                obj = model.objects.only(*detail_columns(model, loaded)).get(id=id)
+            except model.DoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            data = dict(serializer_class(obj, fields=loaded).data)
+
+    validators = detail_validators(model, id, data, *parts)
+    not_modified = validators.conditional_response(request)
+    if not_modified is not None:
+        return not_modified
+
+    if fields is not None:
+        data = {name: data[name] for name in fields}
+    return validators.apply(Response(data, status=status.HTTP_200_OK))
 
-    obj.delete()
+def delete_one(data, model, has_parent=False):
+    with transaction.atomic():
+        # Locked, so that concurrent deletes of the row decrement its parent once
+        try:
+            obj = model.objects.select_for_update().get(id=data.get('id'))
+        except model.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
 
-    if has_parent and parent is not None:
-        subfolders = Folder.objects.filter(parent=parent.id)
-        files = Document.objects.filter(parent=parent.id)
-        if len(subfolders) == 0 and len(files) == 0:
-            parent.has_children = False
-            parent.save()
+        obj.delete()
+        if has_parent:
+            update_child_count(model, obj.parent_id, -1)
 
     return Response({}, status=status.HTTP_200_OK)
 
+def job_accepted(job):
+    response = Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+    response["Location"] = "/api/jobs/%d" % job.id
+    return response
+
+def delete_folder(request):
+    """
+    Deletes a folder and its subtree with set-based batches, or in the
+    background when ``async`` is true.
+    """
+    try:
+        folder = Folder.objects.only("id", "parent", "path").get(id=request.data.get('id'))
+    except Folder.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    if str(request.data.get("async", request.GET.get("async", ""))).lower() in ('true', '1'):
+        return job_accepted(jobs.submit('delete_subtree', folder=folder.id))
+
+    SubtreeDeletion(folder).run()
+    return Response({}, status=status.HTTP_200_OK)
+
 def patch_record(data, id, model, serializer_class):
     try:
         obj = model.objects.get(id=id)
@@ -74,337 +335,148 @@ def patch_record(data, id, model, serializer_class):
 
     serializer = serializer_class(obj, data=data, partial=True)
     if serializer.is_valid():
-        serializer.save()
+        parent = serializer.validated_data.get('parent', None)
+        parent_id = parent.id if parent is not None else None
+        try:
+            with transaction.atomic():
+                if model in CHILD_COUNTERS and 'parent' in serializer.validated_data and parent_id != obj.parent_id:
+                    move_nodes(model, [obj.id], parent_id)
+                    obj.refresh_from_db()
+                serializer.save()
+        except MoveError as error:
+            return Response([{"message": error.message}], status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def move_many(data, model):
+    ser = MoveSerializer(data=data)
+    if not ser.is_valid():
+        return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+    if len(ser.validated_data['ids']) > BULK_MAX_ITEMS:
+        return Response([{"message": "At most %d items can be moved at once" % BULK_MAX_ITEMS}], status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        moved = move_nodes(model, ser.validated_data['ids'], ser.validated_data['parent'])
+    except MoveError as error:
+        return Response([{"message": error.message}], status=status.HTTP_400_BAD_REQUEST)
+    return Response({"moved": moved}, status=status.HTTP_200_OK)
+
 
 # Create your views here.
 class FolderView(APIView):
     serializer_class = FolderSerializer
 
-    @method_decorator(name='post', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['name'],
-            properties={
-                'name': openapi.Schema(type=openapi.TYPE_STRING),
-                'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN)
-            }
-        ),
-        responses={
-            201: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
     def post(self, request):
+        if isinstance(request.data, list):
+            return create_many(request.data, Folder)
         return create(request.data, Folder, self.serializer_class, check_parent=True)
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_ARRAY,
-                items=openapi.Items(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                        'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    }
-                )
-            )
-        }
-    ))
+    @query_budget(2)
     def get(self, request):
-        return get_all(Folder)
-
-    @method_decorator(name='delete', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['id'],
-            properties={
-                'id': openapi.Schema(type=openapi.TYPE_INTEGER)
-            }
-        ),
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={}
-            )
-        }
-    ))
+        return get_all(request, Folder, self.serializer_class)
+
     def delete(self, request, format=None):
-        return delete_one(request.data, Folder, has_parent=True)
+        return delete_folder(request)
+
+
+class FolderMoveView(APIView):
+
+    def post(self, request):
+        return move_many(request.data, Folder)
 
 
 class FolderDetailsView(APIView):
     serializer_class = FolderSerializer
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'id', openapi.IN_QUERY,
-                description=("Folder id whose details are required as output"),
-                type=openapi.TYPE_INTEGER,
-                required=True
-            )
-        ],
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
+    @query_budget(2)
     def get(self, request, id):
-        return get_one(id, Folder, self.serializer_class)
-
-    @method_decorator(name='patch', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'id', openapi.IN_QUERY,
-                description=("Folder id whose details are to be modified"),
-                type=openapi.TYPE_INTEGER,
-                required=True
-            )
-        ],
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=[],
-            properties={
-                'name': openapi.Schema(type=openapi.TYPE_STRING),
-                'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN)
-            }
-        ),
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'has_children': openapi.Schema(type=openapi.TYPE_BOOLEAN),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
+        return get_one(request, id, Folder, self.serializer_class, requested_fields(request, self.serializer_class))
+
     def patch(self, request, id):
         return patch_record(request.data, id, Folder, self.serializer_class)
 
 
+class FolderTreeView(APIView):
+
+    @query_budget(5)
+    def get(self, request, id):
+        try:
+            folder = Folder.objects.get(id=id)
+        except Folder.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        folders = aggregate_state(subtree_folders(folder))
+        documents = aggregate_state(subtree_documents(folder))
+        # Removing a row below the folder updates the counters, and so the
+        # updated_at, of its parent
+        validators = Validators(
+            request.get_full_path(), folder.updated_at, folder.subfolder_count, folder.document_count, *folders, *documents,
+            last_modified=latest(folder.updated_at, folders[2], documents[2]),
+        )
+
+        return validators.conditional_response(request) or validators.apply(Response(build_tree(folder), status=status.HTTP_200_OK))
+
+
 class DocumentView(APIView):
     serializer_class = DocumentSerializer
 
-    @method_decorator(name='post', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['name'],
-            properties={
-                'name': openapi.Schema(type=openapi.TYPE_STRING),
-                'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'content': openapi.Schema(type=openapi.TYPE_STRING)
-            }
-        ),
-        responses={
-            201: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'content': openapi.Schema(type=openapi.TYPE_STRING),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
     def post(self, request):
+        if isinstance(request.data, list):
+            return create_many(request.data, Document)
         return create(request.data, Document, self.serializer_class, check_parent=True)
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_ARRAY,
-                items=openapi.Items(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                        'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    }
-                )
-            )
-        }
-    ))
+    @query_budget(2)
     def get(self, request):
-        return get_all(Document)
-
-    @method_decorator(name='delete', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['id'],
-            properties={
-                'id': openapi.Schema(type=openapi.TYPE_INTEGER)
-            }
-        ),
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={}
-            )
-        }
-    ))
+        return get_all(request, Document, self.serializer_class)
+
+    @query_budget(6)
     def delete(self, request, format=None):
         return delete_one(request.data, Document, has_parent=True)
 
 
+class DocumentMoveView(APIView):
+
+    def post(self, request):
+        return move_many(request.data, Document)
+
+
 class DocumentDetailsView(APIView):
     serializer_class = DocumentSerializer
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'id', openapi.IN_QUERY,
-                description=("Document id whose details are required as output"),
-                type=openapi.TYPE_INTEGER,
-                required=True
-            )
-        ],
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'content': openapi.Schema(type=openapi.TYPE_STRING),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
+    # Validators, row and the blob holding its content on a stale conditional miss
+    @query_budget(3)
     def get(self, request, id):
-        return get_one(id, Document, self.serializer_class)
-
-    @method_decorator(name='patch', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'id', openapi.IN_QUERY,
-                description=("Document id whose details are to be modified"),
-                type=openapi.TYPE_INTEGER,
-                required=True
-            )
-        ],
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=[],
-            properties={
-                'name': openapi.Schema(type=openapi.TYPE_STRING),
-                'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'content': openapi.Schema(type=openapi.TYPE_STRING)
-            }
-        ),
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'parent': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'content': openapi.Schema(type=openapi.TYPE_STRING),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
+        fields = requested_fields(request, self.serializer_class)
+        if request.GET.get("content", None) in ('false', '0'):
+            fields = tuple(name for name in fields or self.serializer_class().fields if name != 'content')
+        return get_one(request, id, Document, self.serializer_class, fields)
+
     def patch(self, request, id):
         return patch_record(request.data, id, Document, self.serializer_class)
 
 
+class DocumentContentView(APIView):
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    @query_budget(2)
+    def get(self, request, id):
+        return get_content(request, id)
+
+    def patch(self, request, id):
+        return patch_content(request, id)
+
+
 class TopicView(APIView):
     serializer_class = TopicSerializer
 
-    @method_decorator(name='post', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['name', 'short_desc'],
-            properties={
-                'name': openapi.Schema(type=openapi.TYPE_STRING),
-                'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                'long_desc': openapi.Schema(type=openapi.TYPE_STRING)
-            }
-        ),
-        responses={
-            201: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                    'long_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
     def post(self, request):
         return create(request.data, Topic, self.serializer_class)
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_ARRAY,
-                items=openapi.Items(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                        'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    }
-                )
-            )
-        }
-    ))
+    @query_budget(2)
     def get(self, request):
-        return get_all(Topic)
-
-    @method_decorator(name='delete', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['id'],
-            properties={
-                'id': openapi.Schema(type=openapi.TYPE_INTEGER)
-            }
-        ),
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={}
-            )
-        }
-    ))
+        return get_all(request, Topic, self.serializer_class)
+
     def delete(self, request, format=None):
         return delete_one(request.data, Folder)
 
@@ -412,213 +484,167 @@ class TopicView(APIView):
 class TopicDetailsView(APIView):
     serializer_class = TopicSerializer
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'id', openapi.IN_QUERY,
-                description=("Topic id whose details are required as output"),
-                type=openapi.TYPE_INTEGER,
-                required=True
-            )
-        ],
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                    'long_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
+    @query_budget(2)
     def get(self, request, id):
-        return get_one(id, Topic, self.serializer_class)
-
-    @method_decorator(name='patch', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'id', openapi.IN_QUERY,
-                description=("Topic id whose details are to be modified"),
-                type=openapi.TYPE_INTEGER,
-                required=True
-            )
-        ],
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=[],
-            properties={
-                'name': openapi.Schema(type=openapi.TYPE_STRING),
-                'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                'long_desc': openapi.Schema(type=openapi.TYPE_STRING)
-            }
-        ),
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    'short_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                    'long_desc': openapi.Schema(type=openapi.TYPE_STRING),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
+        return get_one(request, id, Topic, self.serializer_class, requested_fields(request, self.serializer_class))
+
     def patch(self, request, id):
         return patch_record(request.data, id, Topic, self.serializer_class)
 
 
+class SearchView(APIView):
+
+    @query_budget(3)
+    def get(self, request):
+        query = request.GET.get("q", "").strip()
+        if not query:
+            return Response([{"message": "Parameter 'q' is required"}], status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(int(request.GET.get("limit", 20)), 100)
+            folder_id = request.GET.get("folder", None)
+            folder_id = int(folder_id) if folder_id is not None else None
+        except ValueError:
+            return Response([{"message": "Parameters 'limit' and 'folder' must be integers"}], status=status.HTTP_400_BAD_REQUEST)
+
+        topic_id = folder = None
+        try:
+            if request.GET.get("topic_name", None) is not None:
+                topic_id = Topic.objects.values_list("id", flat=True).get(name=request.GET.get("topic_name"))
+            if folder_id is not None:
+                folder = Folder.objects.only("id", "path").get(id=folder_id)
+        except (Topic.DoesNotExist, Folder.DoesNotExist):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        return Response(search_documents(query, topic_id, folder, max(limit, 1)), status=status.HTTP_200_OK)
+
+
+class JobDetailsView(APIView):
+    serializer_class = JobSerializer
+
+    @query_budget(1)
+    def get(self, request, id):
+        try:
+            job = Job.objects.get(id=id)
+        except Job.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(self.serializer_class(job).data, status=status.HTTP_200_OK)
+
+
+class JobCancelView(APIView):
+
+    def post(self, request, id):
+        job = jobs.cancel(id)
+        if job is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+class CacheStatsView(APIView):
+
+    def get(self, request):
+        return Response(get_detail_cache().stats(), status=status.HTTP_200_OK)
+
+
+class DatabasePoolStatsView(APIView):
+
+    def get(self, request):
+        # Counters of the pools of this worker process, keyed by database alias
+        return Response(pool_stats(), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+class ApiDocsView(APIView):
+    """
+    Swagger UI, and with ``?format=openapi`` (or an Accept header asking for
+    JSON) the OpenAPI document it loads, generated once per process.
+    """
+    # Left out of the document it serves
+    swagger_schema = None
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request):
+        # drf_yasg is only imported once the docs are asked for
+        from .schema import get_schema, render_ui
+
+        accept = request.headers.get('Accept', '')
+        if request.GET.get('format') != 'openapi' and ('text/html' in accept or 'json' not in accept):
+            return HttpResponse(render_ui(request), content_type='text/html; charset=utf-8')
+
+        schema = get_schema()
+        not_modified = schema.validators.conditional_response(request)
+        if not_modified is not None:
+            return not_modified
+        response = HttpResponse(schema.body, content_type='application/openapi+json; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        return schema.validators.apply(response)
+
+
 class FolderTopicView(APIView):
     serializer_class = FolderTopicSerializer
 
-    @method_decorator(name='post', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['folder', 'topic'],
-            properties={
-                'folder': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'topic': openapi.Schema(type=openapi.TYPE_INTEGER)
-            }
-        ),
-        responses={
-            201: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'folder': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'topic': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
     def post(self, request):
         return create(request.data, FolderTopic, self.serializer_class)
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'topic_name', openapi.IN_QUERY,
-                description=("Topic name whose associated folders are required in the output"),
-                type=openapi.TYPE_STRING,
-                required=True
-            )
-        ],
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_ARRAY,
-                items=openapi.Items(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                        'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    }
-                )
-            )
-        }
-    ))
+    @replica_reads()
+    @query_budget(4)
     def get(self, request):
         topic_name = request.GET.get("topic_name", None)
         if topic_name is None:
             return Response([{"message": "Parameter 'topic_name' is required"}], status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            obj = Topic.objects.get(name=topic_name)
+            topic_id = Topic.objects.values_list("id", flat=True).get(name=topic_name)
         except Topic.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        folder_topics = FolderTopic.objects.filter(topic=obj.id)
-        id_set = []
-        for folder_topic in folder_topics:
-            id_set.append(folder_topic.folder.id)
-        folders = Folder.objects.values("id", "name").filter(id__in=id_set)
+        folders = list_values(Folder.objects.filter(foldertopic__topic=topic_id), requested_fields(request, FolderSerializer, listing=True))
 
-        return Response(list(folders), status=status.HTTP_200_OK)
+        return list_response(request, folders, lambda: tag_state(FolderTopic, topic_id))
+
+
+class FolderTopicBulkView(APIView):
+    serializer_class = BulkFolderTopicSerializer
+
+    def post(self, request):
+        return tag_many(request.data, FolderTopic, self.serializer_class, 'folder')
 
 
 class DocumentTopicView(APIView):
     serializer_class = DocumentTopicSerializer
 
-    @method_decorator(name='post', decorator=swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['document', 'topic'],
-            properties={
-                'document': openapi.Schema(type=openapi.TYPE_INTEGER),
-                'topic': openapi.Schema(type=openapi.TYPE_INTEGER)
-            }
-        ),
-        responses={
-            201: openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'document': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'topic': openapi.Schema(type=openapi.TYPE_INTEGER),
-                    'created_at': openapi.Schema(type=openapi.TYPE_STRING),
-                    'updated_at': openapi.Schema(type=openapi.TYPE_STRING),
-                }
-            )
-        }
-    ))
     def post(self, request):
         return create(request.data, DocumentTopic, self.serializer_class)
 
-    @method_decorator(name='get', decorator=swagger_auto_schema(
-        manual_parameters=[
-            openapi.Parameter(
-                'topic_name', openapi.IN_QUERY,
-                description=("Topic name whose associated documents are required in the output"),
-                type=openapi.TYPE_STRING,
-                required=True
-            ),
-            openapi.Parameter(
-                'folder_name', openapi.IN_QUERY,
-                description=("Folder name whose documents are required in the output"),
-                type=openapi.TYPE_STRING,
-                required=False
-            )
-        ],
-        responses={
-            200: openapi.Schema(
-                type=openapi.TYPE_ARRAY,
-                items=openapi.Items(
-                    type=openapi.TYPE_OBJECT,
-                    properties={
-                        'id': openapi.Schema(type=openapi.TYPE_INTEGER),
-                        'name': openapi.Schema(type=openapi.TYPE_STRING),
-                    }
-                )
-            )
-        }
-    ))
+    @replica_reads()
+    @query_budget(5)
     def get(self, request):
         topic_name = request.GET.get("topic_name", None)
         if topic_name is None:
             return Response([{"message": "Parameter 'topic_name' is required"}], status=status.HTTP_400_BAD_REQUEST)
 
+        folder_name = request.GET.get("folder_name", None)
         try:
-            topic_obj = Topic.objects.get(name=topic_name)
-            folder_obj = None
-            if request.GET.get("folder_name", None) is not None:
-                folder_obj = Folder.objects.get(name=request.GET.get("folder_name"))
-        except (Topic.DoesNotExist, Folder.DoesNotExist) as e:
+            topic_id = Topic.objects.values_list("id", flat=True).get(name=topic_name)
+        except Topic.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if folder_name is not None and not Folder.objects.filter(name=folder_name).exists():
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        document_topics = DocumentTopic.objects.filter(topic=topic_obj.id)
-        id_set = []
-        for document_topic in document_topics:
-            id_set.append(document_topic.document.id)
-        if folder_obj:
-            documents = Document.objects.values("id", "name").filter(id__in=id_set, parent=folder_obj.id)
-        else:
-            documents = Document.objects.values("id", "name").filter(id__in=id_set)
+        documents = list_values(Document.objects.filter(documenttopic__topic=topic_id), requested_fields(request, DocumentSerializer, listing=True))
+        if folder_name is not None:
+            documents = documents.filter(parent__name=folder_name)
+
+        return list_response(request, documents, lambda: tag_state(DocumentTopic, topic_id))
 
-        return Response(list(documents), status=status.HTTP_200_OK)
+
+class DocumentTopicBulkView(APIView):
+    serializer_class = BulkDocumentTopicSerializer
+
+    def post(self, request):
+        return tag_many(request.data, DocumentTopic, self.serializer_class, 'document')